@@ -4,9 +4,8 @@ from flask_login import current_user
 from flask_wtf import FlaskForm
 from wtforms import PasswordField, StringField, SubmitField, TextAreaField
 from wtforms.validators import DataRequired, Email, EqualTo, Length, ValidationError
-from sqlalchemy import func
 
-from app.models import User
+from app.utils.identity import find_user_by_email, find_user_by_username
 
 
 def username_validator(_, field):
@@ -33,14 +32,14 @@ class RegistrationForm(FlaskForm):
         username = (field.data or "").strip().lower().lstrip("@")
         if not username:
             raise ValidationError("Username is required.")
-        existing = User.query.filter(func.lower(User.username).in_([username, f"@{username}"])).first()
+        existing = find_user_by_username(username)
         if existing:
             raise ValidationError("Username already taken.")
         field.data = username
 
     def validate_email(self, field):
         email = (field.data or "").strip().lower()
-        existing = User.query.filter(func.lower(User.email) == email).first()
+        existing = find_user_by_email(email)
         if existing:
             raise ValidationError("Email already registered.")
         field.data = email
@@ -75,7 +74,7 @@ class ProfileForm(FlaskForm):
         if not username:
             raise ValidationError("Username is required.")
         if username != self.original_username_lower:
-            existing = User.query.filter(func.lower(User.username).in_([username, f"@{username}"])).first()
+            existing = find_user_by_username(username)
             if existing and existing.username.lower().lstrip("@") != self.original_username_lower:
                 raise ValidationError("Username already taken.")
         field.data = username
@@ -83,7 +82,7 @@ class ProfileForm(FlaskForm):
     def validate_email(self, field):
         email = (field.data or "").strip().lower()
         if email != self.original_email_lower:
-            existing = User.query.filter(func.lower(User.email) == email).first()
+            existing = find_user_by_email(email)
             if existing and existing.email.lower() != self.original_email_lower:
                 raise ValidationError("Email already registered.")
         field.data = email
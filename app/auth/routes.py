@@ -1,13 +1,16 @@
 from datetime import datetime
 
-from flask import Blueprint, flash, redirect, render_template, request, url_for
+from flask import Blueprint, abort, flash, redirect, render_template, request, url_for
 from flask_login import current_user, login_required, login_user, logout_user
-from sqlalchemy import func
 
-from app import db, socketio
+from app import db
 from app.auth.forms import ChangePasswordForm, LoginForm, ProfileForm, RegistrationForm
+from app.chat import outbox
 from app.models import Avatar, FriendRequest, Friendship, User
+from app.utils.identity import find_user_by_email, find_user_by_username
+from app.utils.replica import replica_reads
 from app.utils.storage import save_avatar
+from app.utils.user_cache import user_cards
 
 auth_bp = Blueprint("auth", __name__, url_prefix="/auth")
 
@@ -41,16 +44,12 @@ def login():
     form = LoginForm()
     if form.validate_on_submit():
         identifier = (form.username.data or "").strip()
-        lookup_value = identifier.lower()
         user = None
 
         if "@" in identifier and not identifier.startswith("@"):
-            user = User.query.filter(func.lower(User.email) == lookup_value).first()
+            user = find_user_by_email(identifier)
         else:
-            normalized_username = lookup_value.lstrip("@")
-            user = User.query.filter(
-                func.lower(User.username).in_([normalized_username, f"@{normalized_username}"])
-            ).first()
+            user = find_user_by_username(identifier)
 
         if not user or not user.check_password(form.password.data):
             flash("Invalid username or password", "danger")
@@ -119,9 +118,9 @@ def profile():
                 db.session.flush()
                 current_user.avatar = avatar
 
-        db.session.commit()
+        db.session.flush()
         if current_user.avatar_url:
-            socketio.emit(
+            outbox.publish(
                 "profile:avatar-updated",
                 {
                     "user_id": current_user.id,
@@ -129,6 +128,8 @@ def profile():
                 },
                 room=f"user_{current_user.id}",
             )
+        db.session.commit()
+        user_cards.bump(current_user.id)
         flash("Profile updated", "success")
         return redirect(url_for("auth.profile"))
 
@@ -146,34 +147,34 @@ def profile():
 @auth_bp.route("/profile/<username>")
 @login_required
 def public_profile(username):
-    normalized = (username or "").strip().lower().lstrip("@")
-    profile_user = User.query.filter(
-        func.lower(User.username).in_([normalized, f"@{normalized}"])
-    ).first_or_404()
-    is_self = profile_user.id == current_user.id
-    friend_status = "self" if is_self else "none"
-    incoming_request = None
-    outgoing_request = None
-    if not is_self:
-        is_friend = bool(
-            Friendship.query.filter_by(user_id=current_user.id, friend_id=profile_user.id).first()
-            and Friendship.query.filter_by(user_id=profile_user.id, friend_id=current_user.id).first()
-        )
-        if is_friend:
-            friend_status = "friends"
-        else:
-            incoming_request = FriendRequest.query.filter_by(
-                sender_id=profile_user.id, receiver_id=current_user.id, status="pending"
-            ).first()
-            outgoing_request = FriendRequest.query.filter_by(
-                sender_id=current_user.id, receiver_id=profile_user.id, status="pending"
-            ).first()
-            if incoming_request:
-                friend_status = "incoming"
-            elif outgoing_request:
-                friend_status = "outgoing"
+    with replica_reads():
+        profile_user = find_user_by_username(username)
+        if profile_user is None:
+            abort(404)
+        is_self = profile_user.id == current_user.id
+        friend_status = "self" if is_self else "none"
+        incoming_request = None
+        outgoing_request = None
+        if not is_self:
+            is_friend = bool(
+                Friendship.query.filter_by(user_id=current_user.id, friend_id=profile_user.id).first()
+                and Friendship.query.filter_by(user_id=profile_user.id, friend_id=current_user.id).first()
+            )
+            if is_friend:
+                friend_status = "friends"
             else:
-                friend_status = "none"
+                incoming_request = FriendRequest.query.filter_by(
+                    sender_id=profile_user.id, receiver_id=current_user.id, status="pending"
+                ).first()
+                outgoing_request = FriendRequest.query.filter_by(
+                    sender_id=current_user.id, receiver_id=profile_user.id, status="pending"
+                ).first()
+                if incoming_request:
+                    friend_status = "incoming"
+                elif outgoing_request:
+                    friend_status = "outgoing"
+                else:
+                    friend_status = "none"
     return render_template(
         "auth/public_profile.html",
         profile_user=profile_user,
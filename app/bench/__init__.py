@@ -0,0 +1 @@
+"""Benchmarks and load tests for NovaTalk, run as ``python -m app.bench.<tool>``."""
@@ -0,0 +1,516 @@
+"""Socket.IO load test with simulated clients.
+
+    python -m app.bench.load --clients 1000 --duration 60 --output load.json
+
+The harness creates ``--clients`` users (``load0``, ``load1``, …) in the
+database, each in a group chat of ``--group-size`` members and a direct chat
+with a friend, then starts the app on eventlet's WSGI server as the
+production ``gunicorn -k eventlet`` worker does. Simulated clients run as
+green threads spread over ``--processes`` worker processes. Each logs in over
+HTTP, connects with the websocket transport, sends ``initialize`` and then
+picks actions from ``--mix`` until the run ends, with an exponentially
+distributed think time between them. Load users get a deliberately cheap
+password hash so logins do not dominate the ramp-up. Ack latency is recorded per action;
+delivery latency is the time from a ``send_message`` call to each other member
+receiving ``new_message``, carried in the message's ``client_ref``.
+
+The report is JSON with throughput and p50/p95/p99 per action, delivery
+latency, and the server's ``/admin/stats`` at the end, so runs can be diffed
+between releases. ``--seed`` fixes each client's action sequence. The
+database defaults to a temporary SQLite file; pass ``--database-url`` to load
+a real database, or ``--url`` to drive an app that is already running against
+a database prepared by an earlier run. Needs the Socket.IO client extras:
+``pip install "python-socketio[client]"``.
+"""
+from __future__ import annotations
+
+import json
+import os
+import random
+import re
+import secrets
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import click
+
+DEFAULT_MIX = "send=45,type=25,open=15,edit=5,forward=5,initialize=3,reconnect=2"
+ACTIONS = ("send", "type", "open", "edit", "forward", "initialize", "reconnect")
+PASSWORD = "load-test-password"
+USERNAME_PREFIX = "load"
+ADMIN_USERNAME = f"{USERNAME_PREFIX}0"
+SERVER_START_TIMEOUT = 60.0
+RECENT_MESSAGES = 20
+LOGIN_HASH_METHOD = "pbkdf2:sha256:1000"
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Both children patch before anything imports threading or socket.
+_SERVER_MAIN = (
+    "import eventlet; eventlet.monkey_patch(); import sys; from app import create_app, socketio; "
+    "socketio.run(create_app(), host='127.0.0.1', port=int(sys.argv[1]), log_output=False)"
+)
+_WORKER_MAIN = (
+    "import eventlet; eventlet.monkey_patch(); import sys; from app.bench.load import run_worker; "
+    "run_worker(sys.argv[1])"
+)
+
+_CSRF_TOKEN = re.compile(r'name="csrf_token"[^>]*value="([^"]+)"')
+
+
+def parse_mix(value: str) -> Dict[str, float]:
+    """Parse ``"send=45,type=25"`` into action weights, ignoring unknown actions."""
+
+    weights: Dict[str, float] = {}
+    for part in str(value or "").split(","):
+        action, _, weight = part.partition("=")
+        action = action.strip()
+        if action not in ACTIONS:
+            continue
+        try:
+            weights[action] = max(0.0, float(weight))
+        except ValueError:
+            continue
+    return {action: weight for action, weight in weights.items() if weight > 0}
+
+
+def _percentile(ordered: List[float], q: float) -> float:
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+
+def summarize(samples: List[float], errors: int, elapsed: float) -> Dict[str, Any]:
+    ordered = sorted(samples)
+    return {
+        "count": len(ordered),
+        "errors": errors,
+        "per_second": round(len(ordered) / elapsed, 2) if elapsed else 0.0,
+        "p50_ms": round(_percentile(ordered, 0.50), 2),
+        "p95_ms": round(_percentile(ordered, 0.95), 2),
+        "p99_ms": round(_percentile(ordered, 0.99), 2),
+        "max_ms": round(ordered[-1], 2) if ordered else 0.0,
+    }
+
+
+class Recorder:
+    """Latency samples and error counts of the clients in one worker process."""
+
+    def __init__(self):
+        self.samples: Dict[str, List[float]] = {}
+        self.errors: Dict[str, int] = {}
+
+    def record(self, action: str, started: float, ok: bool = True) -> None:
+        if ok:
+            self.samples.setdefault(action, []).append((time.perf_counter() - started) * 1000)
+        else:
+            self.errors[action] = self.errors.get(action, 0) + 1
+
+    def delivered(self, client_ref: str) -> None:
+        # Refs end with the sender's wall-clock send time, comparable across processes.
+        try:
+            sent = float(client_ref.rsplit("-", 1)[1])
+        except (IndexError, ValueError):
+            return
+        self.samples.setdefault("delivery", []).append((time.time() - sent) * 1000)
+
+    def merge(self, other: Dict[str, Any]) -> None:
+        for action, samples in other["samples"].items():
+            self.samples.setdefault(action, []).extend(samples)
+        for action, errors in other["errors"].items():
+            self.errors[action] = self.errors.get(action, 0) + errors
+
+    def report(self, elapsed: float) -> Dict[str, Any]:
+        names = sorted((set(self.samples) | set(self.errors)) - {"delivery"})
+        return {
+            "actions": {
+                name: summarize(self.samples.get(name, []), self.errors.get(name, 0), elapsed) for name in names
+            },
+            "delivery": summarize(self.samples.get("delivery", []), 0, elapsed),
+        }
+
+
+def prepare_database(database_url: str, clients: int, group_size: int) -> None:
+    """Create the schema and the ``load*`` users and chats that do not exist yet."""
+
+    from sqlalchemy import func, insert, select
+    from werkzeug.security import generate_password_hash
+
+    from app import create_app, db
+    from app.models.chat import Chat, ChatMember
+    from app.models.friendship import Friendship
+    from app.models.user import User
+
+    settings = {"SQLALCHEMY_DATABASE_URI": database_url, "SQLALCHEMY_BINDS": {}}
+    bench_app = create_app(type("LoadConfig", (), settings))
+    with bench_app.app_context():
+        db.create_all()
+        existing = set(
+            db.session.execute(select(User.username).where(User.username.like(f"{USERNAME_PREFIX}%"))).scalars()
+        )
+        # A cheap hash keeps thousands of logins from dominating the ramp-up.
+        password_hash = generate_password_hash(PASSWORD, method=LOGIN_HASH_METHOD)
+        rows = [
+            {
+                "username": f"{USERNAME_PREFIX}{index}",
+                "email": f"{USERNAME_PREFIX}{index}@example.com",
+                "display_name": f"Load {index}",
+                "password_hash": password_hash,
+                "bio": "",
+                "is_admin": index == 0,
+            }
+            for index in range(clients)
+            if f"{USERNAME_PREFIX}{index}" not in existing
+        ]
+        if rows:
+            db.session.execute(insert(User), rows)
+            user_ids = dict(
+                db.session.execute(
+                    select(User.username, User.id).where(User.username.like(f"{USERNAME_PREFIX}%"))
+                ).all()
+            )
+            new_ids = [user_ids[row["username"]] for row in rows]
+            groups = [new_ids[start:start + group_size] for start in range(0, len(new_ids), group_size)]
+            pairs = [new_ids[start:start + 2] for start in range(0, len(new_ids) - 1, 2)]
+            chats = [
+                {"name": f"Load group {members[0]}", "is_group": True, "creator_id": members[0]} for members in groups
+            ]
+            chats += [{"name": None, "is_group": False, "creator_id": pair[0]} for pair in pairs]
+            last_chat_id = db.session.scalar(select(func.max(Chat.id))) or 0
+            db.session.execute(insert(Chat), chats)
+            chat_ids = db.session.execute(
+                select(Chat.id).where(Chat.id > last_chat_id).order_by(Chat.id)
+            ).scalars().all()
+            db.session.execute(
+                insert(ChatMember),
+                [
+                    {"chat_id": chat_id, "user_id": user_id, "is_admin": position == 0, "is_owner": position == 0}
+                    for chat_id, members in zip(chat_ids, groups + pairs)
+                    for position, user_id in enumerate(members)
+                ],
+            )
+            if pairs:
+                db.session.execute(
+                    insert(Friendship),
+                    [{"user_id": left, "friend_id": right} for left, right in pairs]
+                    + [{"user_id": right, "friend_id": left} for left, right in pairs],
+                )
+            db.session.commit()
+        for engine in db.engines.values():
+            engine.dispose()
+
+
+def _free_port() -> int:
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+def start_server(database_url: str, port: int) -> subprocess.Popen:
+    env = {**os.environ, "DATABASE_URL": database_url}
+    env.setdefault("SECRET_KEY", secrets.token_hex(16))
+    env.pop("DATABASE_READ_URL", None)
+    # Every simulated client connects from 127.0.0.1, so per-IP buckets would throttle the whole run.
+    env.setdefault("RATE_LIMITS_PER_IP", "")
+    return subprocess.Popen([sys.executable, "-c", _SERVER_MAIN, str(port)], cwd=PROJECT_ROOT, env=env)
+
+
+def wait_for_server(http, base_url: str, server: Optional[subprocess.Popen]) -> None:
+    deadline = time.monotonic() + SERVER_START_TIMEOUT
+    while time.monotonic() < deadline:
+        if server is not None and server.poll() is not None:
+            raise click.ClickException(f"Server exited with status {server.returncode}")
+        try:
+            if http.get(f"{base_url}/auth/login", timeout=2).status_code == 200:
+                return
+        except http.exceptions.RequestException:
+            pass
+        time.sleep(0.25)
+    raise click.ClickException(f"Server at {base_url} did not start within {SERVER_START_TIMEOUT:.0f}s")
+
+
+def login(http, base_url: str, username: str):
+    session = http.Session()
+    page = session.get(f"{base_url}/auth/login", timeout=30)
+    match = _CSRF_TOKEN.search(page.text)
+    data = {"username": username, "password": PASSWORD}
+    if match:
+        data["csrf_token"] = match.group(1)
+    response = session.post(f"{base_url}/auth/login", data=data, timeout=30, allow_redirects=False)
+    if response.status_code != 302:
+        raise RuntimeError(f"Login failed for {username} ({response.status_code})")
+    return session
+
+
+class SimulatedClient:
+    def __init__(self, index: int, settings: Dict[str, Any], recorder: Recorder, http, sio_module):
+        self.username = f"{USERNAME_PREFIX}{index}"
+        self.base_url = settings["base_url"]
+        self.actions = list(settings["mix"])
+        self.weights = [settings["mix"][action] for action in self.actions]
+        self.think_ms = settings["think_ms"]
+        self.timeout = settings["timeout"]
+        self.rng = random.Random(settings["seed"] * 1000003 + index)
+        self.recorder = recorder
+        self.http = http
+        self.sio_module = sio_module
+        self.cookie = ""
+        self.sio = None
+        self.chat_ids: List[int] = []
+        self.own_messages: List[Tuple[int, int]] = []
+        self.sent = 0
+
+    def _on_new_message(self, message: Dict[str, Any]) -> None:
+        client_ref = message.get("client_ref") if isinstance(message, dict) else None
+        if client_ref and not client_ref.startswith(f"{self.username}-"):
+            self.recorder.delivered(client_ref)
+
+    def call(self, action: str, event: str, data: Any) -> Any:
+        started = time.perf_counter()
+        try:
+            result = self.sio.call(event, data, timeout=self.timeout)
+        except Exception:
+            self.recorder.record(action, started, ok=False)
+            return None
+        rejected = isinstance(result, dict) and result.get("ok") is False
+        self.recorder.record(action, started, ok=not rejected)
+        return None if rejected else result
+
+    def connect(self) -> bool:
+        started = time.perf_counter()
+        self.sio = self.sio_module.Client(reconnection=False)
+        self.sio.on("new_message", self._on_new_message)
+        try:
+            self.sio.connect(
+                self.base_url, headers={"Cookie": self.cookie}, transports=["websocket"], wait_timeout=self.timeout
+            )
+        except Exception:
+            self.recorder.record("connect", started, ok=False)
+            return False
+        self.recorder.record("connect", started)
+        return self.initialize()
+
+    def initialize(self) -> bool:
+        result = self.call("initialize", "initialize", {"normalized": True})
+        if not result:
+            return False
+        self.chat_ids = [chat["id"] for chat in (result.get("state") or {}).get("chats") or []]
+        return bool(self.chat_ids)
+
+    def close(self) -> None:
+        if self.sio is not None:
+            try:
+                self.sio.disconnect()
+            except Exception:
+                pass
+
+    def run(self, start_at: float, deadline: float) -> None:
+        time.sleep(max(0.0, start_at - time.time()))
+        started = time.perf_counter()
+        try:
+            session = login(self.http, self.base_url, self.username)
+        except Exception:
+            self.recorder.record("login", started, ok=False)
+            return
+        self.recorder.record("login", started)
+        self.cookie = "; ".join(f"{cookie.name}={cookie.value}" for cookie in session.cookies)
+        try:
+            if not self.connect():
+                return
+            while True:
+                pause = self.rng.expovariate(1000.0 / self.think_ms)
+                if time.time() + pause >= deadline:
+                    break
+                time.sleep(pause)
+                action = self.rng.choices(self.actions, self.weights)[0]
+                if not getattr(self, f"do_{action}")():
+                    break
+        finally:
+            self.close()
+
+    def do_send(self) -> bool:
+        self.sent += 1
+        client_ref = f"{self.username}-{self.sent}-{time.time():.6f}"
+        result = self.call(
+            "send",
+            "send_message",
+            {"chat_id": self.rng.choice(self.chat_ids), "body": f"load message {self.sent}", "client_ref": client_ref},
+        )
+        if result and result.get("message"):
+            message = result["message"]
+            self.own_messages = (self.own_messages + [(message["id"], message["chat_id"])])[-RECENT_MESSAGES:]
+        return True
+
+    def do_type(self) -> bool:
+        self.call("type", "chat:typing", {"chat_id": self.rng.choice(self.chat_ids)})
+        return True
+
+    def do_open(self) -> bool:
+        self.call("open", "chat:open", {"chat_id": self.rng.choice(self.chat_ids)})
+        return True
+
+    def do_edit(self) -> bool:
+        if not self.own_messages:
+            return self.do_send()
+        message_id, _ = self.rng.choice(self.own_messages)
+        self.call("edit", "message:edit", {"message_id": message_id, "body": "edited load message"})
+        return True
+
+    def do_forward(self) -> bool:
+        message_id, source_chat_id = self.rng.choice(self.own_messages) if self.own_messages else (None, None)
+        targets = [chat_id for chat_id in self.chat_ids if chat_id != source_chat_id]
+        if message_id is None or not targets:
+            return self.do_send()
+        self.call("forward", "message:forward", {"message_id": message_id, "target_chat_ids": [self.rng.choice(targets)]})
+        return True
+
+    def do_initialize(self) -> bool:
+        self.initialize()
+        return True
+
+    def do_reconnect(self) -> bool:
+        started = time.perf_counter()
+        self.close()
+        if not self.connect():
+            return False
+        self.recorder.record("reconnect", started)
+        return True
+
+
+def run_worker(encoded_settings: str) -> None:
+    """Entry point of a worker process: run its clients and print their raw samples as JSON."""
+
+    import eventlet
+    import requests
+    import socketio
+
+    settings = json.loads(encoded_settings)
+    recorder = Recorder()
+    indexes = settings["indexes"]
+    pool = eventlet.GreenPool(max(1, len(indexes)))
+    for index in indexes:
+        client = SimulatedClient(index, settings, recorder, requests, socketio)
+        pool.spawn(client.run, settings["start_at"][str(index)], settings["deadline"])
+    pool.waitall()
+    sys.stdout.write(json.dumps({"samples": recorder.samples, "errors": recorder.errors}))
+    sys.stdout.flush()
+
+
+@click.command()
+@click.option("--clients", default=200, show_default=True, help="Simulated users connected at once")
+@click.option("--duration", default=60.0, show_default=True, help="Seconds of traffic after the ramp-up")
+@click.option("--ramp", default=10.0, show_default=True, help="Seconds over which clients connect")
+@click.option("--mix", default=DEFAULT_MIX, show_default=True, help="Relative weights of client actions")
+@click.option("--think-ms", default=1000.0, show_default=True, help="Mean pause between a client's actions")
+@click.option("--group-size", default=8, show_default=True, help="Members per group chat")
+@click.option("--processes", default=0, help="Client worker processes  [default: one per 500 clients]")
+@click.option("--seed", default=1, show_default=True, help="Seed for the clients' action sequences")
+@click.option("--timeout", default=30.0, show_default=True, help="Seconds to wait for an ack")
+@click.option("--database-url", help="Database to prepare and serve (default: a temporary SQLite file)")
+@click.option("--url", help="Drive an already running server instead of starting one")
+@click.option("--output", type=click.Path(dir_okay=False), help="Write the JSON report here instead of stdout")
+def main(clients, duration, ramp, mix, think_ms, group_size, processes, seed, timeout, database_url, url, output):
+    """Run simulated Socket.IO clients against NovaTalk and report latencies as JSON."""
+    try:
+        import requests
+        import websocket  # noqa: F401
+    except ImportError:
+        raise click.ClickException('The load test needs the client extras: pip install "python-socketio[client]"')
+
+    weights = parse_mix(mix)
+    if not weights:
+        raise click.ClickException(f"--mix has no known actions; choose from {', '.join(ACTIONS)}")
+    clients, group_size, think_ms = max(1, clients), max(2, group_size), max(1.0, think_ms)
+    processes = min(clients, processes if processes > 0 else -(-clients // 500))
+
+    workdir = None
+    if url is None and database_url is None:
+        workdir = tempfile.TemporaryDirectory()
+        database_url = f"sqlite:///{workdir.name}/load.db"
+    server = None
+    workers: List[subprocess.Popen] = []
+    try:
+        if database_url is not None:
+            prepare_database(database_url, clients, group_size)
+        if url is None:
+            port = _free_port()
+            url = f"http://127.0.0.1:{port}"
+            server = start_server(database_url, port)
+        base_url = url.rstrip("/")
+        wait_for_server(requests, base_url, server)
+
+        started = time.time()
+        deadline = started + ramp + duration
+        start_at = {index: started + ramp * index / clients for index in range(clients)}
+        for worker in range(processes):
+            indexes = list(range(worker, clients, processes))
+            settings = {
+                "base_url": base_url,
+                "mix": weights,
+                "think_ms": think_ms,
+                "timeout": timeout,
+                "seed": seed,
+                "deadline": deadline,
+                "indexes": indexes,
+                "start_at": {str(index): start_at[index] for index in indexes},
+            }
+            workers.append(
+                subprocess.Popen(
+                    [sys.executable, "-c", _WORKER_MAIN, json.dumps(settings)],
+                    cwd=PROJECT_ROOT,
+                    stdout=subprocess.PIPE,
+                    text=True,
+                )
+            )
+        recorder = Recorder()
+        for worker in workers:
+            output_text, _ = worker.communicate()
+            if worker.returncode != 0 or not output_text:
+                raise click.ClickException(f"A client worker exited with status {worker.returncode}")
+            recorder.merge(json.loads(output_text))
+        elapsed = time.time() - started
+
+        report = {
+            "config": {
+                "clients": clients,
+                "duration": duration,
+                "ramp": ramp,
+                "mix": weights,
+                "think_ms": think_ms,
+                "group_size": group_size,
+                "processes": processes,
+                "seed": seed,
+                "database": database_url.split(":", 1)[0] if database_url else None,
+            },
+            "elapsed_s": round(elapsed, 2),
+            **recorder.report(elapsed),
+        }
+        try:
+            admin = login(requests, base_url, ADMIN_USERNAME)
+            report["server"] = admin.get(f"{base_url}/admin/stats", timeout=30).json()
+        except Exception as exc:
+            report["server"] = {"error": str(exc)}
+    finally:
+        for worker in workers:
+            if worker.poll() is None:
+                worker.kill()
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=30)
+        if workdir is not None:
+            workdir.cleanup()
+
+    rendered = json.dumps(report, indent=2, sort_keys=True)
+    if output:
+        with open(output, "w", encoding="utf-8") as handle:
+            handle.write(rendered + "\n")
+    else:
+        click.echo(rendered)
+
+
+if __name__ == "__main__":
+    main()
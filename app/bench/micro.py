@@ -0,0 +1,297 @@
+"""Micro-benchmarks for serializers and query helpers, with baseline gating.
+
+    python -m app.bench.micro --save            # record micro-baseline.json
+    python -m app.bench.micro                   # compare against it
+
+Each case times one hot function against an in-memory SQLite database filled
+by :func:`app.bench.seed.generate` at every ``--scales`` user count (fifty
+messages per user by default). Objects are loaded fresh from a new session
+before every sample, outside the timed region, so lazy loads inside the
+function are measured and counted as they are in a request. A sample reports
+wall time and SQL statements per call; the median of ``--iterations`` samples
+is kept after one warm-up run.
+
+With a baseline, the run fails (exit status 1) when a case is slower than
+``--time-threshold`` (a fraction, 0.25 = 25%) or issues more statements per
+call than ``--query-threshold`` allows. Timings are machine-specific, so keep
+baselines next to the machine that produced them; statement counts are not.
+"""
+from __future__ import annotations
+
+import base64
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import click
+from sqlalchemy import event, func
+
+from app.bench.seed import PLACEHOLDER_PNG
+
+DEFAULT_BASELINE = "micro-baseline.json"
+BATCH = 50
+
+# prepare() runs untimed in a fresh session and returns (args, calls); run(args) is timed.
+Case = Tuple[Callable[[], Tuple[Any, int]], Callable[[Any], Any]]
+
+
+class StatementCounter:
+    """Counts statements executed on an engine while :meth:`counting` is active."""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.count = 0
+        self.active = False
+        event.listen(engine, "before_cursor_execute", self._on_execute)
+
+    def _on_execute(self, *_):
+        if self.active:
+            self.count += 1
+
+    @contextmanager
+    def counting(self) -> Iterator[None]:
+        self.count = 0
+        self.active = True
+        try:
+            yield
+        finally:
+            self.active = False
+
+    def close(self) -> None:
+        event.remove(self.engine, "before_cursor_execute", self._on_execute)
+
+
+def build_cases() -> Dict[str, Case]:
+    from app import db
+    from app.chat.routes import (
+        _collect_contacts,
+        _persist_attachment,
+        _resolve_invitees,
+        _serialize_chat_summary,
+        _serialize_message,
+    )
+    from app.models import Chat, ChatMember, Friendship, Message, User
+    from app.utils.datetime import _encode_utc, to_utc_iso
+    from app.utils.identity import identity_cache
+
+    def busiest_chat_id() -> int:
+        return (
+            db.session.query(Message.chat_id)
+            .group_by(Message.chat_id)
+            .order_by(func.count(Message.id).desc())
+            .limit(1)
+            .scalar()
+        )
+
+    def best_connected_user() -> User:
+        user_id = (
+            db.session.query(Friendship.user_id)
+            .group_by(Friendship.user_id)
+            .order_by(func.count(Friendship.id).desc())
+            .limit(1)
+            .scalar()
+        )
+        return db.session.get(User, user_id)
+
+    def latest_messages() -> Tuple[List[Message], int]:
+        messages = (
+            Message.query.filter_by(chat_id=busiest_chat_id()).order_by(Message.seq.desc()).limit(BATCH).all()
+        )
+        return messages, len(messages)
+
+    def forwarded_messages() -> Tuple[List[Message], int]:
+        messages = Message.query.filter(Message.forwarded_from_id.isnot(None)).limit(BATCH).all()
+        return messages, len(messages)
+
+    def users() -> Tuple[List[User], int]:
+        people = User.query.order_by(User.id).limit(BATCH).all()
+        return people, len(people)
+
+    def timestamps() -> Tuple[List[datetime], int]:
+        _encode_utc.cache_clear()
+        start = datetime(2026, 1, 1)
+        return [start + timedelta(seconds=index * 7.5) for index in range(BATCH * 20)], BATCH * 20
+
+    def chat_summaries() -> Tuple[Tuple[List[Chat], User], int]:
+        user = best_connected_user()
+        chats = (
+            Chat.query.join(ChatMember)
+            .filter(ChatMember.user_id == user.id)
+            .order_by(Chat.created_at.desc())
+            .limit(20)
+            .all()
+        )
+        return (chats, user), len(chats)
+
+    def contacts() -> Tuple[User, int]:
+        return best_connected_user(), 1
+
+    def invitees() -> Tuple[str, int]:
+        identity_cache.clear()
+        names = [username for (username,) in db.session.query(User.username).order_by(User.id).limit(20)]
+        return ", ".join(names), 1
+
+    encoded_png = "data:image/png;base64," + base64.b64encode(PLACEHOLDER_PNG).decode("ascii")
+
+    def attachment() -> Tuple[Dict[str, Any], int]:
+        return {"name": "photo.png", "mimetype": "image/png", "data": encoded_png}, 1
+
+    return {
+        "to_utc_iso": (timestamps, lambda values: [to_utc_iso(value) for value in values]),
+        "Message.to_dict": (latest_messages, lambda messages: [message.to_dict() for message in messages]),
+        "User.to_public_dict": (users, lambda people: [person.to_public_dict() for person in people]),
+        "_serialize_message": (latest_messages, lambda messages: [_serialize_message(message) for message in messages]),
+        "_serialize_message[forwarded]": (
+            forwarded_messages,
+            lambda messages: [_serialize_message(message) for message in messages],
+        ),
+        "_serialize_chat_summary": (
+            chat_summaries,
+            lambda args: [_serialize_chat_summary(chat, args[1]) for chat in args[0]],
+        ),
+        "_collect_contacts": (contacts, _collect_contacts),
+        "_resolve_invitees": (invitees, _resolve_invitees),
+        "_persist_attachment": (attachment, _persist_attachment),
+    }
+
+
+def measure(case: Case, counter: StatementCounter, iterations: int) -> Dict[str, float]:
+    from app import db
+
+    prepare, run = case
+    timings: List[float] = []
+    statements: List[float] = []
+    for iteration in range(iterations + 1):
+        db.session.remove()
+        args, calls = prepare()
+        calls = max(1, calls)
+        with counter.counting():
+            started = time.perf_counter()
+            run(args)
+            elapsed = time.perf_counter() - started
+        if iteration:
+            timings.append(elapsed * 1000 / calls)
+            statements.append(counter.count / calls)
+    db.session.remove()
+    return {
+        "ms_per_call": round(statistics.median(timings), 4),
+        "queries_per_call": round(statistics.median(statements), 2),
+    }
+
+
+def run_scale(users: int, messages_per_user: int, iterations: int, only: Tuple[str, ...]) -> Dict[str, Dict[str, float]]:
+    from app import create_app, db
+    from app.bench.seed import generate
+
+    with tempfile.TemporaryDirectory() as upload_folder:
+        settings = {
+            "SQLALCHEMY_DATABASE_URI": "sqlite://",
+            "SQLALCHEMY_BINDS": {},
+            "UPLOAD_FOLDER": upload_folder,
+        }
+        bench_app = create_app(type("MicroConfig", (), settings))
+        with bench_app.test_request_context():
+            db.create_all()
+            generate(
+                db.engine,
+                upload_folder,
+                users=users,
+                messages=users * messages_per_user,
+                until=datetime(2026, 1, 1),
+            )
+            counter = StatementCounter(db.engine)
+            try:
+                return {
+                    name: measure(case, counter, iterations)
+                    for name, case in build_cases().items()
+                    if not only or name in only
+                }
+            finally:
+                counter.close()
+                db.session.remove()
+                db.engine.dispose()
+
+
+def compare(
+    results: Dict[str, Dict[str, float]],
+    baseline: Dict[str, Dict[str, float]],
+    time_threshold: float,
+    query_threshold: float,
+) -> List[str]:
+    """Return a description of every case that regressed against ``baseline``."""
+
+    regressions = []
+    for key, result in sorted(results.items()):
+        previous = baseline.get(key)
+        if not previous:
+            continue
+        limit_ms = previous["ms_per_call"] * (1 + time_threshold)
+        if result["ms_per_call"] > limit_ms:
+            regressions.append(
+                f"{key}: {result['ms_per_call']:.4f} ms/call, baseline {previous['ms_per_call']:.4f} ms "
+                f"(limit {limit_ms:.4f} ms)"
+            )
+        limit_queries = previous["queries_per_call"] + query_threshold
+        if result["queries_per_call"] > limit_queries:
+            regressions.append(
+                f"{key}: {result['queries_per_call']:g} queries/call, baseline {previous['queries_per_call']:g} "
+                f"(limit {limit_queries:g})"
+            )
+    return regressions
+
+
+@click.command()
+@click.option("--scales", default="100,1000", show_default=True, help="Comma-separated user counts to seed")
+@click.option("--messages-per-user", default=50, show_default=True, help="Messages seeded per user")
+@click.option("--iterations", default=20, show_default=True, help="Timed samples per case")
+@click.option("--case", "only", multiple=True, help="Run only this case (repeatable)")
+@click.option("--baseline", default=DEFAULT_BASELINE, show_default=True, type=click.Path(dir_okay=False))
+@click.option("--save", is_flag=True, help="Write the results as the new baseline instead of comparing")
+@click.option("--time-threshold", default=0.25, show_default=True, help="Allowed slowdown as a fraction")
+@click.option("--query-threshold", default=0.0, show_default=True, help="Allowed extra statements per call")
+def main(scales, messages_per_user, iterations, only, baseline, save, time_threshold, query_threshold):
+    """Time serializers and query helpers, and fail on regressions against a baseline."""
+    try:
+        user_counts = [int(value) for value in scales.split(",") if value.strip()]
+    except ValueError:
+        raise click.ClickException("--scales takes comma-separated integers, e.g. 100,1000")
+    if not user_counts:
+        raise click.ClickException("--scales needs at least one user count")
+
+    results: Dict[str, Dict[str, float]] = {}
+    for users in user_counts:
+        for name, result in run_scale(max(2, users), max(1, messages_per_user), max(1, iterations), only).items():
+            key = f"{name}@{users}"
+            results[key] = result
+            click.echo(f"{key:<40} {result['ms_per_call']:>10.4f} ms/call {result['queries_per_call']:>8g} queries/call")
+
+    if save:
+        with open(baseline, "w", encoding="utf-8") as handle:
+            json.dump(results, handle, indent=2, sort_keys=True)
+            handle.write("\n")
+        click.secho(f"Saved {len(results)} results to {baseline}", fg="green")
+        return
+
+    previous: Optional[Dict[str, Dict[str, float]]] = None
+    if os.path.exists(baseline):
+        with open(baseline, encoding="utf-8") as handle:
+            previous = json.load(handle)
+    if previous is None:
+        click.echo(f"No baseline at {baseline}; run with --save to record one.")
+        return
+    regressions = compare(results, previous, time_threshold, query_threshold)
+    if regressions:
+        for line in regressions:
+            click.secho(f"REGRESSION {line}", fg="red")
+        sys.exit(1)
+    click.secho(f"No regressions against {baseline}", fg="green")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,396 @@
+"""Query-count regression check for the Socket.IO handlers.
+
+    python -m app.bench.queries                  # exits 1 if any handler is O(n)
+    python -m app.bench.queries --event group:invite --event message:forward
+
+Every case emits one event through Flask-SocketIO's test client as the user
+``probe`` and counts the SQL statements it runs, including the background jobs
+it enqueues (run synchronously right after the handler). Background jobs with
+their own fan-out, such as the ``contacts.broadcast`` sent after every friend
+and invite change, are also enqueued and counted on their own. The fixture is
+built at each ``--scales`` size n: probe has n friends, a direct chat with
+each, n group chats, a main group with n members and 3n messages (some
+forwarded, some with attachments), n incoming friend requests, n incoming
+group invites from different groups and inviters, n outgoing group invites and
+n users it is not connected to. Cases that take a list
+(invitees, forward targets) pass n entries. Each case starts from a fresh copy
+of the fixture.
+
+A handler whose statement count grows between the smallest and largest scale
+is reported together with the statement templates (literals and ``IN`` lists
+collapsed, as in the slow-event log) that account for the growth. Growth that
+is inherent to a handler, such as one message written per forward target, is
+listed in ``ACCEPTED_GROWTH``; pass ``--allow`` to accept others for one run.
+"""
+from __future__ import annotations
+
+import os
+import shutil
+import sys
+import tempfile
+from collections import Counter
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import click
+from sqlalchemy import event
+
+from app.bench.seed import PLACEHOLDER_PNG
+from app.utils.slow_events import statement_template
+
+DEFAULT_SCALES = "4,16"
+
+Fixture = Dict[str, Any]
+
+# event name -> payload built from the fixture ids; keys with a suffix share the event.
+CASES: Dict[str, Callable[[Fixture], Dict[str, Any]]] = {
+    "initialize": lambda ids: {},
+    "chat:open": lambda ids: {"chat_id": ids["group"]},
+    "chat:fetch_range": lambda ids: {"chat_id": ids["group"]},
+    "chat:mark_read": lambda ids: {"chat_id": ids["group"]},
+    "chat:leave": lambda ids: {"chat_id": ids["group"]},
+    "chat:delete": lambda ids: {"chat_id": ids["member_groups"][0]},
+    "chat:typing": lambda ids: {"chat_id": ids["group"]},
+    "chat:stop_typing": lambda ids: {"chat_id": ids["group"]},
+    "send_message": lambda ids: {"chat_id": ids["group"], "body": "query count", "client_ref": "queries-1"},
+    "send_message[direct]": lambda ids: {"chat_id": ids["direct_chats"][0], "body": "query count"},
+    "message:edit": lambda ids: {"message_id": ids["own_message"], "body": "edited"},
+    "message:delete": lambda ids: {"message_id": ids["own_message"]},
+    "message:forward": lambda ids: {
+        "message_id": ids["attachment_message"],
+        "target_chat_ids": ids["direct_chats"],
+    },
+    "chat:create[direct]": lambda ids: {"type": "direct", "user_id": ids["loner"]},
+    "chat:create[group]": lambda ids: {"type": "group", "name": "New group", "user_ids": ids["peers"][:2]},
+    "group:invite": lambda ids: {"chat_id": ids["group"], "user_ids": ids["strangers"]},
+    "group:respond": lambda ids: {"invite_id": ids["incoming_invite"], "action": "accept"},
+    "group:cancel": lambda ids: {"invite_id": ids["outgoing_invites"][0]},
+    "group:remove_member": lambda ids: {"chat_id": ids["group"], "user_id": ids["peers"][0]},
+    "group:set_admin": lambda ids: {"chat_id": ids["group"], "user_id": ids["peers"][0], "is_admin": True},
+    "group:transfer_owner": lambda ids: {"chat_id": ids["group"], "user_id": ids["peers"][0]},
+    "group:disband": lambda ids: {"chat_id": ids["group"]},
+    "messages:search": lambda ids: {"query": "fixture"},
+    "contacts:search": lambda ids: {"query": "peer"},
+    "friend:send_request": lambda ids: {"user_id": ids["strangers"][0]},
+    "friend:respond": lambda ids: {"request_id": ids["incoming_requests"][0], "action": "accept"},
+    "friend:cancel": lambda ids: {"request_id": ids["outgoing_request"]},
+    "friend:remove": lambda ids: {"friend_id": ids["peers"][0]},
+    "me:update": lambda ids: {"display_name": "Probe", "bio": "Updated"},
+}
+
+# event -> why its statement count may grow; only writes that are one row set per item belong here.
+ACCEPTED_GROWTH: Dict[str, str] = {
+    "message:forward": "inserts each target's message, attachments, index entry and copy job and bumps its seq",
+}
+
+# job name -> payload; run as if enqueued by a handler, outside any socket event.
+JOB_CASES: Dict[str, Callable[[Fixture], Dict[str, Any]]] = {
+    "contacts.broadcast": lambda ids: {"user_id": ids["probe"]},
+}
+
+
+def build_fixture(size: int, upload_folder: str) -> Fixture:
+    """Create the probe user's world at scale ``size`` and return the ids the cases need."""
+
+    from app import db
+    from app.models import Chat, ChatMember, FriendRequest, Friendship, GroupInvite, Message, MessageAttachment, User
+
+    def person(username: str) -> User:
+        user = User(username=username, email=f"{username}@example.com", display_name=username.title())
+        user.password_hash = "!"
+        db.session.add(user)
+        return user
+
+    def group(name: str, owner: User, members: List[User]) -> Chat:
+        chat = Chat(name=name, is_group=True, creator_id=owner.id)
+        db.session.add(chat)
+        db.session.flush()
+        db.session.add(ChatMember(chat_id=chat.id, user_id=owner.id, is_admin=True, is_owner=True))
+        db.session.add_all(ChatMember(chat_id=chat.id, user_id=member.id) for member in members)
+        return chat
+
+    def befriend(left: User, right: User) -> None:
+        db.session.add_all([Friendship(user_id=left.id, friend_id=right.id), Friendship(user_id=right.id, friend_id=left.id)])
+
+    def post(chat: Chat, sender: User, body: str, **values: Any) -> Message:
+        chat.last_seq = (chat.last_seq or 0) + 1
+        message = Message(chat_id=chat.id, sender_id=sender.id, seq=chat.last_seq, body=body, **values)
+        db.session.add(message)
+        db.session.flush()
+        return message
+
+    def attach(message: Message) -> None:
+        filename = f"queries_{message.id}.png"
+        with open(os.path.join(upload_folder, "messages", filename), "wb") as handle:
+            handle.write(PLACEHOLDER_PNG)
+        db.session.add(MessageAttachment(message_id=message.id, filename=filename, mimetype="image/png"))
+
+    probe = person("probe")
+    peers = [person(f"peer{index}") for index in range(size)]
+    outsiders = [person(f"outsider{index}") for index in range(size)]
+    strangers = [person(f"stranger{index}") for index in range(size)]
+    loner, requested = person("loner"), person("requested")
+    db.session.flush()
+
+    direct_chats = []
+    for peer in peers:
+        befriend(probe, peer)
+        chat = Chat(is_group=False)
+        db.session.add(chat)
+        db.session.flush()
+        db.session.add_all([ChatMember(chat_id=chat.id, user_id=probe.id), ChatMember(chat_id=chat.id, user_id=peer.id)])
+        post(chat, peer, f"fixture hello from {peer.username}")
+        direct_chats.append(chat)
+    befriend(probe, loner)
+
+    main = group("Fixture group", probe, peers)
+    sources = [post(chat, probe, "fixture direct note") for chat in direct_chats]
+    own_message = post(main, probe, "fixture message from probe")
+    attachment_message = own_message
+    for index in range(3 * size):
+        sender = peers[index % size]
+        if index % 4 == 0:
+            message = post(main, sender, "fixture forward", forwarded_from_id=sources[index % size].id)
+        else:
+            message = post(main, sender, f"fixture message {index}")
+        if index % 5 == 0:
+            attach(message)
+            attachment_message = message
+    member_groups = []
+    for index, peer in enumerate(peers):
+        chat = group(f"Peer group {index}", peer, [probe])
+        post(chat, peer, "fixture group hello")
+        member_groups.append(chat)
+
+    incoming_requests = [FriendRequest(sender_id=outsider.id, receiver_id=probe.id, status="pending") for outsider in outsiders]
+    outgoing_request = FriendRequest(sender_id=probe.id, receiver_id=requested.id, status="pending")
+    outgoing_invites = [
+        GroupInvite(chat_id=main.id, inviter_id=probe.id, invitee_id=outsider.id, status="pending") for outsider in outsiders
+    ]
+    db.session.add_all([*incoming_requests, outgoing_request, *outgoing_invites])
+    invited_group = group("Invited group", peers[0], peers[1:])
+    outsider_groups = [group(f"Outsider group {index}", outsider, []) for index, outsider in enumerate(outsiders)]
+    db.session.flush()
+    incoming_invite = GroupInvite(chat_id=invited_group.id, inviter_id=peers[0].id, invitee_id=probe.id, status="pending")
+    db.session.add(incoming_invite)
+    db.session.add_all(
+        GroupInvite(chat_id=chat.id, inviter_id=outsider.id, invitee_id=probe.id, status="pending")
+        for chat, outsider in zip(outsider_groups, outsiders)
+    )
+    db.session.commit()
+    return {
+        "probe": probe.id,
+        "peers": [peer.id for peer in peers],
+        "loner": loner.id,
+        "strangers": [stranger.id for stranger in strangers],
+        "group": main.id,
+        "direct_chats": [chat.id for chat in direct_chats],
+        "member_groups": [chat.id for chat in member_groups],
+        "own_message": own_message.id,
+        "attachment_message": attachment_message.id,
+        "incoming_requests": [request.id for request in incoming_requests],
+        "outgoing_request": outgoing_request.id,
+        "outgoing_invites": [invite.id for invite in outgoing_invites],
+        "incoming_invite": incoming_invite.id,
+    }
+
+
+class StatementLog:
+    """Records the statements an engine executes while :attr:`active` is set."""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.active = False
+        self.statements: List[str] = []
+        event.listen(engine, "before_cursor_execute", self._on_execute)
+
+    def _on_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if self.active:
+            self.statements.append(statement)
+
+    def close(self) -> None:
+        event.remove(self.engine, "before_cursor_execute", self._on_execute)
+
+
+def run_case(bench_app, log: StatementLog, name: str, payload: Dict[str, Any], probe_id: int) -> Tuple[List[str], Any]:
+    """Emit one event as probe and return its statements (handler, then jobs) and the ack."""
+
+    from app import socketio
+    from app.jobs.runner import job_runner
+
+    http = bench_app.test_client()
+    with http.session_transaction() as session:
+        session["_user_id"] = str(probe_id)
+        session["_fresh"] = True
+    client = socketio.test_client(bench_app, flask_test_client=http)
+    try:
+        log.statements = []
+        log.active = True
+        try:
+            ack = client.emit(name.split("[", 1)[0], payload, callback=True)
+            with bench_app.app_context():
+                for job in job_runner._claim_due():
+                    job_runner._execute(bench_app, job)
+        finally:
+            log.active = False
+    finally:
+        client.disconnect()
+    return list(log.statements), ack
+
+
+def run_job(bench_app, log: StatementLog, name: str, payload: Dict[str, Any]) -> List[str]:
+    """Enqueue job ``name`` and return the statements it runs."""
+
+    from app import db, jobs
+    from app.jobs.runner import job_runner
+
+    with bench_app.app_context():
+        jobs.enqueue(name, payload)
+        db.session.commit()
+        log.statements = []
+        log.active = True
+        try:
+            for job in job_runner._claim_due():
+                job_runner._execute(bench_app, job)
+        finally:
+            log.active = False
+    return list(log.statements)
+
+
+def _reset_database(bench_app, database: str, source: Optional[str] = None) -> None:
+    """Close every connection and replace ``database`` with ``source`` (or nothing)."""
+
+    from app import db
+
+    with bench_app.app_context():
+        db.session.remove()
+        db.engine.dispose()
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(database + suffix):
+            os.remove(database + suffix)
+    if source is not None:
+        shutil.copyfile(source, database)
+
+
+def run_scale(
+    bench_app, workdir: str, size: int, events: Tuple[str, ...]
+) -> Tuple[Dict[str, List[str]], Dict[str, str]]:
+    from app import db
+    from app.utils.identity import identity_cache
+    from app.utils.user_cache import user_cache, user_cards
+
+    database = os.path.join(workdir, "queries.db")
+    template = os.path.join(workdir, f"fixture-{size}.db")
+    _reset_database(bench_app, database)
+    with bench_app.app_context():
+        db.create_all()
+        ids = build_fixture(size, bench_app.config["UPLOAD_FOLDER"])
+    _reset_database(bench_app, template)
+    os.replace(database, template)
+
+    statements: Dict[str, List[str]] = {}
+    failures: Dict[str, str] = {}
+    for name, build_payload in [*CASES.items(), *JOB_CASES.items()]:
+        if events and name not in events and name.split("[", 1)[0] not in events:
+            continue
+        _reset_database(bench_app, database, template)
+        identity_cache.clear()
+        user_cache.clear()
+        user_cards.clear()
+        with bench_app.app_context():
+            log = StatementLog(db.engine)
+        try:
+            if name in JOB_CASES:
+                statements[name], ack = run_job(bench_app, log, name, build_payload(ids)), None
+            else:
+                statements[name], ack = run_case(bench_app, log, name, build_payload(ids), ids["probe"])
+        finally:
+            log.close()
+        if isinstance(ack, dict) and ack.get("ok") is False:
+            failures[name] = str(ack.get("error"))
+    _reset_database(bench_app, database)
+    return statements, failures
+
+
+def growth(small: List[str], large: List[str]) -> List[Tuple[str, int, int]]:
+    """Templates executed more often at the larger scale, as ``(template, small, large)``."""
+
+    before = Counter(statement_template(statement) for statement in small)
+    after = Counter(statement_template(statement) for statement in large)
+    return sorted(
+        ((template, before[template], count) for template, count in after.items() if count > before[template]),
+        key=lambda item: item[1] - item[2],
+    )
+
+
+def measure(sizes: List[int], events: Tuple[str, ...] = ()) -> List[Tuple[Dict[str, List[str]], Dict[str, str]]]:
+    """Build the fixture at each of ``sizes`` and return every scale's statements and handler errors."""
+
+    from app import create_app
+    from app.jobs.runner import job_runner
+
+    # Socket handlers attach to the first app's server only, so one app serves every scale.
+    with tempfile.TemporaryDirectory() as workdir:
+        settings = {
+            "SQLALCHEMY_DATABASE_URI": f"sqlite:///{os.path.join(workdir, 'queries.db')}",
+            "SQLALCHEMY_BINDS": {},
+            "UPLOAD_FOLDER": os.path.join(workdir, "uploads"),
+            "CONTACT_SEARCH_DEBOUNCE_MS": 0,
+            "MESSAGE_WRITE_BATCHING": False,
+            "SLOW_EVENT_MS": 0,
+        }
+        bench_app = create_app(type("QueriesConfig", (), settings))
+        # Jobs run synchronously after each handler instead of on the poller.
+        job_runner._started = True
+        return [run_scale(bench_app, workdir, size, events) for size in sizes]
+
+
+@click.command()
+@click.option("--scales", default=DEFAULT_SCALES, show_default=True, help="Comma-separated fixture sizes")
+@click.option("--event", "events", multiple=True, help="Check only this event (repeatable)")
+@click.option("--allow", multiple=True, help="Event whose statement count may grow (repeatable)")
+@click.option("--verbose", is_flag=True, help="Print every statement template of growing handlers")
+def main(scales: str, events: Tuple[str, ...], allow: Tuple[str, ...], verbose: bool):
+    """Fail when a Socket.IO handler's SQL statement count grows with the data."""
+    try:
+        sizes = sorted({int(value) for value in scales.split(",") if value.strip()})
+    except ValueError:
+        raise click.ClickException("--scales takes comma-separated integers, e.g. 4,16")
+    if len(sizes) < 2 or sizes[0] < 2:
+        raise click.ClickException("--scales needs two or more sizes of at least 2")
+
+    runs = measure(sizes, events)
+    failures: Dict[str, str] = {}
+    for _, scale_failures in runs:
+        failures.update(scale_failures)
+    header = "".join(f"{f'n={size}':>8}" for size in sizes)
+    click.echo(f"{'event':<28}{header}")
+    regressions: List[str] = []
+    for name in runs[0][0]:
+        counts = [len(statements[name]) for statements, _ in runs]
+        grows = counts[-1] > counts[0]
+        marker = ""
+        if name in failures:
+            marker = f"  (handler error: {failures[name]})"
+        elif grows:
+            accepted = {*allow, *ACCEPTED_GROWTH}
+            marker = "  allowed" if name in accepted or name.split("[", 1)[0] in accepted else "  GROWS"
+        click.echo(f"{name:<28}{''.join(f'{count:>8}' for count in counts)}{marker}")
+        if grows and marker == "  GROWS":
+            regressions.append(name)
+
+    for name in regressions:
+        click.secho(f"\n{name} runs more statements as the data grows:", fg="red")
+        rows = growth(runs[0][0][name], runs[-1][0][name])
+        for template, small, large in rows if verbose else rows[:5]:
+            click.echo(f"  {small:>4} -> {large:<4} {template}")
+        if not verbose and len(rows) > 5:
+            click.echo(f"  ... {len(rows) - 5} more templates (--verbose)")
+    if failures:
+        click.secho(f"\n{len(failures)} handlers returned an error; their counts do not cover the full path.", fg="yellow")
+    if regressions:
+        sys.exit(1)
+    click.secho("\nNo handler's statement count grows with the data.", fg="green")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,440 @@
+"""Deterministic synthetic dataset for large-scale benchmarks.
+
+:func:`generate` writes users, a Zipf-distributed friend graph, direct chats
+between friends, groups of heavy-tailed sizes, messages, forwards, edits,
+deletions, attachments and pending friend requests and group invites. Rows go
+straight to the DB-API driver with ``executemany`` in chunks (PyMySQL turns
+each chunk into one multi-row ``INSERT``), bypassing the ORM and its per-row
+events. The full-text index is rebuilt once at the end.
+
+Everything is drawn from one ``random.Random(seed)`` and timestamps end at a
+fixed ``until``, so the same arguments always produce the same rows. Message
+activity per chat follows a Zipf law and arrives in bursts: most gaps are
+seconds to minutes, a few are hours, scaled to fit between the chat's creation
+and ``until``.
+"""
+from __future__ import annotations
+
+import os
+import random
+from bisect import bisect_left
+from datetime import datetime, timedelta
+from itertools import accumulate
+from typing import Any, Callable, Dict, List, Optional, Sequence, Set, Tuple
+
+from sqlalchemy import text
+from werkzeug.security import generate_password_hash
+
+from app.models.user import DEFAULT_DATETIME_FORMAT, DEFAULT_TIMEZONE_MODE, DEFAULT_TIMEZONE_OFFSET
+
+CHUNK_ROWS = 10000
+RECENT_FORWARD_SOURCES = 50000
+SENTENCE_POOL = 20000
+READ_RATIO = 0.7
+BURST_RATIO = 0.85
+BURST_GAP_SECONDS = 45.0
+IDLE_GAP_SECONDS = 6 * 3600.0
+
+# 1x1 transparent PNG used for every placeholder attachment.
+PLACEHOLDER_PNG = bytes.fromhex(
+    "89504e470d0a1a0a0000000d49484452000000010000000108060000001f15c489"
+    "0000000d4944415478da63f8ffff3f0005fe02fea7d6a4bf0000000049454e44ae426082"
+)
+
+FIRST_NAMES = (
+    "Ada", "Alan", "Ana", "Ben", "Chen", "Chloe", "Dana", "Diego", "Elena", "Emre", "Fatima", "Felix",
+    "Grace", "Hana", "Ivan", "Jia", "Kofi", "Lena", "Liam", "Maya", "Mei", "Nina", "Omar", "Priya",
+    "Quinn", "Rosa", "Sam", "Sara", "Tariq", "Uma", "Victor", "Wen", "Yara", "Yusuf", "Zoe",
+)
+LAST_NAMES = (
+    "Adams", "Baker", "Costa", "Dubois", "Evans", "Fischer", "Garcia", "Hoang", "Ito", "Jensen", "Kim",
+    "Larsen", "Mensah", "Novak", "Okafor", "Patel", "Quispe", "Rossi", "Silva", "Tanaka", "Ueda",
+    "Varga", "Wang", "Yilmaz", "Zhang",
+)
+WORDS = (
+    "the", "a", "we", "you", "I", "it", "is", "are", "was", "will", "can", "should", "maybe", "today",
+    "tomorrow", "tonight", "meeting", "project", "deadline", "lunch", "coffee", "call", "review", "draft",
+    "release", "build", "test", "bug", "fix", "deploy", "server", "update", "plan", "quarterly", "report",
+    "budget", "team", "client", "design", "photo", "trip", "weekend", "game", "movie", "dinner", "thanks",
+    "sure", "ok", "great", "sounds", "good", "let's", "check", "send", "share", "later", "soon", "now",
+    "after", "before", "with", "about", "for", "on", "at", "in", "to", "from", "please", "again", "done",
+)
+
+
+def zipf_weights(count: int, exponent: float, rng: random.Random) -> List[float]:
+    """Zipf weights ``1 / rank**exponent`` assigned to ``count`` items in random rank order."""
+
+    ranks = list(range(1, count + 1))
+    rng.shuffle(ranks)
+    return [1.0 / rank ** exponent for rank in ranks]
+
+
+def allocate(total: int, weights: Sequence[float]) -> List[int]:
+    """Split ``total`` proportionally to ``weights`` with the largest-remainder method."""
+
+    weight_sum = sum(weights) or 1.0
+    shares = [total * weight / weight_sum for weight in weights]
+    counts = [int(share) for share in shares]
+    remainder = total - sum(counts)
+    by_fraction = sorted(range(len(shares)), key=lambda index: counts[index] - shares[index])
+    for index in by_fraction[:remainder]:
+        counts[index] += 1
+    return counts
+
+
+class _Picker:
+    """Weighted sampling by binary search over cumulative weights."""
+
+    def __init__(self, items: Sequence[int], weights: Sequence[float], rng: random.Random):
+        self.items = items
+        self.cumulative = list(accumulate(weights))
+        self.total = self.cumulative[-1] if self.cumulative else 0.0
+        self.rng = rng
+
+    def pick(self) -> int:
+        index = bisect_left(self.cumulative, self.rng.random() * self.total)
+        return self.items[min(index, len(self.items) - 1)]
+
+
+class _Writer:
+    """Chunked ``executemany`` into one table through the raw driver."""
+
+    def __init__(self, connection, table: str, columns: Sequence[str], report: Callable[[str, int], None]):
+        quote = connection.dialect.identifier_preparer.quote
+        placeholder = "?" if connection.dialect.paramstyle == "qmark" else "%s"
+        self.sql = (
+            f"INSERT INTO {quote(table)} ({', '.join(quote(column) for column in columns)}) "
+            f"VALUES ({', '.join([placeholder] * len(columns))})"
+        )
+        self.connection = connection
+        self.table = table
+        self.rows: List[Tuple[Any, ...]] = []
+        self.written = 0
+        self.report = report
+
+    def add(self, row: Tuple[Any, ...]) -> None:
+        self.rows.append(row)
+        if len(self.rows) >= CHUNK_ROWS:
+            self.flush()
+
+    def flush(self) -> None:
+        if not self.rows:
+            return
+        self.connection.exec_driver_sql(self.sql, self.rows)
+        self.connection.commit()
+        self.written += len(self.rows)
+        self.rows = []
+        self.report(self.table, self.written)
+
+
+def _next_id(connection, table: str) -> int:
+    quote = connection.dialect.identifier_preparer.quote
+    return (connection.execute(text(f"SELECT MAX(id) FROM {quote(table)}")).scalar() or 0) + 1
+
+
+def _timestamp_encoder(dialect: str) -> Callable[[float], Any]:
+    epoch = datetime(1970, 1, 1)
+    if dialect == "sqlite":
+        # The format SQLAlchemy's SQLite DateTime type reads back.
+        return lambda seconds: (epoch + timedelta(seconds=seconds)).isoformat(" ", "microseconds")
+    return lambda seconds: epoch + timedelta(seconds=seconds)
+
+
+def _prepare_connection(connection) -> None:
+    dialect = connection.dialect.name
+    if dialect == "sqlite":
+        connection.exec_driver_sql("PRAGMA synchronous=OFF")
+    elif dialect == "mysql":
+        connection.exec_driver_sql("SET SESSION unique_checks=0, foreign_key_checks=0")
+
+
+def _restore_connection(connection) -> None:
+    dialect = connection.dialect.name
+    if dialect == "sqlite":
+        connection.exec_driver_sql("PRAGMA synchronous=NORMAL")
+    elif dialect == "mysql":
+        connection.exec_driver_sql("SET SESSION unique_checks=1, foreign_key_checks=1")
+
+
+def generate(
+    engine,
+    upload_folder: str,
+    users: int = 1000,
+    messages: int = 100000,
+    avg_friends: int = 20,
+    groups: Optional[int] = None,
+    max_group_size: int = 200,
+    dm_ratio: float = 0.3,
+    forward_ratio: float = 0.02,
+    edit_ratio: float = 0.03,
+    delete_ratio: float = 0.01,
+    attachment_ratio: float = 0.005,
+    pending_requests: Optional[int] = None,
+    pending_invites: Optional[int] = None,
+    days: int = 180,
+    until: Optional[datetime] = None,
+    zipf: float = 1.1,
+    seed: int = 1,
+    prefix: str = "seed",
+    password: str = "password123",
+    report: Callable[[str, int], None] = lambda table, rows: None,
+) -> Dict[str, int]:
+    """Write a synthetic population into ``engine`` and return row counts per table."""
+
+    rng = random.Random(seed)
+    groups = max(0, users // 20 if groups is None else groups)
+    pending_requests = users // 10 if pending_requests is None else pending_requests
+    pending_invites = groups if pending_invites is None else pending_invites
+    until = until or datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    end = (until - datetime(1970, 1, 1)).total_seconds()
+    start = end - days * 86400.0
+    counts: Dict[str, int] = {}
+
+    with engine.connect() as connection:
+        taken = connection.execute(
+            text("SELECT 1 FROM users WHERE username = :username"), {"username": f"{prefix}0"}
+        ).first()
+        if taken:
+            raise ValueError(f"Users with the prefix '{prefix}' already exist; choose another prefix.")
+        encode_time = _timestamp_encoder(connection.dialect.name)
+        _prepare_connection(connection)
+        try:
+            # Users, ranked by a shuffled Zipf popularity that drives friendships and group membership.
+            first_user = _next_id(connection, "users")
+            user_ids = list(range(first_user, first_user + users))
+            popularity = zipf_weights(users, zipf, rng)
+            picker = _Picker(user_ids, popularity, rng)
+            password_hash = generate_password_hash(password)
+            writer = _Writer(
+                connection,
+                "users",
+                ("id", "display_name", "username", "email", "password_hash", "bio", "is_admin", "last_seen",
+                 "online", "timezone_mode", "timezone_offset", "datetime_format"),
+                report,
+            )
+            for offset, user_id in enumerate(user_ids):
+                name = f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}"
+                writer.add((
+                    user_id, name, f"{prefix}{offset}", f"{prefix}{offset}@example.com", password_hash, "", False,
+                    encode_time(end - rng.expovariate(1 / 86400.0)), False, DEFAULT_TIMEZONE_MODE,
+                    DEFAULT_TIMEZONE_OFFSET, DEFAULT_DATETIME_FORMAT,
+                ))
+            writer.flush()
+            counts["users"] = writer.written
+
+            # Friendships: one uniformly chosen end and one popularity-weighted end per edge.
+            target_pairs = min(users * avg_friends // 2, users * (users - 1) // 2)
+            pairs: Set[Tuple[int, int]] = set()
+            for _ in range(target_pairs * 3):
+                if len(pairs) >= target_pairs:
+                    break
+                user_id, other = rng.choice(user_ids), picker.pick()
+                if other != user_id:
+                    pairs.add((min(user_id, other), max(user_id, other)))
+            friend_pairs = sorted(pairs)
+            writer = _Writer(connection, "friendships", ("id", "user_id", "friend_id", "created_at"), report)
+            next_id = _next_id(connection, "friendships")
+            for left, right in friend_pairs:
+                created = encode_time(rng.uniform(start, end))
+                writer.add((next_id, left, right, created))
+                writer.add((next_id + 1, right, left, created))
+                next_id += 2
+            writer.flush()
+            counts["friendships"] = writer.written
+
+            # Chats: direct chats for a share of friend pairs, then groups of heavy-tailed sizes.
+            chat_members: List[List[int]] = [list(pair) for pair in friend_pairs if rng.random() < dm_ratio]
+            dm_count = len(chat_members)
+            for _ in range(groups):
+                size = min(max_group_size, users, max(3, int(rng.paretovariate(1.3) * 3)))
+                members: List[int] = []
+                seen: Set[int] = set()
+                while len(members) < size:
+                    member = picker.pick() if rng.random() < 0.8 else rng.choice(user_ids)
+                    if member not in seen:
+                        seen.add(member)
+                        members.append(member)
+                chat_members.append(members)
+            first_chat = _next_id(connection, "chats")
+            chat_ids = list(range(first_chat, first_chat + len(chat_members)))
+            per_chat = allocate(messages, zipf_weights(len(chat_ids), zipf, rng))
+            created_at = [rng.uniform(start, end - 3600.0) for _ in chat_ids]
+            writer = _Writer(
+                connection, "chats", ("id", "name", "is_group", "creator_id", "created_at", "last_seq"), report
+            )
+            for index, (chat_id, members) in enumerate(zip(chat_ids, chat_members)):
+                is_group = index >= dm_count
+                name = f"{rng.choice(WORDS).title()} {rng.choice(WORDS)} {index - dm_count}" if is_group else None
+                writer.add((chat_id, name, is_group, members[0], encode_time(created_at[index]), per_chat[index]))
+            writer.flush()
+            counts["chats"] = writer.written
+
+            writer = _Writer(
+                connection,
+                "chat_members",
+                ("id", "chat_id", "user_id", "is_admin", "is_owner", "joined_at", "last_read_seq", "last_read_at",
+                 "unread_count"),
+                report,
+            )
+            next_id = _next_id(connection, "chat_members")
+            for index, (chat_id, members) in enumerate(zip(chat_ids, chat_members)):
+                is_group = index >= dm_count
+                last_seq = per_chat[index]
+                for position, user_id in enumerate(members):
+                    read_seq = last_seq if rng.random() < READ_RATIO else max(0, last_seq - rng.randint(1, 50))
+                    writer.add((
+                        next_id, chat_id, user_id, is_group and position < 2, is_group and position == 0,
+                        encode_time(created_at[index]), read_seq or None,
+                        encode_time(end - rng.uniform(0, 86400.0)) if read_seq else None, last_seq - read_seq,
+                    ))
+                    next_id += 1
+            writer.flush()
+            counts["chat_members"] = writer.written
+
+            counts.update(
+                _write_messages(
+                    connection, rng, upload_folder, chat_ids, chat_members, per_chat, created_at, end,
+                    forward_ratio, edit_ratio, delete_ratio, attachment_ratio, encode_time, report,
+                )
+            )
+
+            # Pending friend requests between non-friends and pending invites to groups.
+            writer = _Writer(connection, "friend_requests", ("id", "sender_id", "receiver_id", "created_at", "status"), report)
+            next_id = _next_id(connection, "friend_requests")
+            requested: Set[Tuple[int, int]] = set()
+            for _ in range(pending_requests if users > 1 else 0):
+                sender, receiver = rng.choice(user_ids), picker.pick()
+                key = (min(sender, receiver), max(sender, receiver))
+                if sender == receiver or key in pairs or key in requested:
+                    continue
+                requested.add(key)
+                writer.add((next_id, sender, receiver, encode_time(end - rng.uniform(0, 14 * 86400.0)), "pending"))
+                next_id += 1
+            writer.flush()
+            counts["friend_requests"] = writer.written
+
+            writer = _Writer(
+                connection, "group_invites", ("id", "chat_id", "inviter_id", "invitee_id", "status", "created_at"), report
+            )
+            next_id = _next_id(connection, "group_invites")
+            group_indexes = list(range(dm_count, len(chat_ids)))
+            invited: Set[Tuple[int, int]] = set()
+            for _ in range(pending_invites if group_indexes else 0):
+                index = rng.choice(group_indexes)
+                invitee = picker.pick()
+                if invitee in chat_members[index] or (index, invitee) in invited:
+                    continue
+                invited.add((index, invitee))
+                writer.add((
+                    next_id, chat_ids[index], chat_members[index][0], invitee, "pending",
+                    encode_time(end - rng.uniform(0, 14 * 86400.0)),
+                ))
+                next_id += 1
+            writer.flush()
+            counts["group_invites"] = writer.written
+        finally:
+            _restore_connection(connection)
+            connection.commit()
+    return counts
+
+
+def _write_messages(
+    connection,
+    rng: random.Random,
+    upload_folder: str,
+    chat_ids: Sequence[int],
+    chat_members: Sequence[Sequence[int]],
+    per_chat: Sequence[int],
+    created_at: Sequence[float],
+    end: float,
+    forward_ratio: float,
+    edit_ratio: float,
+    delete_ratio: float,
+    attachment_ratio: float,
+    encode_time: Callable[[float], Any],
+    report: Callable[[str, int], None],
+) -> Dict[str, int]:
+    sentences = [" ".join(rng.choices(WORDS, k=rng.randint(2, 16))).capitalize() for _ in range(SENTENCE_POOL)]
+    writer = _Writer(
+        connection,
+        "messages",
+        ("id", "chat_id", "sender_id", "seq", "forwarded_from_id", "body", "created_at", "last_edited_at",
+         "is_deleted", "edited"),
+        report,
+    )
+    attachments = _Writer(
+        connection, "message_attachments", ("id", "message_id", "filename", "mimetype", "created_at"), report
+    )
+    attachment_dir = os.path.join(upload_folder, "messages")
+    os.makedirs(attachment_dir, exist_ok=True)
+    message_id = _next_id(connection, "messages")
+    attachment_id = _next_id(connection, "message_attachments")
+    recent: List[int] = []
+    random_value = rng.random
+    for chat_id, members, count, opened in zip(chat_ids, chat_members, per_chat, created_at):
+        if not count:
+            continue
+        # Bursty arrivals, compressed to fit between the chat's creation and the end of the window.
+        gaps = [
+            rng.expovariate(1 / BURST_GAP_SECONDS) if random_value() < BURST_RATIO else rng.expovariate(1 / IDLE_GAP_SECONDS)
+            for _ in range(count)
+        ]
+        span = sum(gaps)
+        scale = min(1.0, (end - opened) / span) if span else 1.0
+        moment = opened
+        member_count = len(members)
+        for seq, gap in enumerate(gaps, start=1):
+            moment += gap * scale
+            # Squaring skews senders towards the first members, who talk the most.
+            sender = members[int(member_count * random_value() ** 2)]
+            roll = random_value()
+            body: Optional[str] = sentences[int(random_value() * SENTENCE_POOL)]
+            forwarded_from = None
+            edited_at = None
+            deleted = edited = False
+            if roll < delete_ratio:
+                body, deleted, edited_at = None, True, moment + rng.uniform(1, 600)
+            elif roll < delete_ratio + edit_ratio:
+                edited, edited_at = True, moment + rng.uniform(1, 600)
+            elif roll < delete_ratio + edit_ratio + forward_ratio and recent:
+                forwarded_from = recent[int(random_value() * len(recent))]
+            writer.add((
+                message_id, chat_id, sender, seq, forwarded_from, body, encode_time(moment),
+                encode_time(edited_at) if edited_at else None, deleted, edited,
+            ))
+            if not deleted and random_value() < attachment_ratio:
+                filename = f"seed_{message_id}.png"
+                with open(os.path.join(attachment_dir, filename), "wb") as handle:
+                    handle.write(PLACEHOLDER_PNG)
+                attachments.add((attachment_id, message_id, filename, "image/png", encode_time(moment)))
+                attachment_id += 1
+            if len(recent) < RECENT_FORWARD_SOURCES:
+                recent.append(message_id)
+            else:
+                recent[int(random_value() * RECENT_FORWARD_SOURCES)] = message_id
+            message_id += 1
+    writer.flush()
+    attachments.flush()
+    return {"messages": writer.written, "message_attachments": attachments.written}
+
+
+def drop_search_index(engine) -> None:
+    """Drop MySQL's FULLTEXT index so bulk inserts skip maintaining it."""
+
+    from app.search.messages import FULLTEXT_INDEX
+
+    if engine.dialect.name != "mysql":
+        return
+    with engine.begin() as connection:
+        existing = connection.execute(
+            text(
+                "SELECT 1 FROM information_schema.statistics "
+                "WHERE table_schema = DATABASE() AND table_name = 'messages' "
+                "AND index_name = :name LIMIT 1"
+            ),
+            {"name": FULLTEXT_INDEX},
+        ).first()
+        if existing:
+            connection.execute(text(f"ALTER TABLE messages DROP INDEX {FULLTEXT_INDEX}"))
+
+
@@ -0,0 +1,164 @@
+"""Transactional outbox for Socket.IO broadcasts.
+
+Handlers call :func:`publish` while their transaction is open. Events are held
+on the session and handed to a background dispatcher only when the session
+commits; a rollback drops them, so clients never hear about writes that did
+not happen. The dispatcher drains its queue in batches grouped by room, which
+lets the handler acknowledge its caller without waiting for room fan-out.
+Each room hears its events in the order they were queued. Events published
+with ``coalesce=True`` replace an event of the same name queued just before
+them for the same room, so bursts of full-state updates (contact lists, unread
+counters) go out once without jumping ahead of other events.
+"""
+from __future__ import annotations
+
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app import db, socketio
+from app.utils.metrics import Histogram, register_stats
+
+DEFAULT_MAX_QUEUE = 10000
+
+_PENDING_KEY = "outbox_pending"
+
+# (event, payload, room, coalesce, queued_at)
+OutboxEvent = Tuple[str, Any, str, bool, float]
+
+
+class OutboxDispatcher:
+    """Bounded queue of committed events, emitted from one background task.
+
+    When the queue is full, :meth:`enqueue` emits the oldest queued events
+    inline in the caller instead of dropping events. Emits hold ``_emit_lock``
+    so an inline drain cannot overtake a batch the background task is sending.
+    """
+
+    def __init__(self, max_queue: int = DEFAULT_MAX_QUEUE):
+        self.max_queue = max_queue
+        self._queue: Deque[OutboxEvent] = deque()
+        self._lock = threading.Lock()
+        self._emit_lock = threading.Lock()
+        self._wakeup = None
+        self._running = False
+        self.emit_latency_ms = Histogram()
+        self.dispatched = 0
+        self.coalesced = 0
+        self.overflowed = 0
+        self.failed = 0
+        self.max_depth = 0
+
+    def configure(self, config) -> None:
+        self.max_queue = max(1, config.get("OUTBOX_MAX_QUEUE", DEFAULT_MAX_QUEUE))
+
+    def enqueue(self, events: List[OutboxEvent]) -> None:
+        with self._lock:
+            self._queue.extend(events)
+            self.max_depth = max(self.max_depth, min(len(self._queue), self.max_queue))
+            overflow = len(self._queue) > self.max_queue
+            start = not self._running
+            self._running = True
+            if self._wakeup is None:
+                self._wakeup = socketio.server.eio.create_event()
+        if overflow:
+            self._drain_overflow()
+        self._wakeup.set()
+        if start:
+            socketio.start_background_task(self._run)
+
+    def _drain_overflow(self) -> None:
+        with self._emit_lock:
+            with self._lock:
+                excess = len(self._queue) - self.max_queue
+                batch = [self._queue.popleft() for _ in range(max(0, excess))]
+            if batch:
+                self.overflowed += len(batch)
+                self._emit_batch(batch)
+
+    def _run(self) -> None:
+        while True:
+            self._wakeup.wait()
+            self._wakeup.clear()
+            while True:
+                with self._emit_lock:
+                    with self._lock:
+                        batch = list(self._queue)
+                        self._queue.clear()
+                    if not batch:
+                        break
+                    self._emit_batch(batch)
+
+    def _emit_batch(self, batch: List[OutboxEvent]) -> None:
+        by_room: Dict[str, List[OutboxEvent]] = {}
+        for item in batch:
+            name, _, room, coalesce, _ = item
+            room_events = by_room.setdefault(room, [])
+            previous = room_events[-1] if room_events else None
+            if coalesce and previous is not None and previous[0] == name and previous[3]:
+                self.coalesced += 1
+                room_events[-1] = item
+            else:
+                room_events.append(item)
+        for room, room_events in by_room.items():
+            for name, payload, _, _, queued_at in room_events:
+                try:
+                    socketio.emit(name, payload, room=room)
+                except Exception:
+                    self.failed += 1
+                    continue
+                self.dispatched += 1
+                self.emit_latency_ms.observe((time.monotonic() - queued_at) * 1000)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queue_depth": len(self._queue),
+            "max_depth": self.max_depth,
+            "max_queue": self.max_queue,
+            "dispatched": self.dispatched,
+            "coalesced": self.coalesced,
+            "overflowed": self.overflowed,
+            "failed": self.failed,
+            "emit_latency_ms": self.emit_latency_ms.snapshot(),
+        }
+
+
+dispatcher = OutboxDispatcher()
+register_stats("outbox", dispatcher.stats)
+
+
+def publish(
+    name: str,
+    payload: Any,
+    room: str,
+    coalesce: bool = False,
+    session: Optional[Session] = None,
+) -> None:
+    """Emit ``name`` to ``room`` once the current transaction commits."""
+
+    session = session if session is not None else db.session()
+    session.info.setdefault(_PENDING_KEY, []).append(
+        (name, payload, room, coalesce, time.monotonic())
+    )
+
+
+def send(name: str, payload: Any, room: str, coalesce: bool = False) -> None:
+    """Queue an event that does not depend on any database write."""
+
+    dispatcher.enqueue([(name, payload, room, coalesce, time.monotonic())])
+
+
+@event.listens_for(Session, "after_commit")
+def _dispatch_pending(session: Session) -> None:
+    pending = session.info.pop(_PENDING_KEY, None)
+    if pending:
+        dispatcher.enqueue(pending)
+
+
+@event.listens_for(Session, "after_rollback")
+def _drop_pending(session: Session) -> None:
+    session.info.pop(_PENDING_KEY, None)
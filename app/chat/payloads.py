@@ -0,0 +1,111 @@
+"""Normalized payloads for connections that ask for them.
+
+Chat history and initial state repeat the full public user dict (bio, avatar
+URL, last_seen) for every message sender, member, partner and creator. A
+client that sends ``{"normalized": true}`` with ``initialize`` instead
+receives those frames with a single top-level ``users`` map keyed by user id;
+messages keep ``sender_id`` only, ``forwarded_from`` carries ``sender_id``,
+members carry ``user_id`` and chats carry ``partner_id``/``creator_id``. Other
+events keep the full shape.
+"""
+from __future__ import annotations
+
+import threading
+from typing import Any, Dict, Optional, Set
+
+from app.utils import serialization
+from app.utils.metrics import register_stats
+
+UserMap = Dict[str, Dict[str, Any]]
+
+_normalized_sids: Set[str] = set()
+_lock = threading.Lock()
+_savings: Dict[str, Dict[str, int]] = {}
+
+
+def set_normalized(sid: str, enabled: bool) -> None:
+    if enabled:
+        _normalized_sids.add(sid)
+    else:
+        _normalized_sids.discard(sid)
+
+
+def wants_normalized(sid: Optional[str]) -> bool:
+    return sid in _normalized_sids
+
+
+def _take_user(holder: Dict[str, Any], key: str, id_key: str, users: UserMap, seen: Dict[str, int]) -> None:
+    user = holder.pop(key, None)
+    if user is None:
+        holder.setdefault(id_key, None)
+        return
+    user_id = str(user["id"])
+    users.setdefault(user_id, user)
+    seen[user_id] = seen.get(user_id, 0) + 1
+    holder[id_key] = user["id"]
+
+
+def _normalize_message(message: Optional[Dict[str, Any]], users: UserMap, seen: Dict[str, int]) -> None:
+    if not message:
+        return
+    _take_user(message, "sender", "sender_id", users, seen)
+    forwarded = message.get("forwarded_from")
+    if forwarded:
+        _take_user(forwarded, "sender", "sender_id", users, seen)
+
+
+def _normalize_chat(chat: Dict[str, Any], users: UserMap, seen: Dict[str, int]) -> None:
+    for member in chat.get("members") or []:
+        _take_user(member, "user", "user_id", users, seen)
+    _take_user(chat, "partner", "partner_id", users, seen)
+    _take_user(chat, "creator", "creator_id", users, seen)
+    _normalize_message(chat.get("last_message"), users, seen)
+
+
+def _record_savings(event: str, users: UserMap, seen: Dict[str, int]) -> None:
+    # Every repeat of a user dict after its first is the byte cost normalization removed.
+    saved = sum(
+        (seen[user_id] - 1) * len(serialization.dumps(user))
+        for user_id, user in users.items()
+        if seen[user_id] > 1
+    )
+    with _lock:
+        entry = _savings.setdefault(event, {"frames": 0, "users": 0, "bytes_saved": 0})
+        entry["frames"] += 1
+        entry["users"] += len(users)
+        entry["bytes_saved"] += saved
+
+
+def normalize_history(event: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+    """Rewrite a ``chat:history`` frame in place and attach its ``users`` map."""
+
+    users: UserMap = {}
+    seen: Dict[str, int] = {}
+    if payload.get("chat"):
+        _normalize_chat(payload["chat"], users, seen)
+    for message in payload.get("messages") or []:
+        _normalize_message(message, users, seen)
+    payload["users"] = users
+    _record_savings(event, users, seen)
+    return payload
+
+
+def normalize_state(event: str, state: Dict[str, Any]) -> Dict[str, Any]:
+    """Rewrite initial state chats in place and attach their ``users`` map."""
+
+    users: UserMap = {}
+    seen: Dict[str, int] = {}
+    for chat in state.get("chats") or []:
+        _normalize_chat(chat, users, seen)
+    state["users"] = users
+    _record_savings(event, users, seen)
+    return state
+
+
+def normalization_stats() -> Dict[str, Any]:
+    with _lock:
+        events = {name: dict(entry) for name, entry in _savings.items()}
+    return {"connections": len(_normalized_sids), "events": events}
+
+
+register_stats("payloads", normalization_stats)
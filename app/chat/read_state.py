@@ -0,0 +1,198 @@
+"""Per-member read cursors and materialized unread counters.
+
+``ChatMember.unread_count`` is adjusted in the same transaction as message
+inserts and deletions, so chat summaries read it without counting messages.
+``chat:mark_read`` calls are buffered in memory and flushed together after a
+short interval: a user scrolling through a conversation produces one write and
+one ``chat:read`` receipt per chat per interval instead of one per call.
+New messages also send ``chat:activity`` with the member's unread count to
+members whose sockets have not joined the chat's room (see
+:mod:`app.chat.subscriptions`).
+"""
+from __future__ import annotations
+
+import threading
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+
+from sqlalchemy import case, func, or_, select
+
+from app import db, socketio
+from app.chat import outbox
+from app.chat.subscriptions import chat_subscriptions
+from app.models import Chat, ChatMember, Message
+from app.utils.datetime import to_utc_iso
+
+READ_FLUSH_INTERVAL = 0.5
+
+_chats = Chat.__table__
+_members = ChatMember.__table__
+
+
+def record_message_sent(chat_id: int, sender_id: int, seq: int) -> None:
+    """Bump unread counters for everyone but the sender and move the sender's cursor."""
+
+    is_sender = _members.c.user_id == sender_id
+    db.session.execute(
+        _members.update()
+        .where(_members.c.chat_id == chat_id)
+        .values(
+            unread_count=case((is_sender, 0), else_=func.coalesce(_members.c.unread_count, 0) + 1),
+            last_read_seq=case((is_sender, seq), else_=_members.c.last_read_seq),
+        )
+    )
+    _publish_activity(chat_id, seq)
+
+
+def _publish_activity(chat_id: int, seq: int) -> None:
+    """Tell members whose sockets are outside the chat's room that it moved on."""
+
+    if not chat_subscriptions.has_sockets():
+        return
+    updated_at = to_utc_iso(datetime.utcnow())
+    rows = db.session.execute(
+        select(_members.c.user_id, _members.c.unread_count).where(_members.c.chat_id == chat_id)
+    )
+    for user_id, unread in rows:
+        if chat_subscriptions.needs_activity(user_id, chat_id):
+            outbox.publish(
+                "chat:activity",
+                {"chat_id": chat_id, "last_seq": seq, "unread_count": unread or 0, "updated_at": updated_at},
+                room=f"user_{user_id}",
+            )
+
+
+def record_message_deleted(message: Message) -> None:
+    """Drop a deleted message from the unread count of members who had not read it."""
+
+    if message.seq is None:
+        return
+    db.session.execute(
+        _members.update()
+        .where(
+            _members.c.chat_id == message.chat_id,
+            _members.c.user_id != message.sender_id,
+            _members.c.unread_count > 0,
+            or_(_members.c.last_read_seq.is_(None), _members.c.last_read_seq < message.seq),
+        )
+        .values(unread_count=_members.c.unread_count - 1)
+    )
+
+
+def _apply_cursor(chat_id: int, user_id: int, seq: int, read_at: datetime) -> Optional[int]:
+    # Seqs are dense per chat and sending moves the sender's own cursor, so
+    # everything past ``seq`` counts as unread (deleted messages included
+    # until the cursor passes them) without counting the messages.
+    last_seq = select(_chats.c.last_seq).where(_chats.c.id == chat_id).scalar_subquery()
+    unread = case((last_seq > seq, last_seq - seq), else_=0)
+    result = db.session.execute(
+        _members.update()
+        .where(
+            _members.c.chat_id == chat_id,
+            _members.c.user_id == user_id,
+            or_(_members.c.last_read_seq.is_(None), _members.c.last_read_seq < seq),
+        )
+        .values(last_read_seq=seq, last_read_at=read_at, unread_count=unread)
+    )
+    if not result.rowcount:
+        return None
+    return db.session.execute(
+        select(_members.c.unread_count).where(
+            _members.c.chat_id == chat_id, _members.c.user_id == user_id
+        )
+    ).scalar()
+
+
+class ReadCursorBuffer:
+    """Coalesces read-cursor updates and flushes them from a background task."""
+
+    def __init__(self, interval: float = READ_FLUSH_INTERVAL):
+        self.interval = interval
+        self._pending: Dict[Tuple[int, int], Tuple[int, datetime]] = {}
+        self._lock = threading.Lock()
+        self._scheduled = False
+        self.flushes = 0
+        self.coalesced = 0
+        self.failures = 0
+
+    def pending_seq(self, chat_id: int, user_id: int) -> Optional[int]:
+        entry = self._pending.get((chat_id, user_id))
+        return entry[0] if entry else None
+
+    def mark(self, app, chat_id: int, user_id: int, seq: int) -> None:
+        with self._lock:
+            current = self._pending.get((chat_id, user_id))
+            if current is not None:
+                self.coalesced += 1
+                if current[0] >= seq:
+                    return
+            self._pending[(chat_id, user_id)] = (seq, datetime.utcnow())
+            schedule = not self._scheduled
+            self._scheduled = True
+        if schedule:
+            socketio.start_background_task(self._flush_later, app)
+
+    def _flush_later(self, app) -> None:
+        socketio.sleep(self.interval)
+        with app.app_context():
+            try:
+                self.flush()
+            except Exception:
+                db.session.rollback()
+                app.logger.exception("Failed to flush read cursors; retrying with the next flush.")
+                with self._lock:
+                    schedule = bool(self._pending) and not self._scheduled
+                    self._scheduled = self._scheduled or schedule
+                if schedule:
+                    socketio.start_background_task(self._flush_later, app)
+
+    def flush(self) -> None:
+        with self._lock:
+            batch, self._pending = self._pending, {}
+            self._scheduled = False
+        if not batch:
+            return
+        try:
+            self._write(batch)
+        except Exception:
+            self.failures += 1
+            self._restore(batch)
+            raise
+        self.flushes += 1
+
+    def _restore(self, batch: Dict[Tuple[int, int], Tuple[int, datetime]]) -> None:
+        """Put a batch that failed to commit back, unless newer cursors replaced it."""
+
+        with self._lock:
+            for key, entry in batch.items():
+                current = self._pending.get(key)
+                if current is None or current[0] < entry[0]:
+                    self._pending[key] = entry
+
+    def _write(self, batch: Dict[Tuple[int, int], Tuple[int, datetime]]) -> None:
+        for (chat_id, user_id), (seq, read_at) in batch.items():
+            unread = _apply_cursor(chat_id, user_id, seq, read_at)
+            if unread is None:
+                continue
+            outbox.publish(
+                "chat:read",
+                {"chat_id": chat_id, "user_id": user_id, "last_read_seq": seq},
+                room=f"chat_{chat_id}",
+            )
+            outbox.publish(
+                "chat:unread",
+                {"chat_id": chat_id, "unread_count": unread, "last_read_seq": seq},
+                room=f"user_{user_id}",
+            )
+        db.session.commit()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "pending": len(self._pending),
+            "flushes": self.flushes,
+            "coalesced": self.coalesced,
+            "failures": self.failures,
+        }
+
+
+read_cursors = ReadCursorBuffer()
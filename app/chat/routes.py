@@ -1,18 +1,32 @@
-import base64
 import binascii
-import json
+import hmac
 import os
 from datetime import datetime
 from io import BytesIO
-from typing import Any, Dict, List, Optional, Set, Tuple
-
-from flask import Blueprint, abort, current_app, render_template, request, send_from_directory
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from flask import (
+    Blueprint,
+    Response,
+    abort,
+    current_app,
+    jsonify,
+    render_template,
+    request,
+    send_from_directory,
+)
 from flask_login import current_user, login_required
-from flask_socketio import join_room, leave_room
-from sqlalchemy import and_, func, or_
+from flask_wtf.csrf import generate_csrf
+from sqlalchemy import and_, delete, func, or_, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import selectinload
 from werkzeug.datastructures import FileStorage
 
-from app import db, socketio
+from app import db, jobs, socketio
+from app.chat import outbox, payloads
+from app.chat.read_state import read_cursors, record_message_deleted, record_message_sent
+from app.chat.subscriptions import chat_subscriptions
+from app.chat.write_batcher import MessageWriteTimeout, PendingMessage, message_writes
 from app.models import (
     Avatar,
     BlockedUser,
@@ -31,21 +45,62 @@ from app.models.user import (
     DEFAULT_TIMEZONE_MODE,
     DEFAULT_TIMEZONE_OFFSET,
 )
+from app.search import drop_chat_entries, search_messages, user_index
+from app.utils import serialization
+from app.utils.cache import TTLCache
 from app.utils.datetime import to_utc_iso
+from app.utils.identity import find_user_by_username, resolve_users
+from app.utils.instrumentation import instrumentation
+from app.utils.metrics import collect_stats, register_stats
+from app.utils.offload import b64decode
+from app.utils.rate_limit import rate_limited, rate_limiter
+from app.utils.replica import incidental_write, replica_reads
+from app.utils.slow_events import profiler
+from app.utils.user_cache import user_cards
 from app.utils.storage import (
-    duplicate_message_file,
+    STAGING_CATEGORY,
+    copy_message_file,
+    new_avatar_filename,
+    plan_message_copy,
+    promote_staged,
     remove_file,
-    save_avatar,
     save_message_image,
+    stage_upload,
+    write_upload,
 )
 
 VALID_TIMEZONE_MODES = {"system", "custom"}
 MIN_TIMEZONE_OFFSET = -12 * 60
 MAX_TIMEZONE_OFFSET = 14 * 60
 TIMEZONE_STEP = 30
+INVITE_INSERT_CHUNK = 500
+CLIENT_REF_MAX_LENGTH = 64
+SEND_DEDUPE_WINDOW = 10 * 60
+SEND_DEDUPE_SIZE = 10000
+FETCH_RANGE_LIMIT = 200
 
 chat_bp = Blueprint("chat", __name__)
 
+# Loader options for message lists, so attachments and forwarded originals come in one
+# query per list instead of one per message.
+_MESSAGE_LOADS = (selectinload(Message.attachments), selectinload(Message.forwarded_from))
+
+# Latest contacts:search generation per socket; older in-flight searches are dropped.
+_contact_search_generations: Dict[str, int] = {}
+
+# Forwarded attachment copies not yet written by files.copy_attachments; served as pending.
+_pending_copies: Set[str] = set()
+
+# (sender_id, client_ref) -> message id for recently stored sends, so retries are not re-inserted.
+_recent_sends = TTLCache(SEND_DEDUPE_SIZE, SEND_DEDUPE_WINDOW)
+_send_dedupe_counters = {"constraint_hits": 0, "stored_hits": 0}
+register_stats(
+    "send_dedupe",
+    lambda: {**_recent_sends.stats(), **_send_dedupe_counters},
+)
+register_stats("read_cursors", read_cursors.stats)
+register_stats("message_batching", message_writes.stats)
+
 
 def _are_mutual_friends(user_id: int, other_user_id: int) -> bool:
     if user_id == other_user_id:
@@ -56,34 +111,62 @@ def _are_mutual_friends(user_id: int, other_user_id: int) -> bool:
     )
 
 
-def _serialize_member(member: ChatMember) -> Dict[str, Any]:
+def _mutual_friend_ids(user_id: int, other_user_ids: Iterable[int]) -> Set[int]:
+    """The ids among ``other_user_ids`` that are mutual friends of ``user_id``, in one query."""
+
+    other_ids = set(other_user_ids)
+    mutual = {user_id} & other_ids
+    other_ids.discard(user_id)
+    if not other_ids:
+        return mutual
+    rows = db.session.query(Friendship.user_id, Friendship.friend_id).filter(
+        or_(
+            and_(Friendship.user_id == user_id, Friendship.friend_id.in_(other_ids)),
+            and_(Friendship.friend_id == user_id, Friendship.user_id.in_(other_ids)),
+        )
+    )
+    outgoing: Set[int] = set()
+    incoming: Set[int] = set()
+    for owner_id, friend_id in rows:
+        if owner_id == user_id:
+            outgoing.add(friend_id)
+        else:
+            incoming.add(owner_id)
+    return mutual | (outgoing & incoming)
+
+
+def _serialize_member(member: ChatMember, card: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
     return {
         "id": member.id,
-        "user": member.user.to_public_dict(),
+        "user": card if card is not None else user_cards.get_card(member.user_id),
         "is_admin": member.is_admin,
         "is_owner": member.is_owner,
         "joined_at": to_utc_iso(member.joined_at),
     }
 
 
-def _chat_partner(members: List[ChatMember], user_id: int) -> Optional[User]:
-    for member in members:
-        if member.user_id != user_id:
-            return member.user
-    return None
+def _serialize_members(members: List[ChatMember]) -> List[Dict[str, Any]]:
+    cards = user_cards.get_cards([member.user_id for member in members])
+    return [_serialize_member(member, cards.get(member.user_id)) for member in members]
 
 
-def _serialize_message(message: Message) -> Dict[str, Any]:
+def _serialize_message(message: Message, cards: Optional[Dict[int, Dict[str, Any]]] = None) -> Dict[str, Any]:
+    def card(user_id: int) -> Optional[Dict[str, Any]]:
+        return cards.get(user_id) if cards is not None else user_cards.get_card(user_id)
+
     payload = message.to_dict()
-    payload["sender"] = message.sender.to_public_dict() if message.sender else None
+    if _pending_copies:
+        for attachment in payload["attachments"]:
+            if attachment["filename"] in _pending_copies:
+                attachment["url"] = None
+                attachment["pending"] = True
+    payload["sender"] = card(message.sender_id)
     if message.forwarded_from_id:
         origin = message.forwarded_from
         forwarded_payload: Dict[str, Any] = {"id": message.forwarded_from_id}
         if origin:
             forwarded_payload["chat_id"] = origin.chat_id
-            forwarded_payload["sender"] = (
-                origin.sender.to_public_dict() if origin.sender else None
-            )
+            forwarded_payload["sender"] = card(origin.sender_id)
         else:
             forwarded_payload["chat_id"] = None
             forwarded_payload["sender"] = None
@@ -93,43 +176,130 @@ def _serialize_message(message: Message) -> Dict[str, Any]:
     return payload
 
 
+def _message_user_ids(messages: Iterable[Message]) -> List[int]:
+    user_ids: List[int] = []
+    for message in messages:
+        user_ids.append(message.sender_id)
+        if message.forwarded_from_id and message.forwarded_from is not None:
+            user_ids.append(message.forwarded_from.sender_id)
+    return user_ids
+
+
+def _serialize_messages(messages: List[Message]) -> List[Dict[str, Any]]:
+    """Serialize ``messages`` with one card lookup for all of their senders."""
+
+    cards = user_cards.get_cards(_message_user_ids(messages))
+    return [_serialize_message(message, cards) for message in messages]
+
+
 def _can_manage_message(message: Message, user: User) -> bool:
     if not message or not user:
         return False
     return message.sender_id == user.id
 
 
+def _unread_state(chat: Chat, members: List[ChatMember], user_id: int) -> Tuple[int, Optional[int]]:
+    membership = next((member for member in members if member.user_id == user_id), None)
+    if membership is None:
+        return 0, None
+    pending_seq = read_cursors.pending_seq(chat.id, user_id)
+    if pending_seq is not None and pending_seq >= (chat.last_seq or 0):
+        return 0, pending_seq
+    return membership.unread_count or 0, membership.last_read_seq
+
+
+def _latest_messages(chat_ids: List[int]) -> Dict[int, Message]:
+    """The newest message of each chat in ``chat_ids``, in one query."""
+
+    if not chat_ids:
+        return {}
+    newest = (
+        db.session.query(Message.chat_id, func.max(Message.seq).label("seq"))
+        .filter(Message.chat_id.in_(chat_ids))
+        .group_by(Message.chat_id)
+        .subquery()
+    )
+    messages = Message.query.options(*_MESSAGE_LOADS).join(
+        newest, and_(Message.chat_id == newest.c.chat_id, Message.seq == newest.c.seq)
+    )
+    return {message.chat_id: message for message in messages}
+
+
+def _serialize_chat_summaries(chats: List[Chat], user: User) -> List[Dict[str, Any]]:
+    """Serialize ``chats`` for ``user`` with a fixed number of queries however many there are."""
+
+    if not chats:
+        return []
+    chat_ids = [chat.id for chat in chats]
+    members_by_chat: Dict[int, List[ChatMember]] = {chat_id: [] for chat_id in chat_ids}
+    for member in ChatMember.query.filter(ChatMember.chat_id.in_(chat_ids)).order_by(
+        ChatMember.joined_at.asc(), ChatMember.id.asc()
+    ):
+        members_by_chat[member.chat_id].append(member)
+    latest_by_chat = _latest_messages(chat_ids)
+    partner_ids: Dict[int, Optional[int]] = {}
+    for chat in chats:
+        if not chat.is_group:
+            partner_ids[chat.id] = next(
+                (member.user_id for member in members_by_chat[chat.id] if member.user_id != user.id), None
+            )
+    cards = user_cards.get_cards(
+        [member.user_id for members in members_by_chat.values() for member in members]
+        + [chat.creator_id for chat in chats if chat.creator_id]
+        + _message_user_ids(latest_by_chat.values())
+    )
+    mutual_ids = _mutual_friend_ids(user.id, [partner_id for partner_id in partner_ids.values() if partner_id])
+    summaries = []
+    for chat in chats:
+        members = members_by_chat[chat.id]
+        partner_id = partner_ids.get(chat.id)
+        partner = cards.get(partner_id)
+        unread_count, last_read_seq = _unread_state(chat, members, user.id)
+        latest_message = latest_by_chat.get(chat.id)
+        last_timestamp = to_utc_iso(latest_message.created_at if latest_message else chat.created_at)
+        summaries.append(
+            {
+                "id": chat.id,
+                "is_group": chat.is_group,
+                "name": chat.name
+                if chat.is_group and chat.name
+                else (partner["display_name"] if partner else "Conversation"),
+                "created_at": to_utc_iso(chat.created_at),
+                "updated_at": last_timestamp,
+                "last_seq": chat.last_seq or 0,
+                "unread_count": unread_count,
+                "last_read_seq": last_read_seq,
+                "members": [_serialize_member(member, cards.get(member.user_id)) for member in members],
+                "partner": partner,
+                "last_message": _serialize_message(latest_message, cards) if latest_message else None,
+                "can_message": chat.is_group or (partner and partner_id in mutual_ids),
+                "creator": cards.get(chat.creator_id),
+            }
+        )
+    return summaries
+
+
 def _serialize_chat_summary(chat: Chat, user: User) -> Dict[str, Any]:
-    members = list(chat.members.order_by(ChatMember.joined_at.asc()))
-    partner = _chat_partner(members, user.id) if not chat.is_group else None
-    latest_message = chat.messages.order_by(Message.created_at.desc()).first()
-    last_timestamp = to_utc_iso(latest_message.created_at if latest_message else chat.created_at)
-    return {
-        "id": chat.id,
-        "is_group": chat.is_group,
-        "name": chat.name
-        if chat.is_group and chat.name
-        else (partner.display_name if partner else "Conversation"),
-        "created_at": to_utc_iso(chat.created_at),
-        "updated_at": last_timestamp,
-        "members": [_serialize_member(member) for member in members],
-        "partner": partner.to_public_dict() if partner else None,
-        "last_message": _serialize_message(latest_message) if latest_message else None,
-        "can_message": chat.is_group or (partner and _are_mutual_friends(user.id, partner.id)),
-        "creator": chat.creator.to_public_dict() if chat.creator else None,
-    }
+    return _serialize_chat_summaries([chat], user)[0]
 
 
 def _serialize_chat_detail(chat: Chat, user: User) -> Dict[str, Any]:
     summary = _serialize_chat_summary(chat, user)
-    summary["members"] = [_serialize_member(member) for member in chat.members.order_by(ChatMember.joined_at.asc())]
+    summary["members"] = _serialize_members(chat.members.order_by(ChatMember.joined_at.asc()).all())
     return summary
 
 
-def _serialize_group_invite(invite: GroupInvite) -> Dict[str, Any]:
-    group = invite.group
-    if group is None and invite.chat_id:
-        group = Chat.query.get(invite.chat_id)
+def _serialize_group_invite(
+    invite: GroupInvite,
+    group: Optional[Chat] = None,
+    cards: Optional[Dict[int, Dict[str, Any]]] = None,
+) -> Dict[str, Any]:
+    if group is None:
+        group = invite.group
+        if group is None and invite.chat_id:
+            group = Chat.query.get(invite.chat_id)
+    if cards is None:
+        cards = user_cards.get_cards([invite.inviter_id, invite.invitee_id])
     return {
         "id": invite.id,
         "chat_id": invite.chat_id,
@@ -138,39 +308,61 @@ def _serialize_group_invite(invite: GroupInvite) -> Dict[str, Any]:
         "group_name": group.name if group else None,
         "created_at": to_utc_iso(invite.created_at),
         "status": invite.status,
-        "inviter": invite.inviter.to_public_dict() if invite.inviter else None,
-        "invitee": invite.invitee.to_public_dict() if invite.invitee else None,
+        "inviter": cards.get(invite.inviter_id),
+        "invitee": cards.get(invite.invitee_id),
     }
 
 
+def _serialize_group_invites(invites: List[GroupInvite]) -> List[Dict[str, Any]]:
+    """Serialize ``invites`` with one query for their groups and one card lookup."""
+
+    if not invites:
+        return []
+    chat_ids = {invite.chat_id for invite in invites if invite.chat_id}
+    groups = {chat.id: chat for chat in Chat.query.filter(Chat.id.in_(chat_ids))} if chat_ids else {}
+    cards = user_cards.get_cards(
+        [user_id for invite in invites for user_id in (invite.inviter_id, invite.invitee_id)]
+    )
+    return [_serialize_group_invite(invite, groups.get(invite.chat_id), cards) for invite in invites]
+
+
 def _collect_contacts(user: User) -> Dict[str, Any]:
+    relations = list(user.friends)
+    received = [request_obj for request_obj in user.received_friend_requests if request_obj.status == "pending"]
+    sent = [request_obj for request_obj in user.sent_friend_requests if request_obj.status == "pending"]
+    cards = user_cards.get_cards(
+        [relation.friend_id for relation in relations]
+        + [request_obj.sender_id for request_obj in received]
+        + [request_obj.receiver_id for request_obj in sent]
+    )
     friends = [
         {
             "id": relation.id,
-            "user": relation.friend.to_public_dict(),
+            "user": cards[relation.friend_id],
             "since": to_utc_iso(relation.created_at),
         }
-        for relation in user.friends
+        for relation in relations
+        if relation.friend_id in cards
     ]
     incoming = [
         {
             "id": request_obj.id,
-            "user": request_obj.sender.to_public_dict(),
+            "user": cards[request_obj.sender_id],
             "created_at": to_utc_iso(request_obj.created_at),
             "status": request_obj.status,
         }
-        for request_obj in user.received_friend_requests
-        if request_obj.status == "pending"
+        for request_obj in received
+        if request_obj.sender_id in cards
     ]
     outgoing = [
         {
             "id": request_obj.id,
-            "user": request_obj.receiver.to_public_dict(),
+            "user": cards[request_obj.receiver_id],
             "created_at": to_utc_iso(request_obj.created_at),
             "status": request_obj.status,
         }
-        for request_obj in user.sent_friend_requests
-        if request_obj.status == "pending"
+        for request_obj in sent
+        if request_obj.receiver_id in cards
     ]
     group_invites = _collect_group_invites(user)
     return {
@@ -182,46 +374,10 @@ def _collect_contacts(user: User) -> Dict[str, Any]:
 
 
 def _collect_group_invites(user: User) -> Dict[str, Any]:
-    incoming = [
-        _serialize_group_invite(invite)
-        for invite in GroupInvite.query.filter_by(invitee_id=user.id, status="pending").all()
-    ]
-    outgoing = [
-        _serialize_group_invite(invite)
-        for invite in GroupInvite.query.filter_by(inviter_id=user.id, status="pending").all()
-    ]
-    return {"incoming": incoming, "outgoing": outgoing}
-
-
-def _find_user_by_identifier(identifier: Any) -> Optional[User]:
-    if identifier is None:
-        return None
-    if isinstance(identifier, User):
-        return identifier
-    if isinstance(identifier, dict):
-        if "user_id" in identifier:
-            return _find_user_by_identifier(identifier.get("user_id"))
-        if "username" in identifier:
-            return _find_user_by_identifier(identifier.get("username"))
-    if isinstance(identifier, int):
-        return User.query.get(identifier)
-    if isinstance(identifier, str):
-        value = identifier.strip()
-        if not value:
-            return None
-        if value.isdigit():
-            candidate = User.query.get(int(value))
-            if candidate:
-                return candidate
-        normalized = value.lower().lstrip("@")
-        if not normalized:
-            return None
-        return (
-            User.query.filter(
-                func.lower(User.username).in_([normalized, f"@{normalized}"])
-            ).first()
-        )
-    return None
+    incoming = GroupInvite.query.filter_by(invitee_id=user.id, status="pending").all()
+    outgoing = GroupInvite.query.filter_by(inviter_id=user.id, status="pending").all()
+    serialized = _serialize_group_invites(incoming + outgoing)
+    return {"incoming": serialized[: len(incoming)], "outgoing": serialized[len(incoming) :]}
 
 
 def _resolve_invitees(*values: Any) -> List[User]:
@@ -238,14 +394,7 @@ def _resolve_invitees(*values: Any) -> List[User]:
             identifiers.extend(value.values())
         else:
             identifiers.append(value)
-    resolved: List[User] = []
-    seen_ids = set()
-    for identifier in identifiers:
-        user = _find_user_by_identifier(identifier)
-        if user and user.id not in seen_ids:
-            seen_ids.add(user.id)
-            resolved.append(user)
-    return resolved
+    return resolve_users(identifiers)
 
 
 def _sanitize_timezone_mode(value: Any) -> str:
@@ -283,14 +432,15 @@ def _initial_state_for_user(
     chats_override: Optional[List[Chat]] = None,
     active_tab: Optional[str] = None,
 ) -> Dict[str, Any]:
-    chats = chats_override or (
-        Chat.query.join(ChatMember)
-        .filter(ChatMember.user_id == user.id)
-        .order_by(Chat.created_at.desc())
-        .all()
-    )
-    serialized_chats = [_serialize_chat_summary(chat, user) for chat in chats]
-    contacts = _collect_contacts(user)
+    with replica_reads():
+        chats = chats_override or (
+            Chat.query.join(ChatMember)
+            .filter(ChatMember.user_id == user.id)
+            .order_by(Chat.created_at.desc())
+            .all()
+        )
+        serialized_chats = _serialize_chat_summaries(chats, user)
+        contacts = _collect_contacts(user)
     group_invite_count = len(contacts.get("group_invites", {}).get("incoming", []))
     ui_state: Dict[str, Any] = {
         "activeChatId": active_chat_id,
@@ -322,7 +472,7 @@ def _persist_attachment(payload: Dict[str, Any]) -> Tuple[str, str]:
     if "," in raw_data:
         _, raw_data = raw_data.split(",", 1)
     try:
-        binary = base64.b64decode(raw_data, validate=True)
+        binary = b64decode(raw_data, validate=True)
     except (binascii.Error, ValueError) as exc:
         raise ValueError("Invalid attachment encoding.") from exc
     if not binary:
@@ -334,29 +484,220 @@ def _persist_attachment(payload: Dict[str, Any]) -> Tuple[str, str]:
     return filename, mimetype
 
 
-def _persist_avatar(payload: Dict[str, Any], existing_filename: Optional[str] = None) -> str:
+def _decode_avatar(payload: Dict[str, Any]) -> Tuple[str, bytes]:
+    """Validate an avatar upload and return ``(filename, image_bytes)``."""
     raw_data = payload.get("data")
     if not raw_data:
         raise ValueError("Avatar data missing.")
     name = (payload.get("name") or "avatar").strip() or "avatar"
     if "." not in name:
         name = f"{name}.png"
-    mimetype = payload.get("mimetype") or "image/png"
     if "," in raw_data:
         _, raw_data = raw_data.split(",", 1)
     try:
-        binary = base64.b64decode(raw_data, validate=True)
+        binary = b64decode(raw_data, validate=True)
     except (binascii.Error, ValueError) as exc:
         raise ValueError("Invalid avatar encoding.") from exc
     if not binary:
         raise ValueError("Avatar payload empty.")
-    stream = BytesIO(binary)
-    stream.seek(0)
-    storage = FileStorage(stream=stream, filename=name, content_type=mimetype)
-    return save_avatar(storage, existing_filename=existing_filename)
+    return new_avatar_filename(name), binary
+
+
+def _optional_int(value: Any) -> Optional[int]:
+    try:
+        number = int(value)
+    except (TypeError, ValueError):
+        return None
+    return number if number > 0 else None
+
+
+def _message_search_payload(
+    user: User,
+    query: str,
+    chat_id: Any = None,
+    before: Any = None,
+    limit: Any = None,
+) -> Dict[str, Any]:
+    query = (query or "").strip()
+    if not query:
+        return {"ok": True, "results": [], "next_before": None}
+    found = search_messages(
+        user.id,
+        query,
+        chat_id=_optional_int(chat_id),
+        before_id=_optional_int(before),
+        limit=_optional_int(limit),
+    )
+    cards = user_cards.get_cards(_message_user_ids(message for message, _ in found["hits"]))
+    return {
+        "ok": True,
+        "results": [
+            {"chat_id": message.chat_id, "snippet": snippet, "message": _serialize_message(message, cards)}
+            for message, snippet in found["hits"]
+        ],
+        "terms": found["terms"],
+        "next_before": found["next_before"],
+    }
+
+
+def _create_group_invites(
+    chat: Chat, inviter: User, invitees: List[User], new_chat: bool = False
+) -> List[GroupInvite]:
+    ordered_ids = list(dict.fromkeys(invitee.id for invitee in invitees if invitee.id != inviter.id))
+    if not ordered_ids:
+        return []
+    member_ids: Set[int] = set()
+    existing: Dict[int, GroupInvite] = {}
+    if not new_chat:
+        member_ids = {
+            user_id
+            for (user_id,) in db.session.query(ChatMember.user_id).filter(
+                ChatMember.chat_id == chat.id, ChatMember.user_id.in_(ordered_ids)
+            )
+        }
+        existing = {
+            invite.invitee_id: invite
+            for invite in GroupInvite.query.filter(
+                GroupInvite.chat_id == chat.id, GroupInvite.invitee_id.in_(ordered_ids)
+            )
+        }
+    now = datetime.utcnow()
+    invites_by_user: Dict[int, GroupInvite] = {}
+    fresh_ids: List[int] = []
+    for user_id in ordered_ids:
+        if user_id in member_ids:
+            continue
+        invite = existing.get(user_id)
+        if invite is None:
+            fresh_ids.append(user_id)
+        elif invite.status != "pending":
+            # The (chat_id, invitee_id) pair is unique, so earlier answered invites are reopened.
+            invite.status = "pending"
+            invite.inviter_id = inviter.id
+            invite.created_at = now
+            invite.responded_at = None
+            invites_by_user[user_id] = invite
+    if fresh_ids:
+        db.session.flush()
+        for offset in range(0, len(fresh_ids), INVITE_INSERT_CHUNK):
+            chunk = fresh_ids[offset : offset + INVITE_INSERT_CHUNK]
+            db.session.execute(
+                GroupInvite.__table__.insert().values(
+                    [
+                        {
+                            "chat_id": chat.id,
+                            "inviter_id": inviter.id,
+                            "invitee_id": user_id,
+                            "status": "pending",
+                            "created_at": now,
+                        }
+                        for user_id in chunk
+                    ]
+                )
+            )
+        for invite in GroupInvite.query.filter(
+            GroupInvite.chat_id == chat.id, GroupInvite.invitee_id.in_(fresh_ids)
+        ):
+            invites_by_user[invite.invitee_id] = invite
+    return [invites_by_user[user_id] for user_id in ordered_ids if user_id in invites_by_user]
+
+
+def _delete_chat_messages(chat_id: int) -> None:
+    """Delete a chat's messages, attachments and search entries with set-based statements.
+
+    Left to the ORM cascade, each message is loaded and deleted along with its attachments
+    and search entry one at a time.
+    """
+
+    message_ids = select(Message.id).where(Message.chat_id == chat_id)
+    drop_chat_entries(db.session.connection(), chat_id)
+    db.session.execute(
+        delete(MessageAttachment).where(MessageAttachment.message_id.in_(message_ids)),
+        execution_options={"synchronize_session": False},
+    )
+    # MySQL checks the self-reference row by row, so forwards within the chat would block the delete.
+    db.session.execute(
+        update(Message)
+        .where(Message.chat_id == chat_id, Message.forwarded_from_id.is_not(None))
+        .values(forwarded_from_id=None),
+        execution_options={"synchronize_session": False},
+    )
+    db.session.execute(
+        delete(Message).where(Message.chat_id == chat_id),
+        execution_options={"synchronize_session": False},
+    )
+
+
+def _publish_member_update(chat: Chat) -> None:
+    outbox.publish(
+        "chat:member_update",
+        {
+            "chat_id": chat.id,
+            "members": _serialize_members(chat.members.order_by(ChatMember.joined_at.asc()).all()),
+        },
+        room=f"chat_{chat.id}",
+        coalesce=True,
+    )
+
+
+def _publish_invites_received(invites: List[GroupInvite]) -> List[Dict[str, Any]]:
+    """Publish ``invite:received`` to each invitee and return the serialized invites.
+
+    Callers reuse the result in their reply, since the invites expire on commit and would
+    otherwise be reloaded one by one.
+    """
+
+    serialized = _serialize_group_invites(invites)
+    for invite, payload in zip(invites, serialized):
+        outbox.publish("invite:received", {"invite": payload}, room=f"user_{invite.invitee_id}")
+    return serialized
+
+
+def _normalize_client_ref(value: Any) -> Optional[str]:
+    if value is None or isinstance(value, (dict, list, bool)):
+        return None
+    text = str(value).strip()
+    if not text or len(text) > CLIENT_REF_MAX_LENGTH:
+        return None
+    return text
+
+
+def _duplicate_send_reply(message: Message, client_ref: Any) -> Dict[str, Any]:
+    """Answer a retried send with its stored message, broadcasting it if nobody has yet."""
+
+    payload = _serialize_message(message)
+    payload["client_ref"] = client_ref
+    if message_writes.take_late_commit(message.id):
+        # The first attempt timed out before broadcasting; its batch committed later.
+        outbox.send("new_message", payload, room=f"chat_{message.chat_id}")
+    return {"ok": True, "message": payload, "duplicate": True}
+
+
+def _recent_send(sender_id: int, client_ref: str, chat_id: int) -> Optional[Message]:
+    message_id = _recent_sends.get((sender_id, client_ref))
+    if message_id is not None:
+        message = Message.query.get(message_id)
+    else:
+        # Retries after the window or a restart: the unique (sender_id, client_ref) index
+        # still finds the original before any attachment is written again.
+        message = Message.query.filter_by(sender_id=sender_id, client_ref=client_ref).first()
+        if message is not None:
+            _send_dedupe_counters["stored_hits"] += 1
+            _recent_sends.put((sender_id, client_ref), message.id)
+    if message is None or message.chat_id != chat_id:
+        return None
+    return message
 
 
 def _broadcast_contacts(user: User) -> None:
+    jobs.enqueue("contacts.broadcast", {"user_id": user.id}, dedupe_key=str(user.id))
+
+
+@jobs.task("contacts.broadcast", queue="broadcasts")
+def _broadcast_contacts_job(user_id: int) -> None:
+    user = User.query.get(user_id)
+    if user is None:
+        return
     contacts = _collect_contacts(user)
     payload = {"contacts": contacts}
     friend_pending = len(contacts.get("incoming", []))
@@ -364,7 +705,68 @@ def _broadcast_contacts(user: User) -> None:
     payload["pendingCount"] = friend_pending
     payload["pendingGroupInvites"] = group_pending
     payload["pendingTotal"] = friend_pending + group_pending
-    socketio.emit("contacts:update", payload, room=f"user_{user.id}")
+    outbox.publish("contacts:update", payload, room=f"user_{user.id}", coalesce=True)
+
+
+def _self_payload(user: User) -> Dict[str, Any]:
+    payload = user.to_public_dict()
+    payload["email"] = user.email
+    payload["settings"] = user.settings_payload()
+    return payload
+
+
+@jobs.task("files.remove", queue="files")
+def _remove_file_job(category: str, filename: str) -> None:
+    remove_file(category, filename)
+
+
+@jobs.task("files.copy_attachments", queue="files")
+def _copy_attachments_job(message_id: int, copies: List[List[str]]) -> None:
+    for source, copy_name in copies:
+        copy_message_file(source, copy_name)
+        _pending_copies.discard(copy_name)
+    message = Message.query.get(message_id)
+    if message is not None and not message.is_deleted:
+        outbox.publish("message:updated", _serialize_message(message), room=f"chat_{message.chat_id}")
+
+
+@jobs.task("avatars.store", queue="files")
+def _store_avatar_job(user_id: int, filename: str, staged: Optional[str] = None, data: Optional[str] = None) -> None:
+    user = User.query.get(user_id)
+    if user is None:
+        if staged:
+            remove_file(STAGING_CATEGORY, staged)
+        return
+    if data is not None:
+        # Enqueued before avatars were staged on disk, with the image in the payload.
+        write_upload("avatars", filename, b64decode(data))
+    elif not promote_staged(staged, "avatars", filename):
+        current_app.logger.warning("Staged avatar %s for user %s is missing.", staged, user_id)
+        return
+    if user.avatar:
+        if user.avatar.filename != filename:
+            jobs.enqueue("files.remove", {"category": "avatars", "filename": user.avatar.filename})
+        user.avatar.filename = filename
+        user.avatar.created_at = datetime.utcnow()
+    else:
+        avatar = Avatar(filename=filename)
+        db.session.add(avatar)
+        db.session.flush()
+        user.avatar = avatar
+    db.session.flush()
+    outbox.publish("profile:update", {"user": _self_payload(user)}, room=f"user_{user.id}", coalesce=True)
+
+
+@chat_bp.before_app_request
+def start_job_runner():
+    # Picks up jobs left pending by a previous process as soon as the server takes traffic.
+    jobs.job_runner.start(current_app._get_current_object())
+
+
+@chat_bp.before_app_request
+def warm_user_index():
+    # Builds the contact search index in the background before the first search needs it.
+    user_index.warm(current_app._get_current_object())
 
 
 @chat_bp.before_app_request
@@ -372,6 +774,7 @@ def update_last_seen():
     if current_user.is_authenticated:
         current_user.last_seen = datetime.utcnow()
         current_user.online = True
+        incidental_write()
         db.session.commit()
 
 
@@ -391,7 +794,7 @@ def chat_app(chat_id: Optional[int] = None, tab: str = "chats"):
         active_chat_id=resolved_chat_id,
         active_tab=active_tab,
     )
-    state_json = json.dumps(initial_state, separators=(",", ":"))
+    state_json = serialization.dumps(initial_state, separators=(",", ":"))
     return render_template("chat/app.html", initial_state=state_json)
 
 
@@ -405,34 +808,92 @@ def media(category: str, filename: str):
     return send_from_directory(os.path.join(directory, category), filename)
 
 
+@chat_bp.route("/admin/stats")
+@login_required
+def admin_stats():
+    if not current_user.is_admin:
+        abort(403)
+    return jsonify(collect_stats())
+
+
+@chat_bp.route("/admin/profiler", methods=["GET", "POST"])
+@login_required
+def admin_profiler():
+    if not current_user.is_admin:
+        abort(403)
+    if request.method == "POST":
+        data = request.get_json(silent=True) or {}
+        try:
+            sample_percent = float(data["sample_percent"]) if "sample_percent" in data else None
+        except (TypeError, ValueError):
+            return jsonify({"ok": False, "error": "sample_percent must be a number."}), 400
+        profiler.set(bool(data.get("enabled")), sample_percent)
+    # The global CSRFProtect checks POSTs; scripts send this token back as X-CSRFToken.
+    return jsonify({"ok": True, **profiler.stats(), "csrf_token": generate_csrf()})
+
+
+@chat_bp.route("/metrics")
+def metrics():
+    token = current_app.config.get("METRICS_TOKEN")
+    if token:
+        supplied = request.headers.get("Authorization", "").removeprefix("Bearer ").strip()
+        if not hmac.compare_digest(supplied.encode(), token.encode()):
+            abort(401)
+    elif not (current_user.is_authenticated and current_user.is_admin):
+        abort(403)
+    return Response(
+        instrumentation.prometheus() + rate_limiter.prometheus(), mimetype="text/plain; version=0.0.4"
+    )
+
+
+@chat_bp.route("/search/messages")
+@login_required
+def search_messages_view():
+    return jsonify(
+        _message_search_payload(
+            current_user,
+            request.args.get("q") or request.args.get("query") or "",
+            chat_id=request.args.get("chat_id"),
+            before=request.args.get("before"),
+            limit=request.args.get("limit"),
+        )
+    )
+
+
 def _emit_chat_history(chat: Chat, user: User) -> None:
-    messages = chat.messages.order_by(Message.created_at.asc()).all()
-    socketio.emit(
-        "chat:history",
-        {
+    with replica_reads():
+        messages = chat.messages.options(*_MESSAGE_LOADS).order_by(Message.seq.asc(), Message.id.asc()).all()
+        payload = {
             "ok": True,
             "chat_id": chat.id,
             "chat": _serialize_chat_detail(chat, user),
-            "messages": [_serialize_message(message) for message in messages],
-        },
-        to=request.sid,
-    )
+            "messages": _serialize_messages(messages),
+        }
+    if payloads.wants_normalized(request.sid):
+        payload = payloads.normalize_history("chat:history", payload)
+    socketio.emit("chat:history", payload, to=request.sid)
 
 
 @socketio.on("initialize")
-def handle_initialize(_: Optional[Dict[str, Any]] = None):
+@rate_limited("initialize")
+def handle_initialize(data: Optional[Dict[str, Any]] = None):
     if not current_user.is_authenticated:
         return {"ok": False, "error": "Unauthorized"}
-    join_room(f"user_{current_user.id}")
+    payloads.set_normalized(request.sid, isinstance(data, dict) and bool(data.get("normalized")))
+    # Registered before the state is built, so messages landing meanwhile still reach the
+    # socket as chat:activity.
+    chat_subscriptions.connect(request.sid, current_user.id)
     user_chats = (
         Chat.query.join(ChatMember)
         .filter(ChatMember.user_id == current_user.id)
         .order_by(Chat.created_at.desc())
         .all()
     )
-    for chat in user_chats:
-        join_room(f"chat_{chat.id}")
     state = _initial_state_for_user(current_user, active_chat_id=None, chats_override=user_chats)
+    recent = sorted(state["chats"], key=lambda summary: summary["updated_at"] or "", reverse=True)
+    chat_subscriptions.subscribe_recent(request.sid, current_user.id, [summary["id"] for summary in recent])
+    if payloads.wants_normalized(request.sid):
+        state = payloads.normalize_state("initialize", state)
     return {"ok": True, "state": state}
 
 
@@ -460,7 +921,7 @@ def handle_chat_open(data):
         payload["error"] = "Chat not found"
         socketio.emit("chat:history", payload, to=request.sid)
         return payload
-    join_room(f"chat_{chat.id}")
+    chat_subscriptions.subscribe(request.sid, current_user.id, chat.id)
     _emit_chat_history(chat, current_user)
     payload = {
         "ok": True,
@@ -470,6 +931,60 @@ def handle_chat_open(data):
     return payload
 
 
+@socketio.on("chat:fetch_range")
+def handle_chat_fetch_range(data):
+    if not current_user.is_authenticated:
+        return {"ok": False, "error": "Unauthorized"}
+    data = data or {}
+    chat_id = _optional_int(data.get("chat_id"))
+    if not chat_id:
+        return {"ok": False, "error": "Chat ID required"}
+    chat = Chat.query.get(chat_id)
+    if not chat or not chat.has_member(current_user.id):
+        return {"ok": False, "error": "Chat not found"}
+    last_seq = chat.last_seq or 0
+    from_seq = _optional_int(data.get("from_seq")) or 1
+    to_seq = min(_optional_int(data.get("to_seq")) or last_seq, last_seq)
+    if from_seq > to_seq:
+        return {"ok": True, "chat_id": chat.id, "messages": [], "last_seq": last_seq, "has_more": False}
+    messages = (
+        chat.messages.options(*_MESSAGE_LOADS)
+        .filter(Message.seq >= from_seq, Message.seq <= to_seq)
+        .order_by(Message.seq.asc())
+        .limit(FETCH_RANGE_LIMIT + 1)
+        .all()
+    )
+    has_more = len(messages) > FETCH_RANGE_LIMIT
+    messages = messages[:FETCH_RANGE_LIMIT]
+    return {
+        "ok": True,
+        "chat_id": chat.id,
+        "from_seq": from_seq,
+        "to_seq": messages[-1].seq if has_more else to_seq,
+        "last_seq": last_seq,
+        "has_more": has_more,
+        "messages": _serialize_messages(messages),
+    }
+
+
+@socketio.on("chat:mark_read")
+def handle_chat_mark_read(data):
+    if not current_user.is_authenticated:
+        return {"ok": False, "error": "Unauthorized"}
+    data = data if isinstance(data, dict) else {"chat_id": data}
+    chat_id = _optional_int(data.get("chat_id"))
+    if not chat_id:
+        return {"ok": False, "error": "Chat ID required"}
+    chat = Chat.query.get(chat_id)
+    if not chat or not chat.has_member(current_user.id):
+        return {"ok": False, "error": "Chat not found"}
+    last_seq = chat.last_seq or 0
+    seq = min(_optional_int(data.get("seq")) or last_seq, last_seq)
+    if seq:
+        read_cursors.mark(current_app._get_current_object(), chat.id, current_user.id, seq)
+    return {"ok": True, "chat_id": chat.id, "last_read_seq": seq, "caught_up": seq >= last_seq}
+
+
 @socketio.on("chat:leave")
 def handle_chat_leave(data):
     if not current_user.is_authenticated:
@@ -484,7 +999,7 @@ def handle_chat_leave(data):
             chat_id = None
     if not chat_id:
         return {"ok": False, "error": "Chat ID required"}
-    leave_room(f"chat_{chat_id}")
+    chat_subscriptions.unsubscribe(request.sid, chat_id)
     return {"ok": True, "chat_id": chat_id}
 
 
@@ -518,31 +1033,33 @@ def handle_chat_delete(data):
         db.session.delete(membership)
         db.session.flush()
         remaining_members = chat.members.order_by(ChatMember.joined_at.asc()).all()
-        serialized_members = [_serialize_member(member) for member in remaining_members]
+        serialized_members = _serialize_members(remaining_members)
         chat_removed = len(serialized_members) == 0
         if chat_removed:
+            _delete_chat_messages(chat.id)
             db.session.delete(chat)
+        outbox.publish(
+            "chat:deleted",
+            {"chat_id": chat_identifier, "initiator_id": current_user.id},
+            room=f"user_{current_user.id}",
+        )
+        if not chat_removed:
+            outbox.publish(
+                "chat:member_update",
+                {"chat_id": chat_identifier, "members": serialized_members},
+                room=f"chat_{chat_identifier}",
+            )
         db.session.commit()
     except Exception:
         db.session.rollback()
         current_app.logger.exception("Failed to delete chat.")
         return {"ok": False, "error": "Unable to delete conversation."}
-    leave_room(f"chat_{chat_identifier}")
-    socketio.emit(
-        "chat:deleted",
-        {"chat_id": chat_identifier, "initiator_id": current_user.id},
-        room=f"user_{current_user.id}",
-    )
-    if not chat_removed:
-        socketio.emit(
-            "chat:member_update",
-            {"chat_id": chat_identifier, "members": serialized_members},
-            room=f"chat_{chat_identifier}",
-        )
+    chat_subscriptions.unsubscribe(request.sid, chat_identifier)
     return {"ok": True, "chat_id": chat_identifier, "deleted": chat_removed}
 
 
 @socketio.on("chat:typing")
+@rate_limited("typing")
 def handle_chat_typing(data):
     if not current_user.is_authenticated:
         return
@@ -565,6 +1082,7 @@ def handle_chat_typing(data):
 
 
 @socketio.on("chat:stop_typing")
+@rate_limited("typing")
 def handle_chat_stop_typing(data):
     if not current_user.is_authenticated:
         return
@@ -586,7 +1104,26 @@ def handle_chat_stop_typing(data):
     )
 
 
+def _write_message_batched(
+    chat_id: int,
+    sender_id: int,
+    body: Optional[str],
+    client_ref: Optional[str],
+    stored_files: List[Tuple[str, str]],
+) -> Message:
+    # End the read transaction first so the batch commit is visible to the lookup below.
+    db.session.commit()
+    pending = message_writes.submit(
+        current_app._get_current_object(),
+        PendingMessage(chat_id, sender_id, body, client_ref, stored_files),
+    )
+    if pending.error is not None:
+        raise pending.error
+    return Message.query.get(pending.message_id)
+
+
 @socketio.on("send_message")
+@rate_limited("send")
 def handle_send_message(data):
     if not current_user.is_authenticated:
         return {"ok": False, "error": "Unauthorized"}
@@ -594,11 +1131,16 @@ def handle_send_message(data):
     raw_body = (data.get("body") or "").strip()
     attachments_payload = data.get("attachments") or []
     client_ref = data.get("client_ref")
+    dedupe_key = _normalize_client_ref(client_ref)
     if not chat_id:
         return {"ok": False, "error": "Chat ID required"}
     chat = Chat.query.get(chat_id)
     if not chat or not chat.has_member(current_user.id):
         return {"ok": False, "error": "Chat not found"}
+    if dedupe_key:
+        duplicate = _recent_send(current_user.id, dedupe_key, chat.id)
+        if duplicate is not None:
+            return _duplicate_send_reply(duplicate, client_ref)
     if not chat.is_group:
         other_member = chat.members.filter(ChatMember.user_id != current_user.id).first()
         if other_member and not _are_mutual_friends(current_user.id, other_member.user_id):
@@ -630,15 +1172,57 @@ def handle_send_message(data):
                     remove_file("messages", filename)
                 return {"ok": False, "error": "Failed to process attachment."}
 
-    message = Message(chat_id=chat.id, sender_id=current_user.id, body=raw_body or None)
-    db.session.add(message)
+    room = f"chat_{chat.id}"
     try:
-        db.session.flush()
-        for filename, mimetype in stored_files:
-            db.session.add(
-                MessageAttachment(message_id=message.id, filename=filename, mimetype=mimetype)
+        if message_writes.enabled:
+            message = _write_message_batched(
+                chat.id, current_user.id, raw_body or None, dedupe_key, stored_files
             )
-        db.session.commit()
+            payload = _serialize_message(message)
+            if client_ref:
+                payload["client_ref"] = client_ref
+            outbox.send("new_message", payload, room=room)
+        else:
+            message = Message(
+                chat_id=chat.id,
+                sender_id=current_user.id,
+                seq=chat.allocate_seq(),
+                body=raw_body or None,
+                client_ref=dedupe_key,
+            )
+            db.session.add(message)
+            db.session.flush()
+            record_message_sent(chat.id, current_user.id, message.seq)
+            for filename, mimetype in stored_files:
+                db.session.add(
+                    MessageAttachment(message_id=message.id, filename=filename, mimetype=mimetype)
+                )
+            payload = _serialize_message(message)
+            if client_ref:
+                payload["client_ref"] = client_ref
+            outbox.publish("new_message", payload, room=room)
+            db.session.commit()
+    except MessageWriteTimeout:
+        # The batch may still commit with these files, so they stay; a retry finds the row.
+        db.session.rollback()
+        current_app.logger.warning("Message write for chat %s timed out waiting for its batch.", chat.id)
+        return {"ok": False, "error": "Sending is taking longer than usual. Please try again.", "retry": True}
+    except IntegrityError:
+        # A concurrent retry stored the same client_ref between the lookup above and this insert.
+        db.session.rollback()
+        for filename, _ in stored_files:
+            remove_file("messages", filename)
+        original = (
+            Message.query.filter_by(sender_id=current_user.id, client_ref=dedupe_key).first()
+            if dedupe_key
+            else None
+        )
+        if original is None or original.chat_id != chat.id:
+            current_app.logger.exception("Failed to save message.")
+            return {"ok": False, "error": "Failed to send message."}
+        _send_dedupe_counters["constraint_hits"] += 1
+        _recent_sends.put((current_user.id, dedupe_key), original.id)
+        return _duplicate_send_reply(original, client_ref)
     except Exception:
         db.session.rollback()
         for filename, _ in stored_files:
@@ -646,10 +1230,8 @@ def handle_send_message(data):
         current_app.logger.exception("Failed to save message.")
         return {"ok": False, "error": "Failed to send message."}
 
-    payload = _serialize_message(message)
-    if client_ref:
-        payload["client_ref"] = client_ref
-    socketio.emit("new_message", payload, room=f"chat_{chat.id}")
+    if dedupe_key:
+        _recent_sends.put((current_user.id, dedupe_key), message.id)
     return {"ok": True, "message": payload}
 
 
@@ -686,20 +1268,18 @@ def handle_message_edit(data):
     from sqlalchemy.exc import SQLAlchemyError
 
     try:
+        payload = _serialize_message(message)
+        outbox.publish("message:updated", payload, room=f"chat_{message.chat_id}")
         db.session.commit()
     except SQLAlchemyError as e:
         db.session.rollback()
         current_app.logger.exception("Database commit failed during message edit")
         return {"ok": False, "error": f"Database error: {e}"}
-    except Exception as e:
-        # non-DB errors (socket serialization, etc.) shouldn’t block a success
-        current_app.logger.warning(f"Non-critical error after commit: {e}")
-        payload = _serialize_message(message)
-        socketio.emit("message:updated", payload, room=f"chat_{message.chat_id}")
-        return {"ok": True, "message": payload}
+    except Exception:
+        db.session.rollback()
+        current_app.logger.exception("Failed to edit message.")
+        return {"ok": False, "error": "Failed to edit message."}
 
-    payload = _serialize_message(message)
-    socketio.emit("message:updated", payload, room=f"chat_{message.chat_id}")
     return {"ok": True, "message": payload}
 
 
@@ -721,31 +1301,32 @@ def handle_message_delete(data):
     if not _can_manage_message(message, current_user):
         return {"ok": False, "error": "You do not have permission to delete this message."}
 
-    attachments = list(message.attachments)
-    for attachment in attachments:
-        try:
-            if attachment.filename:
-                remove_file("messages", attachment.filename)
-        finally:
-            db.session.delete(attachment)
+    for attachment in list(message.attachments):
+        if attachment.filename:
+            jobs.enqueue("files.remove", {"category": "messages", "filename": attachment.filename})
+        db.session.delete(attachment)
 
     message.body = None
     message.is_deleted = True
     message.edited = False
     message.last_edited_at = datetime.utcnow()
     try:
+        record_message_deleted(message)
+        db.session.flush()
+        db.session.expire(message, ["attachments"])
+        payload = _serialize_message(message)
+        outbox.publish("message:deleted", payload, room=f"chat_{message.chat_id}")
         db.session.commit()
     except Exception:
         db.session.rollback()
         current_app.logger.exception("Failed to delete message.")
         return {"ok": False, "error": "Failed to delete message."}
 
-    payload = _serialize_message(message)
-    socketio.emit("message:deleted", payload, room=f"chat_{message.chat_id}")
     return {"ok": True, "message": payload}
 
 
 @socketio.on("message:forward")
+@rate_limited("forward")
 def handle_message_forward(data):
     if not current_user.is_authenticated:
         return {"ok": False, "error": "Unauthorized"}
@@ -799,70 +1380,84 @@ def handle_message_forward(data):
         return {"ok": False, "error": "This message can no longer be forwarded."}
 
     forwarded_results: List[Tuple[Chat, Message]] = []
-    copied_files: List[str] = []
+    planned_copies: List[str] = []
 
     try:
+        # Targets are checked together: one query each for the chats, their members,
+        # friendships and blocks, however many chats the message goes to.
+        chats = {chat.id: chat for chat in Chat.query.filter(Chat.id.in_(target_ids))}
+        other_members: Dict[int, List[int]] = {chat_id: [] for chat_id in chats}
+        joined: Set[int] = set()
+        for chat_id, user_id in db.session.query(ChatMember.chat_id, ChatMember.user_id).filter(
+            ChatMember.chat_id.in_(list(chats))
+        ):
+            if user_id == current_user.id:
+                joined.add(chat_id)
+            else:
+                other_members[chat_id].append(user_id)
+        if any(chat_id not in chats or chat_id not in joined for chat_id in target_ids):
+            raise ValueError("Chat not found or access denied.")
+        partner_ids = [
+            other_members[chat_id][0] for chat_id, chat in chats.items() if not chat.is_group and other_members[chat_id]
+        ]
+        if len(_mutual_friend_ids(current_user.id, partner_ids)) < len(set(partner_ids)):
+            raise ValueError("You must be friends before you can chat.")
+        recipient_ids = {user_id for member_ids in other_members.values() for user_id in member_ids}
+        if recipient_ids and BlockedUser.query.filter(
+            BlockedUser.user_id.in_(recipient_ids),
+            BlockedUser.blocked_user_id == current_user.id,
+        ).first():
+            raise ValueError("You cannot send messages to this chat right now.")
+
+        source_attachments = list(source.attachments)
         for chat_id in target_ids:
-            chat = Chat.query.get(chat_id)
-            if not chat or not chat.has_member(current_user.id):
-                raise ValueError("Chat not found or access denied.")
-
-            if not chat.is_group:
-                other_member = chat.members.filter(ChatMember.user_id != current_user.id).first()
-                if other_member and not _are_mutual_friends(current_user.id, other_member.user_id):
-                    raise ValueError("You must be friends before you can chat.")
-
-            member_ids = [member.user_id for member in chat.members if member.user_id != current_user.id]
-            if member_ids and BlockedUser.query.filter(
-                BlockedUser.user_id.in_(member_ids),
-                BlockedUser.blocked_user_id == current_user.id,
-            ).first():
-                raise ValueError("You cannot send messages to this chat right now.")
+            chat = chats[chat_id]
+            copies: List[List[str]] = []
+            attachments: List[MessageAttachment] = []
+            for attachment in source_attachments:
+                try:
+                    source_filename, new_filename = plan_message_copy(attachment.filename)
+                except FileNotFoundError as exc:
+                    raise ValueError("Original attachment is missing.") from exc
+                copies.append([source_filename, new_filename])
+                attachments.append(MessageAttachment(filename=new_filename, mimetype=attachment.mimetype))
 
             new_message = Message(
                 chat_id=chat.id,
                 sender_id=current_user.id,
+                seq=chat.allocate_seq(),
                 body=source.body,
                 forwarded_from_id=source.id,
+                attachments=attachments,
             )
             db.session.add(new_message)
             db.session.flush()
-
-            for attachment in list(source.attachments):
-                try:
-                    new_filename = duplicate_message_file(attachment.filename)
-                except FileNotFoundError as exc:
-                    raise ValueError("Original attachment is missing.") from exc
-                copied_files.append(new_filename)
-                db.session.add(
-                    MessageAttachment(
-                        message_id=new_message.id,
-                        filename=new_filename,
-                        mimetype=attachment.mimetype,
-                    )
+            record_message_sent(chat.id, current_user.id, new_message.seq)
+            if copies:
+                _pending_copies.update(copy_name for _, copy_name in copies)
+                planned_copies.extend(copy_name for _, copy_name in copies)
+                jobs.enqueue(
+                    "files.copy_attachments", {"message_id": new_message.id, "copies": copies}
                 )
 
             forwarded_results.append((chat, new_message))
 
+        forwarded_payloads: List[Dict[str, Any]] = []
+        for chat, new_message in forwarded_results:
+            payload = _serialize_message(new_message)
+            outbox.publish("new_message", payload, room=f"chat_{chat.id}")
+            forwarded_payloads.append({"chat_id": chat.id, "message": payload})
         db.session.commit()
     except ValueError as exc:
         db.session.rollback()
-        for filename in copied_files:
-            remove_file("messages", filename)
+        _pending_copies.difference_update(planned_copies)
         return {"ok": False, "error": str(exc)}
     except Exception:
         db.session.rollback()
-        for filename in copied_files:
-            remove_file("messages", filename)
+        _pending_copies.difference_update(planned_copies)
         current_app.logger.exception("Failed to forward message.")
         return {"ok": False, "error": "Failed to forward message."}
 
-    forwarded_payloads: List[Dict[str, Any]] = []
-    for chat, new_message in forwarded_results:
-        payload = _serialize_message(new_message)
-        socketio.emit("new_message", payload, room=f"chat_{chat.id}")
-        forwarded_payloads.append({"chat_id": chat.id, "message": payload})
-
     return {"ok": True, "forwarded": forwarded_payloads, "count": len(forwarded_payloads)}
 
 
@@ -881,11 +1476,7 @@ def handle_chat_create(data):
         if target_user_id:
             other_user = User.query.get(target_user_id)
         elif username_input:
-            other_user = (
-                User.query.filter(
-                    func.lower(User.username).in_([username_input, f"@{username_input}"])
-                ).first()
-            )
+            other_user = find_user_by_username(username_input)
         if not other_user:
             return {"ok": False, "error": "User not found"}
         if other_user.id == current_user.id:
@@ -906,7 +1497,7 @@ def handle_chat_create(data):
         db.session.add(ChatMember(chat_id=chat.id, user_id=current_user.id, is_admin=True))
         db.session.add(ChatMember(chat_id=chat.id, user_id=other_user.id))
         db.session.commit()
-        join_room(f"chat_{chat.id}")
+        chat_subscriptions.subscribe(request.sid, current_user.id, chat.id)
         return {"ok": True, "chat": _serialize_chat_summary(chat, current_user)}
 
     name = (data.get("name") or "").strip()
@@ -927,39 +1518,20 @@ def handle_chat_create(data):
                 chat_id=chat.id, user_id=current_user.id, is_admin=True, is_owner=True
             )
         )
-        created_invites: List[GroupInvite] = []
-        for invitee in invitees:
-            if invitee.id == current_user.id:
-                continue
-            if chat.has_member(invitee.id):
-                continue
-            existing_invite = GroupInvite.query.filter_by(
-                chat_id=chat.id, invitee_id=invitee.id, status="pending"
-            ).first()
-            if existing_invite:
-                continue
-            invitation = GroupInvite(
-                chat_id=chat.id,
-                inviter_id=current_user.id,
-                invitee_id=invitee.id,
-            )
-            db.session.add(invitation)
-            created_invites.append(invitation)
+        created_invites = _create_group_invites(chat, current_user, invitees, new_chat=True)
+        _broadcast_contacts(current_user)
+        invite_payloads = _publish_invites_received(created_invites)
         db.session.commit()
     except Exception:
         db.session.rollback()
         current_app.logger.exception("Failed to create group chat.")
         return {"ok": False, "error": "Failed to create group."}
-    join_room(f"chat_{chat.id}")
+    chat_subscriptions.subscribe(request.sid, current_user.id, chat.id)
     summary = _serialize_chat_summary(chat, current_user)
-    _broadcast_contacts(current_user)
-    for invitation in created_invites:
-        if invitation.invitee:
-            _broadcast_contacts(invitation.invitee)
     return {
         "ok": True,
         "chat": summary,
-        "invites": [_serialize_group_invite(invite) for invite in created_invites],
+        "invites": invite_payloads,
     }
 
 
@@ -984,41 +1556,22 @@ def handle_group_invite(data):
     )
     if not invitees:
         return {"ok": False, "error": "No invitees specified."}
-    created_invites: List[GroupInvite] = []
     try:
-        for invitee in invitees:
-            if invitee.id == current_user.id:
-                continue
-            if chat.has_member(invitee.id):
-                continue
-            existing_invite = GroupInvite.query.filter_by(
-                chat_id=chat.id, invitee_id=invitee.id, status="pending"
-            ).first()
-            if existing_invite:
-                continue
-            invitation = GroupInvite(
-                chat_id=chat.id,
-                inviter_id=current_user.id,
-                invitee_id=invitee.id,
-            )
-            db.session.add(invitation)
-            created_invites.append(invitation)
+        created_invites = _create_group_invites(chat, current_user, invitees)
         if not created_invites:
             db.session.rollback()
             return {"ok": False, "error": "No new invitations were created."}
+        _broadcast_contacts(current_user)
+        invite_payloads = _publish_invites_received(created_invites)
         db.session.commit()
     except Exception:
         db.session.rollback()
         current_app.logger.exception("Failed to invite group members.")
         return {"ok": False, "error": "Unable to send invites."}
-    _broadcast_contacts(current_user)
-    for invitation in created_invites:
-        if invitation.invitee:
-            _broadcast_contacts(invitation.invitee)
     return {
         "ok": True,
         "chat_id": chat.id,
-        "invites": [_serialize_group_invite(invite) for invite in created_invites],
+        "invites": invite_payloads,
     }
 
 
@@ -1039,43 +1592,37 @@ def handle_group_respond(data):
     if action == "accept":
         try:
             if not chat.has_member(current_user.id):
-                db.session.add(ChatMember(chat_id=chat.id, user_id=current_user.id))
+                db.session.add(
+                    ChatMember(chat_id=chat.id, user_id=current_user.id, last_read_seq=chat.last_seq)
+                )
             invite.status = "accepted"
             invite.responded_at = datetime.utcnow()
+            db.session.flush()
+            _broadcast_contacts(current_user)
+            if invite.inviter:
+                _broadcast_contacts(invite.inviter)
+            _publish_member_update(chat)
             db.session.commit()
         except Exception:
             db.session.rollback()
             current_app.logger.exception("Failed to accept group invite.")
             return {"ok": False, "error": "Unable to join group."}
-        join_room(f"chat_{chat.id}")
+        chat_subscriptions.subscribe(request.sid, current_user.id, chat.id)
         summary = _serialize_chat_summary(chat, current_user)
-        _broadcast_contacts(current_user)
-        if invite.inviter:
-            _broadcast_contacts(invite.inviter)
-        socketio.emit(
-            "chat:member_update",
-            {
-                "chat_id": chat.id,
-                "members": [
-                    _serialize_member(member)
-                    for member in chat.members.order_by(ChatMember.joined_at.asc())
-                ],
-            },
-            room=f"chat_{chat.id}",
-        )
         _emit_chat_history(chat, current_user)
         return {"ok": True, "status": "accepted", "chat": summary}
     try:
         invite.status = "declined"
         invite.responded_at = datetime.utcnow()
+        db.session.flush()
+        _broadcast_contacts(current_user)
+        if invite.inviter:
+            _broadcast_contacts(invite.inviter)
         db.session.commit()
     except Exception:
         db.session.rollback()
         current_app.logger.exception("Failed to decline group invite.")
         return {"ok": False, "error": "Unable to decline invite."}
-    _broadcast_contacts(current_user)
-    if invite.inviter:
-        _broadcast_contacts(invite.inviter)
     return {"ok": True, "status": "declined"}
 
 
@@ -1096,14 +1643,15 @@ def handle_group_cancel(data):
     try:
         invite.status = "cancelled"
         invite.responded_at = datetime.utcnow()
+        db.session.flush()
+        _broadcast_contacts(current_user)
+        if invite.invitee:
+            _broadcast_contacts(invite.invitee)
         db.session.commit()
     except Exception:
         db.session.rollback()
         current_app.logger.exception("Failed to cancel group invite.")
         return {"ok": False, "error": "Unable to cancel invite."}
-    _broadcast_contacts(current_user)
-    if invite.invitee:
-        _broadcast_contacts(invite.invitee)
     return {"ok": True, "status": "cancelled", "invite_id": invite.id}
 
 
@@ -1163,32 +1711,34 @@ def handle_group_remove_member(data):
         db.session.delete(target_membership)
         db.session.flush()
         remaining_members = chat.members.order_by(ChatMember.joined_at.asc()).all()
-        serialized_members = [_serialize_member(member) for member in remaining_members]
+        serialized_members = _serialize_members(remaining_members)
         chat_removed = len(remaining_members) == 0
         if chat_removed:
+            _delete_chat_messages(chat.id)
             db.session.delete(chat)
+        outbox.publish(
+            "chat:member_update",
+            {"chat_id": chat_id, "members": serialized_members},
+            room=f"chat_{chat_id}",
+            coalesce=True,
+        )
+        outbox.publish(
+            "chat:deleted",
+            {"chat_id": chat_id, "initiator_id": current_user.id, "removed": True},
+            room=f"user_{removed_user_id}",
+        )
+        if chat_removed:
+            outbox.publish(
+                "chat:deleted",
+                {"chat_id": chat_id, "initiator_id": current_user.id, "removed": True},
+                room=f"chat_{chat_id}",
+            )
         db.session.commit()
     except Exception:
         db.session.rollback()
         current_app.logger.exception("Failed to remove group member.")
         return {"ok": False, "error": "Unable to remove member."}
-    socketio.emit(
-        "chat:member_update",
-        {"chat_id": chat.id, "members": serialized_members},
-        room=f"chat_{chat.id}",
-    )
-    socketio.emit(
-        "chat:deleted",
-        {"chat_id": chat.id, "initiator_id": current_user.id, "removed": True},
-        room=f"user_{removed_user_id}",
-    )
-    if chat_removed:
-        socketio.emit(
-            "chat:deleted",
-            {"chat_id": chat.id, "initiator_id": current_user.id, "removed": True},
-            room=f"chat_{chat.id}",
-        )
-    return {"ok": True, "chat_id": chat.id, "member_id": removed_membership_id}
+    return {"ok": True, "chat_id": chat_id, "member_id": removed_membership_id}
 
 
 @socketio.on("group:set_admin")
@@ -1247,22 +1797,13 @@ def handle_group_set_admin(data):
         }
     try:
         target_membership.is_admin = desired_admin
+        db.session.flush()
+        _publish_member_update(chat)
         db.session.commit()
     except Exception:
         db.session.rollback()
         current_app.logger.exception("Failed to update admin status.")
         return {"ok": False, "error": "Unable to update admin privileges."}
-    socketio.emit(
-        "chat:member_update",
-        {
-            "chat_id": chat.id,
-            "members": [
-                _serialize_member(member)
-                for member in chat.members.order_by(ChatMember.joined_at.asc())
-            ],
-        },
-        room=f"chat_{chat.id}",
-    )
     return {
         "ok": True,
         "chat_id": chat.id,
@@ -1313,22 +1854,13 @@ def handle_group_transfer_owner(data):
             current_owner.is_admin = True
         target_membership.is_owner = True
         target_membership.is_admin = True
+        db.session.flush()
+        _publish_member_update(chat)
         db.session.commit()
     except Exception:
         db.session.rollback()
         current_app.logger.exception("Failed to transfer ownership.")
         return {"ok": False, "error": "Unable to transfer ownership."}
-    socketio.emit(
-        "chat:member_update",
-        {
-            "chat_id": chat.id,
-            "members": [
-                _serialize_member(member)
-                for member in chat.members.order_by(ChatMember.joined_at.asc())
-            ],
-        },
-        room=f"chat_{chat.id}",
-    )
     return {
         "ok": True,
         "chat_id": chat.id,
@@ -1354,35 +1886,75 @@ def handle_group_disband(data):
     if not owner_membership or not owner_membership.is_owner:
         return {"ok": False, "error": "Only the group owner can disband the group."}
     member_user_ids = [member.user_id for member in chat.members.all()]
+    payload = {"chat_id": chat_id, "initiator_id": current_user.id, "disbanded": True}
     try:
+        _delete_chat_messages(chat.id)
         db.session.delete(chat)
+        outbox.publish("chat:deleted", payload, room=f"chat_{chat_id}")
+        for user_id in member_user_ids:
+            outbox.publish("chat:deleted", payload, room=f"user_{user_id}")
         db.session.commit()
     except Exception:
         db.session.rollback()
         current_app.logger.exception("Failed to disband group.")
         return {"ok": False, "error": "Unable to disband group."}
-    payload = {"chat_id": chat_id, "initiator_id": current_user.id, "disbanded": True}
-    socketio.emit("chat:deleted", payload, room=f"chat_{chat_id}")
-    for user_id in member_user_ids:
-        socketio.emit("chat:deleted", payload, room=f"user_{user_id}")
     return {"ok": True, "chat_id": chat_id, "disbanded": True}
 
+
+@socketio.on("messages:search")
+@rate_limited("search")
+def handle_messages_search(data):
+    if not current_user.is_authenticated:
+        return {"ok": False, "error": "Unauthorized"}
+    data = data or {}
+    return _message_search_payload(
+        current_user,
+        data.get("query") or "",
+        chat_id=data.get("chat_id"),
+        before=data.get("before"),
+        limit=data.get("limit"),
+    )
+
+
 @socketio.on("contacts:search")
+@rate_limited("search")
 def handle_contacts_search(data):
     if not current_user.is_authenticated:
         return {"ok": False, "error": "Unauthorized"}
     query = (data.get("query") or "").strip().lstrip("@")
     if not query:
         return {"ok": True, "results": []}
-    results = (
-        User.query.filter(
-            or_(User.username.ilike(f"%{query}%"), User.display_name.ilike(f"%{query}%"))
-        )
-        .filter(User.id != current_user.id)
-        .limit(10)
-        .all()
-    )
-    return {"ok": True, "results": [user.to_public_dict() for user in results]}
+    sid = request.sid
+    generation = _contact_search_generations.get(sid, 0) + 1
+    _contact_search_generations[sid] = generation
+    stale = {"ok": True, "stale": True, "query": query, "results": []}
+    debounce_ms = current_app.config.get("CONTACT_SEARCH_DEBOUNCE_MS", 0)
+    if debounce_ms:
+        socketio.sleep(debounce_ms / 1000)
+        if _contact_search_generations.get(sid) != generation:
+            return stale
+    with replica_reads():
+        friend_ids = {
+            friend_id
+            for (friend_id,) in db.session.query(Friendship.friend_id).filter(
+                Friendship.user_id == current_user.id
+            )
+        }
+    # The index builds itself from the primary so a lagging replica cannot leave it incomplete.
+    ranked_ids = user_index.search(query, friend_ids=friend_ids, exclude_ids=[current_user.id])
+    if _contact_search_generations.get(sid) != generation:
+        return stale
+    with replica_reads():
+        cards = user_cards.get_cards(ranked_ids)
+    results = [cards[user_id] for user_id in ranked_ids if user_id in cards]
+    return {"ok": True, "query": query, "results": results}
+
+
+@socketio.on("disconnect")
+def handle_disconnect():
+    _contact_search_generations.pop(request.sid, None)
+    payloads.set_normalized(request.sid, False)
+    chat_subscriptions.disconnect(request.sid)
 
 
 @socketio.on("friend:send_request")
@@ -1395,11 +1967,7 @@ def handle_friend_request(data):
     if target_id:
         user = User.query.get(target_id)
     elif username_input:
-        user = (
-            User.query.filter(
-                func.lower(User.username).in_([username_input, f"@{username_input}"])
-            ).first()
-        )
+        user = find_user_by_username(username_input)
     if not user:
         return {"ok": False, "error": "User not found"}
     if user.id == current_user.id:
@@ -1420,9 +1988,9 @@ def handle_friend_request(data):
         return {"ok": False, "error": "This user has already sent you a request."}
     friend_request = FriendRequest(sender_id=current_user.id, receiver_id=user.id)
     db.session.add(friend_request)
-    db.session.commit()
+    db.session.flush()
     receiver_pending = FriendRequest.query.filter_by(receiver_id=user.id, status="pending").count()
-    socketio.emit(
+    outbox.publish(
         "friend:update",
         {
             "action": "request_received",
@@ -1435,6 +2003,7 @@ def handle_friend_request(data):
     if receiver_user:
         _broadcast_contacts(receiver_user)
     _broadcast_contacts(current_user)
+    db.session.commit()
     return {"ok": True, "request": {"id": friend_request.id, "user": user.to_public_dict()}}
 
 
@@ -1452,8 +2021,8 @@ def handle_friend_respond(data):
         db.session.add(Friendship(user_id=current_user.id, friend_id=sender_user.id))
         db.session.add(Friendship(user_id=sender_user.id, friend_id=current_user.id))
         db.session.delete(friend_request)
-        db.session.commit()
-        socketio.emit(
+        db.session.flush()
+        outbox.publish(
             "friend:update",
             {"action": "request_accepted", "from_user": current_user.to_public_dict()},
             room=f"user_{sender_user.id}",
@@ -1462,11 +2031,12 @@ def handle_friend_respond(data):
         other_user = User.query.get(sender_user.id)
         if other_user:
             _broadcast_contacts(other_user)
+        db.session.commit()
         return {"ok": True, "status": "accepted"}
     if action == "decline":
         db.session.delete(friend_request)
-        db.session.commit()
-        socketio.emit(
+        db.session.flush()
+        outbox.publish(
             "friend:update",
             {"action": "request_declined", "from_user": current_user.to_public_dict()},
             room=f"user_{sender_user.id}",
@@ -1475,6 +2045,7 @@ def handle_friend_respond(data):
         other_user = User.query.get(sender_user.id)
         if other_user:
             _broadcast_contacts(other_user)
+        db.session.commit()
         return {"ok": True, "status": "declined"}
     return {"ok": False, "error": "Unsupported action"}
 
@@ -1493,8 +2064,8 @@ def handle_friend_cancel(data):
         return {"ok": False, "error": "Pending request not found"}
     receiver = friend_request.receiver
     db.session.delete(friend_request)
-    db.session.commit()
-    socketio.emit(
+    db.session.flush()
+    outbox.publish(
         "friend:update",
         {
             "action": "request_cancelled",
@@ -1507,6 +2078,7 @@ def handle_friend_cancel(data):
     other_user = User.query.get(receiver.id)
     if other_user:
         _broadcast_contacts(other_user)
+    db.session.commit()
     return {"ok": True}
 
 
@@ -1536,8 +2108,8 @@ def handle_friend_remove(data):
             and_(FriendRequest.sender_id == friend.id, FriendRequest.receiver_id == current_user.id),
         )
     ).delete(synchronize_session=False)
-    db.session.commit()
-    socketio.emit(
+    db.session.flush()
+    outbox.publish(
         "friend:update",
         {"action": "friend_removed", "from_user": current_user.to_public_dict()},
         room=f"user_{friend.id}",
@@ -1546,6 +2118,7 @@ def handle_friend_remove(data):
     if other_user:
         _broadcast_contacts(other_user)
     _broadcast_contacts(current_user)
+    db.session.commit()
     return {"ok": True}
 
 
@@ -1567,39 +2140,42 @@ def handle_me_update(data):
     current_user.timezone_offset = timezone_offset
     current_user.datetime_format = datetime_format
 
+    avatar_pending = False
+    staged: Optional[str] = None
     if avatar_payload:
         if avatar_payload.get("remove"):
             if current_user.avatar:
-                remove_file("avatars", current_user.avatar.filename)
+                jobs.enqueue(
+                    "files.remove", {"category": "avatars", "filename": current_user.avatar.filename}
+                )
                 existing_avatar = current_user.avatar
                 current_user.avatar = None
                 db.session.delete(existing_avatar)
         else:
-            existing_filename = current_user.avatar.filename if current_user.avatar else None
             try:
-                filename = _persist_avatar(avatar_payload, existing_filename=existing_filename)
+                filename, image = _decode_avatar(avatar_payload)
             except ValueError as exc:
                 db.session.rollback()
                 return {"ok": False, "error": str(exc)}
-            except Exception:  # pragma: no cover - safeguard
-                db.session.rollback()
-                current_app.logger.exception("Failed to persist avatar data.")
-                return {"ok": False, "error": "Failed to update avatar."}
-            if current_user.avatar:
-                current_user.avatar.created_at = datetime.utcnow()
-            else:
-                avatar = Avatar(filename=filename)
-                db.session.add(avatar)
-                db.session.flush()
-                current_user.avatar = avatar
+            # Only the staged file's name goes into the job row, not the image.
+            staged = stage_upload(image)
+            jobs.enqueue(
+                "avatars.store",
+                {"user_id": current_user.id, "filename": filename, "staged": staged},
+            )
+            avatar_pending = True
     try:
+        db.session.flush()
+        user_payload = _self_payload(current_user)
+        outbox.publish(
+            "profile:update", {"user": user_payload}, room=f"user_{current_user.id}", coalesce=True
+        )
         db.session.commit()
     except Exception:
         db.session.rollback()
+        if staged:
+            remove_file(STAGING_CATEGORY, staged)
         current_app.logger.exception("Profile update failed.")
         return {"ok": False, "error": "Failed to update profile."}
-    user_payload = current_user.to_public_dict()
-    user_payload["email"] = current_user.email
-    user_payload["settings"] = current_user.settings_payload()
-    socketio.emit("profile:update", {"user": user_payload}, room=f"user_{current_user.id}")
-    return {"ok": True, "user": user_payload}
\ No newline at end of file
+    user_cards.bump(current_user.id)
+    return {"ok": True, "user": user_payload, "avatar_pending": avatar_pending}
\ No newline at end of file
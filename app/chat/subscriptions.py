@@ -0,0 +1,164 @@
+"""Which chat rooms each socket has joined.
+
+``initialize`` used to join the room of every chat the user belongs to, so a
+member of thousands of chats held thousands of rooms per connection and was
+sent every message in all of them. A socket now joins its ``user_<id>`` room,
+the rooms of its ``CHAT_SUBSCRIBE_RECENT`` most recently active chats, and the
+room of each chat it opens; past ``CHAT_SUBSCRIPTION_LIMIT`` rooms the least
+recently used one is left again.
+
+Members with a connected socket outside a chat's room hear about new messages
+there through a small ``chat:activity`` event on their user room (chat id,
+last seq, unread count), published by
+:func:`app.chat.read_state.record_message_sent`. The registry is per process,
+like the Socket.IO rooms it mirrors. Rooms per socket and the Socket.IO
+server's own room count appear under ``chat_subscriptions`` in
+``/admin/stats``.
+"""
+from __future__ import annotations
+
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Set
+
+from flask_socketio import join_room, leave_room
+
+from app import socketio
+from app.utils.metrics import register_stats
+
+DEFAULT_RECENT = 20
+DEFAULT_LIMIT = 100
+
+
+class _Socket:
+    __slots__ = ("user_id", "chats")
+
+    def __init__(self, user_id: int):
+        self.user_id = user_id
+        # chat id -> None, least recently used first.
+        self.chats: "OrderedDict[int, None]" = OrderedDict()
+
+
+class ChatSubscriptions:
+    def __init__(self):
+        self.recent = DEFAULT_RECENT
+        self.limit = DEFAULT_LIMIT
+        self._sockets: Dict[str, _Socket] = {}
+        self._user_sockets: Dict[int, Set[str]] = {}
+        self._lock = threading.Lock()
+        self.joins = 0
+        self.leaves = 0
+        self.evictions = 0
+
+    def configure(self, config) -> None:
+        self.limit = max(1, int(config.get("CHAT_SUBSCRIPTION_LIMIT", DEFAULT_LIMIT)))
+        self.recent = min(self.limit, max(0, int(config.get("CHAT_SUBSCRIBE_RECENT", DEFAULT_RECENT))))
+
+    def _socket(self, sid: str, user_id: int) -> _Socket:
+        entry = self._sockets.get(sid)
+        if entry is None:
+            entry = self._sockets[sid] = _Socket(user_id)
+            self._user_sockets.setdefault(user_id, set()).add(sid)
+        return entry
+
+    def connect(self, sid: str, user_id: int) -> None:
+        """Join the user's notification room and start tracking ``sid``."""
+
+        join_room(f"user_{user_id}", sid=sid)
+        with self._lock:
+            self._socket(sid, user_id)
+
+    def subscribe(self, sid: str, user_id: int, chat_id: int) -> None:
+        """Join ``chat_id``'s room, leaving the least recently used one past the limit."""
+
+        with self._lock:
+            chats = self._socket(sid, user_id).chats
+            joined = chat_id not in chats
+            chats[chat_id] = None
+            chats.move_to_end(chat_id)
+            evicted = []
+            while len(chats) > self.limit:
+                evicted.append(chats.popitem(last=False)[0])
+            if joined:
+                self.joins += 1
+            self.evictions += len(evicted)
+        if joined:
+            join_room(f"chat_{chat_id}", sid=sid)
+        for old_chat_id in evicted:
+            leave_room(f"chat_{old_chat_id}", sid=sid)
+
+    def subscribe_recent(self, sid: str, user_id: int, chat_ids: Iterable[int]) -> None:
+        """Subscribe to the first ``recent`` of ``chat_ids`` (most recently active first)."""
+
+        selected = []
+        for chat_id in chat_ids:
+            if len(selected) >= self.recent:
+                break
+            selected.append(chat_id)
+        # Oldest first, so the most recent chat ends up least likely to be evicted.
+        for chat_id in reversed(selected):
+            self.subscribe(sid, user_id, chat_id)
+
+    def unsubscribe(self, sid: str, chat_id: int) -> None:
+        with self._lock:
+            entry = self._sockets.get(sid)
+            if entry is not None and chat_id in entry.chats:
+                del entry.chats[chat_id]
+                self.leaves += 1
+        leave_room(f"chat_{chat_id}", sid=sid)
+
+    def disconnect(self, sid: str) -> None:
+        with self._lock:
+            entry = self._sockets.pop(sid, None)
+            if entry is None:
+                return
+            sids = self._user_sockets.get(entry.user_id)
+            if sids is not None:
+                sids.discard(sid)
+                if not sids:
+                    del self._user_sockets[entry.user_id]
+
+    def has_sockets(self) -> bool:
+        return bool(self._sockets)
+
+    def needs_activity(self, user_id: int, chat_id: int) -> bool:
+        """True if ``user_id`` has a connected socket outside ``chat_id``'s room."""
+
+        with self._lock:
+            return any(
+                chat_id not in self._sockets[sid].chats
+                for sid in self._user_sockets.get(user_id, ())
+                if sid in self._sockets
+            )
+
+    def _server_rooms(self) -> Dict[str, int]:
+        manager = getattr(socketio.server, "manager", None)
+        # Every socket also sits in a room named after its own sid.
+        rooms = [(room, len(members)) for room, members in list(getattr(manager, "rooms", {}).get("/", {}).items())]
+        return {
+            "rooms": sum(1 for room, _ in rooms if room is not None),
+            "memberships": sum(size for room, size in rooms if room is not None),
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            counts = sorted(len(entry.chats) for entry in self._sockets.values())
+            users = len(self._user_sockets)
+        total = sum(counts)
+        return {
+            "recent": self.recent,
+            "limit": self.limit,
+            "sockets": len(counts),
+            "users": users,
+            "chat_rooms_joined": total,
+            "rooms_per_socket_avg": round(total / len(counts), 2) if counts else 0.0,
+            "rooms_per_socket_max": counts[-1] if counts else 0,
+            "joins": self.joins,
+            "leaves": self.leaves,
+            "evictions": self.evictions,
+            "server": self._server_rooms(),
+        }
+
+
+chat_subscriptions = ChatSubscriptions()
+register_stats("chat_subscriptions", chat_subscriptions.stats)
@@ -0,0 +1,283 @@
+"""Group-commit batching for message inserts.
+
+When ``MESSAGE_WRITE_BATCHING`` is enabled, ``send_message`` handlers queue
+their insert here instead of committing on their own. A single background task
+waits ``MESSAGE_BATCH_WINDOW_MS`` after the first queued send, then writes up
+to ``MESSAGE_BATCH_MAX_SIZE`` messages with one multi-row ``INSERT`` and one
+commit, so concurrent senders share a single fsync. Each handler still
+acknowledges and broadcasts its own message. A send that has not been picked
+up within ``MESSAGE_BATCH_MAX_LATENCY_MS`` is pulled back out of the queue and
+written inline by its handler. A send already claimed by a batch waits at
+most ``MESSAGE_BATCH_COMMIT_TIMEOUT_MS`` for its commit; past that it fails
+with :class:`MessageWriteTimeout` so the client can retry with the same
+``client_ref``, and the retry broadcasts the message if the batch committed
+after all.
+"""
+from __future__ import annotations
+
+import threading
+import time
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import and_, or_, select
+
+from app import db, socketio
+from app.chat.read_state import record_message_sent
+from app.models import Chat, Message, MessageAttachment
+from app.search.messages import index_inserted_rows
+from app.utils.cache import TTLCache
+from app.utils.metrics import SIZE_BUCKETS, Histogram
+from app.utils.storage import remove_file
+
+DEFAULT_WINDOW_MS = 5
+DEFAULT_MAX_BATCH = 200
+DEFAULT_MAX_LATENCY_MS = 50
+DEFAULT_COMMIT_TIMEOUT_MS = 5000
+LATE_COMMIT_SIZE = 10000
+LATE_COMMIT_TTL = 10 * 60
+
+_messages = Message.__table__
+_attachments = MessageAttachment.__table__
+
+
+class MessageWriteTimeout(Exception):
+    """The batch holding a send did not commit within ``MESSAGE_BATCH_COMMIT_TIMEOUT_MS``."""
+
+
+class PendingMessage:
+    """One queued send; ``message_id`` or ``error`` is set before ``done`` fires."""
+
+    def __init__(
+        self,
+        chat_id: int,
+        sender_id: int,
+        body: Optional[str],
+        client_ref: Optional[str],
+        attachments: List[Tuple[str, str]],
+    ):
+        self.chat_id = chat_id
+        self.sender_id = sender_id
+        self.body = body
+        self.client_ref = client_ref
+        self.attachments = attachments
+        self.queued_at = time.monotonic()
+        self.done = socketio.server.eio.create_event()
+        self.claimed = False
+        # Set once the handler stopped waiting; the batch may still commit the row.
+        self.abandoned = False
+        self.message_id: Optional[int] = None
+        self.error: Optional[BaseException] = None
+
+
+def write_messages(items: List[PendingMessage]) -> None:
+    """Insert ``items`` in the current transaction and fill in their ``message_id``.
+
+    Sequence numbers are reserved per chat in ascending chat id order, so a batch
+    takes chat row locks in the same order as any other batch.
+    """
+
+    by_chat: Dict[int, List[PendingMessage]] = defaultdict(list)
+    for item in items:
+        by_chat[item.chat_id].append(item)
+    seqs: Dict[int, int] = {}
+    for chat_id in sorted(by_chat):
+        first = Chat.reserve_seq(chat_id, len(by_chat[chat_id]))
+        for offset, item in enumerate(by_chat[chat_id]):
+            seqs[id(item)] = first + offset
+
+    db.session.execute(
+        _messages.insert(),
+        [
+            {
+                "chat_id": item.chat_id,
+                "sender_id": item.sender_id,
+                "seq": seqs[id(item)],
+                "body": item.body,
+                "client_ref": item.client_ref,
+            }
+            for item in items
+        ],
+    )
+    keys = or_(
+        *(
+            and_(_messages.c.chat_id == chat_id, _messages.c.seq.in_([seqs[id(i)] for i in group]))
+            for chat_id, group in by_chat.items()
+        )
+    )
+    ids = {
+        (chat_id, seq): message_id
+        for message_id, chat_id, seq in db.session.execute(
+            select(_messages.c.id, _messages.c.chat_id, _messages.c.seq).where(keys)
+        )
+    }
+    for item in items:
+        item.message_id = ids[(item.chat_id, seqs[id(item)])]
+
+    attachment_rows = [
+        {"message_id": item.message_id, "filename": filename, "mimetype": mimetype}
+        for item in items
+        for filename, mimetype in item.attachments
+    ]
+    if attachment_rows:
+        db.session.execute(_attachments.insert(), attachment_rows)
+    index_inserted_rows(
+        db.session.connection(), [(item.message_id, item.chat_id, item.body) for item in items]
+    )
+    for item in items:
+        record_message_sent(item.chat_id, item.sender_id, seqs[id(item)])
+
+
+class MessageWriteBatcher:
+    """Queues message inserts from many handlers and commits them together."""
+
+    def __init__(self):
+        self.enabled = False
+        self.window = DEFAULT_WINDOW_MS / 1000.0
+        self.max_batch = DEFAULT_MAX_BATCH
+        self.max_latency = DEFAULT_MAX_LATENCY_MS / 1000.0
+        self.commit_timeout = DEFAULT_COMMIT_TIMEOUT_MS / 1000.0
+        # Ids of abandoned sends that committed late and still need their broadcast.
+        self._late = TTLCache(LATE_COMMIT_SIZE, LATE_COMMIT_TTL)
+        self._queue: List[PendingMessage] = []
+        self._lock = threading.Lock()
+        self._wakeup = None
+        self._running = False
+        self.batch_sizes = Histogram(SIZE_BUCKETS)
+        self.latency_ms = Histogram()
+        self.batches = 0
+        self.fallbacks = 0
+        self.bypassed = 0
+        self.timeouts = 0
+        self.late_commits = 0
+
+    def configure(self, config) -> None:
+        self.enabled = bool(config.get("MESSAGE_WRITE_BATCHING"))
+        self.window = config.get("MESSAGE_BATCH_WINDOW_MS", DEFAULT_WINDOW_MS) / 1000.0
+        self.max_batch = max(1, config.get("MESSAGE_BATCH_MAX_SIZE", DEFAULT_MAX_BATCH))
+        self.max_latency = config.get("MESSAGE_BATCH_MAX_LATENCY_MS", DEFAULT_MAX_LATENCY_MS) / 1000.0
+        self.commit_timeout = config.get("MESSAGE_BATCH_COMMIT_TIMEOUT_MS", DEFAULT_COMMIT_TIMEOUT_MS) / 1000.0
+
+    def submit(self, app, item: PendingMessage) -> PendingMessage:
+        """Queue ``item`` and block until it is written, inline past the latency ceiling.
+
+        If a batch claimed ``item`` but has not committed it within the commit
+        timeout, ``item.error`` is a :class:`MessageWriteTimeout`.
+        """
+
+        with self._lock:
+            self._queue.append(item)
+            start = not self._running
+            self._running = True
+            if self._wakeup is None:
+                self._wakeup = socketio.server.eio.create_event()
+        self._wakeup.set()
+        if start:
+            socketio.start_background_task(self._run, app)
+
+        if not item.done.wait(self.max_latency):
+            with self._lock:
+                claimed = item.claimed
+                if not claimed:
+                    self._queue.remove(item)
+            if claimed:
+                if not item.done.wait(self.commit_timeout):
+                    with self._lock:
+                        item.abandoned = not item.done.is_set()
+                    if item.abandoned:
+                        self.timeouts += 1
+                        item.error = MessageWriteTimeout("Message write did not commit in time.")
+            else:
+                self.bypassed += 1
+                self._write_alone(item)
+        self.latency_ms.observe((time.monotonic() - item.queued_at) * 1000)
+        return item
+
+    def _run(self, app) -> None:
+        with app.app_context():
+            while True:
+                self._wakeup.wait()
+                self._wakeup.clear()
+                socketio.sleep(self.window)
+                while True:
+                    with self._lock:
+                        batch = self._queue[: self.max_batch]
+                        del self._queue[: self.max_batch]
+                        for item in batch:
+                            item.claimed = True
+                    if not batch:
+                        break
+                    self._write_batch(app, batch)
+
+    def _write_batch(self, app, batch: List[PendingMessage]) -> None:
+        try:
+            write_messages(batch)
+            db.session.commit()
+        except Exception as exc:
+            db.session.rollback()
+            if len(batch) == 1:
+                batch[0].message_id = None
+                batch[0].error = exc
+                self._finish(batch[0])
+                return
+            app.logger.warning("Batched message insert failed; retrying %d sends one by one.", len(batch))
+            self.fallbacks += 1
+            for item in batch:
+                self._write_alone(item)
+        else:
+            self.batches += 1
+            self.batch_sizes.observe(len(batch))
+            for item in batch:
+                self._finish(item)
+        finally:
+            db.session.remove()
+
+    def _write_alone(self, item: PendingMessage) -> None:
+        item.message_id = None
+        try:
+            write_messages([item])
+            db.session.commit()
+        except Exception as exc:
+            db.session.rollback()
+            item.message_id = None
+            item.error = exc
+        self._finish(item)
+
+    def _finish(self, item: PendingMessage) -> None:
+        with self._lock:
+            abandoned = item.abandoned
+            item.done.set()
+        if not abandoned:
+            return
+        # Failed writes clear message_id, so a set one means the row committed.
+        if item.message_id is not None:
+            self.late_commits += 1
+            self._late.put(item.message_id, True)
+            return
+        # Nobody is left to clean up after a failed abandoned send.
+        for filename, _ in item.attachments:
+            remove_file("messages", filename)
+
+    def take_late_commit(self, message_id: int) -> bool:
+        """True once for an abandoned send that committed after its handler gave up."""
+
+        if self._late.peek(message_id) is None:
+            return False
+        self._late.discard(message_id)
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "queued": len(self._queue),
+            "batches": self.batches,
+            "fallbacks": self.fallbacks,
+            "bypassed": self.bypassed,
+            "commit_timeouts": self.timeouts,
+            "late_commits": self.late_commits,
+            "batch_size": self.batch_sizes.snapshot(),
+            "latency_ms": self.latency_ms.snapshot(),
+        }
+
+
+message_writes = MessageWriteBatcher()
@@ -0,0 +1,3 @@
+from .runner import JobRunner, enqueue, job_runner, task
+
+__all__ = ["JobRunner", "enqueue", "job_runner", "task"]
@@ -0,0 +1,305 @@
+"""Persistent background jobs.
+
+:func:`enqueue` adds a row to the ``jobs`` table inside the caller's
+transaction, so a job exists only if the work that scheduled it committed, and
+pending jobs survive a restart. A single poller claims due jobs with a
+conditional ``UPDATE`` (safe with several processes sharing the table) and runs
+each one as a background task, never running more than the configured number
+of jobs per queue at once. Failed jobs are retried with exponential backoff
+until ``max_attempts`` is reached.
+"""
+from __future__ import annotations
+
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional
+
+from flask import current_app
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app import db, socketio
+from app.models import Job
+from app.utils.metrics import Histogram, register_stats
+
+DEFAULT_QUEUE = "default"
+DEFAULT_CONCURRENCY = 2
+DEFAULT_MAX_ATTEMPTS = 5
+POLL_INTERVAL = 1.0
+CLAIM_BATCH = 50
+RETRY_BASE_SECONDS = 2.0
+RETRY_MAX_SECONDS = 600.0
+STALE_AFTER = timedelta(minutes=10)
+RETENTION = timedelta(days=1)
+PRUNE_INTERVAL = 600.0
+
+_WAKE_KEY = "jobs_enqueued"
+
+
+class TaskSpec:
+    def __init__(self, name: str, func: Callable[..., Any], queue: str, max_attempts: int):
+        self.name = name
+        self.func = func
+        self.queue = queue
+        self.max_attempts = max_attempts
+
+
+_tasks: Dict[str, TaskSpec] = {}
+
+
+def task(name: str, queue: str = DEFAULT_QUEUE, max_attempts: int = DEFAULT_MAX_ATTEMPTS):
+    """Register the decorated function as the handler for jobs called ``name``.
+
+    The function receives the job payload as keyword arguments and runs inside
+    an app context; its session is committed when it returns.
+    """
+
+    def decorator(func: Callable[..., Any]) -> Callable[..., Any]:
+        _tasks[name] = TaskSpec(name, func, queue, max_attempts)
+        return func
+
+    return decorator
+
+
+def enqueue(
+    name: str,
+    payload: Optional[Dict[str, Any]] = None,
+    delay: float = 0,
+    dedupe_key: Optional[str] = None,
+) -> Optional[Job]:
+    """Schedule ``name`` to run after the current transaction commits.
+
+    With ``dedupe_key``, nothing is added while a job with the same name and key
+    is still pending.
+    """
+
+    spec = _tasks.get(name)
+    if spec is None:
+        raise ValueError(f"Unknown job {name!r}.")
+    if dedupe_key is not None:
+        existing = Job.query.filter_by(name=name, dedupe_key=dedupe_key, status="pending").first()
+        if existing is not None:
+            job_runner.deduplicated += 1
+            return None
+    job = Job(
+        queue=spec.queue,
+        name=name,
+        payload=payload or {},
+        dedupe_key=dedupe_key,
+        max_attempts=spec.max_attempts,
+        run_at=datetime.utcnow() + timedelta(seconds=delay),
+    )
+    db.session.add(job)
+    db.session.info[_WAKE_KEY] = True
+    job_runner.start(current_app._get_current_object())
+    return job
+
+
+def retry_delay(attempts: int) -> float:
+    return min(RETRY_MAX_SECONDS, RETRY_BASE_SECONDS * (2 ** max(0, attempts - 1)))
+
+
+def parse_concurrency(value: Any) -> Dict[str, int]:
+    """Parse ``"files=4,broadcasts=2"`` into a per-queue limit mapping."""
+
+    if isinstance(value, dict):
+        return {str(queue): max(1, int(limit)) for queue, limit in value.items()}
+    limits: Dict[str, int] = {}
+    for part in str(value or "").split(","):
+        queue, _, limit = part.partition("=")
+        try:
+            limits[queue.strip()] = max(1, int(limit))
+        except ValueError:
+            continue
+    return limits
+
+
+class JobRunner:
+    """Polls the ``jobs`` table and runs due jobs within per-queue limits."""
+
+    def __init__(self):
+        self.concurrency: Dict[str, int] = {}
+        self.default_concurrency = DEFAULT_CONCURRENCY
+        self._active: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._wakeup = None
+        self._started = False
+        self._last_prune = 0.0
+        self.run_ms = Histogram()
+        self.wait_ms = Histogram()
+        self.completed = 0
+        self.retried = 0
+        self.failed = 0
+        self.deduplicated = 0
+
+    def configure(self, config) -> None:
+        self.default_concurrency = max(1, config.get("JOB_DEFAULT_CONCURRENCY", DEFAULT_CONCURRENCY))
+        self.concurrency = parse_concurrency(config.get("JOB_CONCURRENCY"))
+
+    def limit(self, queue: str) -> int:
+        return self.concurrency.get(queue, self.default_concurrency)
+
+    def start(self, app) -> None:
+        if self._started:
+            return
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+            self._wakeup = socketio.server.eio.create_event()
+        socketio.start_background_task(self._run, app)
+
+    def notify(self) -> None:
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def _run(self, app) -> None:
+        with app.app_context():
+            self._recover_stale()
+            while True:
+                try:
+                    if time.monotonic() - self._last_prune > PRUNE_INTERVAL:
+                        self._prune()
+                    for job in self._claim_due():
+                        socketio.start_background_task(self._execute, app, job)
+                except Exception:
+                    db.session.rollback()
+                    app.logger.exception("Job poller failed.")
+                finally:
+                    db.session.remove()
+                self._wakeup.wait(POLL_INTERVAL)
+                self._wakeup.clear()
+
+    def _recover_stale(self) -> None:
+        """Requeue jobs left ``running`` by a process that died mid-job."""
+
+        try:
+            Job.query.filter(
+                Job.status == "running", Job.locked_at < datetime.utcnow() - STALE_AFTER
+            ).update({"status": "pending", "locked_at": None}, synchronize_session=False)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            current_app.logger.exception("Failed to recover stale jobs.")
+
+    def _prune(self) -> None:
+        self._last_prune = time.monotonic()
+        Job.query.filter(
+            Job.status == "done", Job.finished_at < datetime.utcnow() - RETENTION
+        ).delete(synchronize_session=False)
+        db.session.commit()
+
+    def _claim_due(self) -> List[Dict[str, Any]]:
+        now = datetime.utcnow()
+        with self._lock:
+            active = dict(self._active)
+        full = [queue for queue, count in active.items() if count >= self.limit(queue)]
+        query = Job.query.filter(Job.status == "pending", Job.run_at <= now)
+        if full:
+            query = query.filter(Job.queue.notin_(full))
+        candidates = query.order_by(Job.run_at, Job.id).limit(CLAIM_BATCH).all()
+
+        claimed: List[Dict[str, Any]] = []
+        for job in candidates:
+            if active.get(job.queue, 0) >= self.limit(job.queue):
+                continue
+            taken = Job.query.filter(Job.id == job.id, Job.status == "pending").update(
+                {"status": "running", "locked_at": now, "attempts": Job.attempts + 1},
+                synchronize_session=False,
+            )
+            if not taken:
+                continue
+            active[job.queue] = active.get(job.queue, 0) + 1
+            claimed.append(
+                {
+                    "id": job.id,
+                    "queue": job.queue,
+                    "name": job.name,
+                    "payload": job.payload or {},
+                    "attempts": job.attempts + 1,
+                    "max_attempts": job.max_attempts,
+                    "run_at": job.run_at,
+                }
+            )
+        db.session.commit()
+        with self._lock:
+            for job in claimed:
+                self._active[job["queue"]] = self._active.get(job["queue"], 0) + 1
+        return claimed
+
+    def _execute(self, app, job: Dict[str, Any]) -> None:
+        with app.app_context():
+            self.wait_ms.observe((datetime.utcnow() - job["run_at"]).total_seconds() * 1000)
+            started = time.monotonic()
+            try:
+                spec = _tasks.get(job["name"])
+                if spec is None:
+                    raise LookupError(f"No handler registered for job {job['name']!r}.")
+                spec.func(**job["payload"])
+                db.session.commit()
+            except Exception as exc:
+                db.session.rollback()
+                self._record_failure(app, job, exc)
+            else:
+                Job.query.filter_by(id=job["id"]).update(
+                    {"status": "done", "finished_at": datetime.utcnow(), "last_error": None},
+                    synchronize_session=False,
+                )
+                db.session.commit()
+                self.completed += 1
+            finally:
+                self.run_ms.observe((time.monotonic() - started) * 1000)
+                with self._lock:
+                    self._active[job["queue"]] -= 1
+                db.session.remove()
+                self.notify()
+
+    def _record_failure(self, app, job: Dict[str, Any], exc: Exception) -> None:
+        retry = job["attempts"] < job["max_attempts"] and not isinstance(exc, LookupError)
+        values: Dict[str, Any] = {"last_error": f"{type(exc).__name__}: {exc}"[:2000], "locked_at": None}
+        if retry:
+            values["status"] = "pending"
+            values["run_at"] = datetime.utcnow() + timedelta(seconds=retry_delay(job["attempts"]))
+            self.retried += 1
+            app.logger.warning("Job %s (%s) failed; retrying: %s", job["id"], job["name"], exc)
+        else:
+            values["status"] = "failed"
+            values["finished_at"] = datetime.utcnow()
+            self.failed += 1
+            app.logger.error("Job %s (%s) failed permanently: %s", job["id"], job["name"], exc)
+        try:
+            Job.query.filter_by(id=job["id"]).update(values, synchronize_session=False)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            app.logger.exception("Failed to record job %s failure.", job["id"])
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            active = dict(self._active)
+        return {
+            "active": active,
+            "limits": {**self.concurrency, "*": self.default_concurrency},
+            "completed": self.completed,
+            "retried": self.retried,
+            "failed": self.failed,
+            "deduplicated": self.deduplicated,
+            "run_ms": self.run_ms.snapshot(),
+            "wait_ms": self.wait_ms.snapshot(),
+        }
+
+
+job_runner = JobRunner()
+register_stats("jobs", job_runner.stats)
+
+
+@event.listens_for(Session, "after_commit")
+def _wake_runner(session: Session) -> None:
+    if session.info.pop(_WAKE_KEY, False):
+        job_runner.notify()
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_wakeup(session: Session) -> None:
+    session.info.pop(_WAKE_KEY, None)
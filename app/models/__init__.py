@@ -2,6 +2,7 @@ from .user import User, Avatar
 from .friendship import FriendRequest, Friendship, BlockedUser
 from .chat import Chat, ChatMember, GroupInvite
 from .message import Message, MessageAttachment
+from .job import Job
 
 __all__ = [
     "User",
@@ -14,4 +15,5 @@ __all__ = [
     "Message",
     "MessageAttachment",
     "GroupInvite",
+    "Job",
 ]
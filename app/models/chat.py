@@ -1,5 +1,8 @@
 from datetime import datetime
 
+from sqlalchemy import func, select
+from sqlalchemy.orm.attributes import set_committed_value
+
 from app import db
 
 
@@ -11,6 +14,7 @@ class Chat(db.Model):
     is_group = db.Column(db.Boolean, default=False)
     creator_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    last_seq = db.Column(db.Integer, default=0, nullable=False, server_default="0")
 
     members = db.relationship("ChatMember", backref="chat", cascade="all, delete-orphan", lazy="dynamic")
     messages = db.relationship("Message", backref="chat", cascade="all, delete-orphan", lazy="dynamic")
@@ -19,6 +23,28 @@ class Chat(db.Model):
     def has_member(self, user_id: int) -> bool:
         return self.members.filter_by(user_id=user_id).count() > 0
 
+    def allocate_seq(self, count: int = 1) -> int:
+        """Reserve ``count`` consecutive message sequence numbers and return the first.
+
+        The counter is bumped with a single ``UPDATE`` so concurrent writers to the
+        same chat serialize on the row lock until their transaction ends.
+        """
+        first = Chat.reserve_seq(self.id, count)
+        set_committed_value(self, "last_seq", first + count - 1)
+        return first
+
+    @staticmethod
+    def reserve_seq(chat_id: int, count: int = 1) -> int:
+        """Like :meth:`allocate_seq` for callers that only hold the chat id."""
+        table = Chat.__table__
+        db.session.execute(
+            table.update()
+            .where(table.c.id == chat_id)
+            .values(last_seq=func.coalesce(table.c.last_seq, 0) + count)
+        )
+        last_seq = db.session.execute(select(table.c.last_seq).where(table.c.id == chat_id)).scalar()
+        return last_seq - count + 1
+
     def get_admins(self):
         return [member.user for member in self.members.filter_by(is_admin=True)]
 
@@ -35,6 +61,9 @@ class ChatMember(db.Model):
     is_admin = db.Column(db.Boolean, default=False)
     is_owner = db.Column(db.Boolean, default=False)
     joined_at = db.Column(db.DateTime, default=datetime.utcnow)
+    last_read_seq = db.Column(db.Integer, nullable=True)
+    last_read_at = db.Column(db.DateTime, nullable=True)
+    unread_count = db.Column(db.Integer, default=0, nullable=False, server_default="0")
 
     user = db.relationship("User", backref=db.backref("chat_memberships", cascade="all, delete-orphan"))
 
@@ -9,17 +9,23 @@ from app.utils.datetime import to_utc_iso
 
 class Message(db.Model):
     __tablename__ = "messages"
-    __table_args__ = {"mysql_charset": "utf8mb4", "mysql_collate": "utf8mb4_unicode_ci"}
+    __table_args__ = (
+        db.UniqueConstraint("sender_id", "client_ref", name="uniq_message_client_ref"),
+        db.UniqueConstraint("chat_id", "seq", name="uniq_message_chat_seq"),
+        {"mysql_charset": "utf8mb4", "mysql_collate": "utf8mb4_unicode_ci"},
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     chat_id = db.Column(db.Integer, db.ForeignKey("chats.id"), nullable=False)
     sender_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False)
+    seq = db.Column(db.Integer, nullable=True)
     forwarded_from_id = db.Column(db.Integer, db.ForeignKey("messages.id"), nullable=True)
     body = db.Column(db.Text(collation="utf8mb4_unicode_ci"), nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     last_edited_at = db.Column(db.DateTime, nullable=True)
     is_deleted = db.Column(db.Boolean, default=False, nullable=False)
     edited = db.Column(db.Boolean, default=False, nullable=False)
+    client_ref = db.Column(db.String(64), nullable=True)
 
     attachments = db.relationship("MessageAttachment", backref="message", cascade="all, delete-orphan")
     forwarded_from = db.relationship(
@@ -40,6 +46,7 @@ class Message(db.Model):
         return {
             "id": self.id,
             "chat_id": self.chat_id,
+            "seq": self.seq,
             "sender_id": self.sender_id,
             "forwarded_from_id": self.forwarded_from_id,
             "body": self.body,
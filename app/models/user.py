@@ -7,7 +7,7 @@ from sqlalchemy.orm import reconstructor, validates
 from werkzeug.security import check_password_hash, generate_password_hash
 
 from app import db
-from app.utils.datetime import to_utc_iso
+from app.utils.offload import run_cpu
 
 
 DEFAULT_TIMEZONE_MODE = "system"
@@ -84,12 +84,12 @@ class User(UserMixin, db.Model):
     def set_password(self, password: str) -> None:
         if not password:
             raise ValueError("Password must not be empty.")
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = run_cpu("password_hash", generate_password_hash, password)
 
     def check_password(self, password: str) -> bool:
         if not self.password_hash or password is None:
             return False
-        return check_password_hash(self.password_hash, password)
+        return run_cpu("password_check", check_password_hash, self.password_hash, password)
 
     def set_online(self):
         self.online = True
@@ -109,15 +109,9 @@ class User(UserMixin, db.Model):
         return f"/media/avatars/{self.avatar.filename}?v={timestamp}"
 
     def to_public_dict(self):
-        return {
-            "id": self.id,
-            "display_name": self.display_name,
-            "username": self.username,
-            "avatar": self.avatar_url,
-            "bio": self.bio,
-            "online": self.online,
-            "last_seen": to_utc_iso(self.last_seen),
-        }
+        from app.utils.user_cache import user_cards
+
+        return user_cards.card(self)
 
     def settings_payload(self):
         return {
@@ -0,0 +1,4 @@
+from .messages import drop_chat_entries, rebuild_message_index, search_messages
+from .users import UserSearchIndex, user_index
+
+__all__ = ["drop_chat_entries", "rebuild_message_index", "search_messages", "UserSearchIndex", "user_index"]
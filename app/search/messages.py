@@ -0,0 +1,282 @@
+"""Full-text search over message bodies.
+
+MySQL relies on a native ``FULLTEXT`` index on ``messages.body`` that the
+server maintains by itself; query terms it does not index (stopwords and short
+words) are matched with ``LIKE`` alongside it. SQLite uses an FTS5 table (``messages_fts``) which
+is kept current from mapper events whenever a message is inserted, edited,
+deleted or forwarded; batched core inserts call :func:`index_inserted_rows` and
+bulk chat deletes :func:`drop_chat_entries`.
+Any other backend falls back to a ``LIKE`` scan.
+"""
+from __future__ import annotations
+
+import re
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import DDL, and_, column, event, func, inspect, literal_column, select, table, text
+from sqlalchemy.orm import selectinload
+
+from app import db
+from app.models import ChatMember, Message
+
+FTS_TABLE = "messages_fts"
+FULLTEXT_INDEX = "ix_messages_body_fulltext"
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 50
+MAX_TERMS = 8
+SNIPPET_RADIUS = 60
+SNIPPET_TOKENS = 16
+# InnoDB defaults for innodb_ft_min_token_size and INNODB_FT_DEFAULT_STOPWORD.
+# Terms it never indexes would make a required (+) term match nothing.
+FULLTEXT_MIN_TOKEN_SIZE = 3
+FULLTEXT_STOPWORDS = frozenset(
+    "a about an are as at be by com de en for from how i in is it la of on or "
+    "that the this to und was what when where who will with www".split()
+)
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+_fts = table(FTS_TABLE, column("rowid"), column("body"), column("chat_id"))
+_ready_engines: set = set()
+
+_SQLITE_CREATE = DDL(
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} "
+    "USING fts5(body, chat_id UNINDEXED, tokenize='unicode61')"
+)
+_MYSQL_CREATE = DDL(f"ALTER TABLE messages ADD FULLTEXT INDEX {FULLTEXT_INDEX} (body)")
+
+event.listen(Message.__table__, "after_create", _SQLITE_CREATE.execute_if(dialect="sqlite"))
+event.listen(Message.__table__, "after_create", _MYSQL_CREATE.execute_if(dialect="mysql"))
+
+
+def _sqlite_index_ready(connection) -> bool:
+    key = str(connection.engine.url)
+    if key in _ready_engines:
+        return True
+    exists = connection.execute(
+        text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+        {"name": FTS_TABLE},
+    ).first()
+    if exists:
+        _ready_engines.add(key)
+    return bool(exists)
+
+
+def _uses_fts_table(connection) -> bool:
+    return connection.dialect.name == "sqlite" and _sqlite_index_ready(connection)
+
+
+def _searchable_body(message: Message) -> Optional[str]:
+    if message.is_deleted or not message.body:
+        return None
+    return message.body
+
+
+def _write_entry(connection, message: Message) -> None:
+    body = _searchable_body(message)
+    if body is None:
+        return
+    connection.execute(
+        _fts.insert().values(rowid=message.id, body=body, chat_id=message.chat_id)
+    )
+
+
+def _drop_entry(connection, message_id: int) -> None:
+    connection.execute(_fts.delete().where(_fts.c.rowid == message_id))
+
+
+@event.listens_for(Message, "after_insert")
+def _index_inserted_message(_, connection, target: Message) -> None:
+    if _uses_fts_table(connection):
+        _write_entry(connection, target)
+
+
+def index_inserted_rows(connection, rows: Iterable[Tuple[int, int, Optional[str]]]) -> None:
+    """Index ``(id, chat_id, body)`` rows written with core inserts, which skip mapper events."""
+
+    if not _uses_fts_table(connection):
+        return
+    entries = [
+        {"rowid": message_id, "body": body, "chat_id": chat_id}
+        for message_id, chat_id, body in rows
+        if body
+    ]
+    if entries:
+        connection.execute(_fts.insert(), entries)
+
+
+@event.listens_for(Message, "after_update")
+def _index_updated_message(_, connection, target: Message) -> None:
+    state = inspect(target)
+    if not (state.attrs.body.history.has_changes() or state.attrs.is_deleted.history.has_changes()):
+        return
+    if _uses_fts_table(connection):
+        _drop_entry(connection, target.id)
+        _write_entry(connection, target)
+
+
+@event.listens_for(Message, "after_delete")
+def _index_deleted_message(_, connection, target: Message) -> None:
+    if _uses_fts_table(connection):
+        _drop_entry(connection, target.id)
+
+
+def drop_chat_entries(connection, chat_id: int) -> None:
+    """Unindex every message of ``chat_id`` ahead of a bulk delete, which skips mapper events."""
+
+    if _uses_fts_table(connection):
+        message_ids = select(Message.id).where(Message.chat_id == chat_id)
+        connection.execute(_fts.delete().where(_fts.c.rowid.in_(message_ids)))
+
+
+def _terms(query: str) -> List[str]:
+    return _TOKEN_RE.findall((query or "").lower())[:MAX_TERMS]
+
+
+def _make_snippet(body: Optional[str], terms: List[str]) -> str:
+    if not body:
+        return ""
+    lowered = body.lower()
+    positions = [lowered.find(term) for term in terms if term in lowered]
+    anchor = min(positions) if positions else 0
+    start = max(0, anchor - SNIPPET_RADIUS)
+    end = min(len(body), anchor + SNIPPET_RADIUS)
+    snippet = body[start:end].strip()
+    if start > 0:
+        snippet = f"…{snippet}"
+    if end < len(body):
+        snippet = f"{snippet}…"
+    return snippet
+
+
+def _scoped_query(user_id: int, chat_id: Optional[int], before_id: Optional[int]):
+    query = Message.query.join(
+        ChatMember,
+        and_(ChatMember.chat_id == Message.chat_id, ChatMember.user_id == user_id),
+    ).filter(Message.is_deleted.is_(False))
+    # Every hit is serialized with its attachments and forwarded original.
+    query = query.options(selectinload(Message.attachments), selectinload(Message.forwarded_from))
+    if chat_id:
+        query = query.filter(Message.chat_id == chat_id)
+    if before_id:
+        query = query.filter(Message.id < before_id)
+    return query.order_by(Message.id.desc())
+
+
+def _search_fts5(query, terms: List[str], limit: int) -> List[Tuple[Message, str]]:
+    match = " ".join(f'"{term}"' for term in terms[:-1])
+    match = f'{match} "{terms[-1]}"*'.strip()
+    rows = (
+        query.join(_fts, _fts.c.rowid == Message.id)
+        .filter(literal_column(FTS_TABLE).op("MATCH")(match))
+        .add_columns(func.snippet(literal_column(FTS_TABLE), 0, "", "", "…", SNIPPET_TOKENS))
+        .limit(limit)
+        .all()
+    )
+    return [(message, snippet) for message, snippet in rows]
+
+
+def _fulltext_indexed(term: str) -> bool:
+    return len(term) >= FULLTEXT_MIN_TOKEN_SIZE and term not in FULLTEXT_STOPWORDS
+
+
+def _search_fulltext(query, terms: List[str], limit: int) -> List[Tuple[Message, str]]:
+    indexed = [term for term in terms if _fulltext_indexed(term)]
+    if not indexed:
+        return _search_like(query, terms, limit)
+    required = [f"+{term}" for term in indexed]
+    if _fulltext_indexed(terms[-1]):
+        required[-1] += "*"
+    match = " ".join(required)
+    # Short and stopword terms are not in the index; they narrow the matches with LIKE.
+    query = _contains_terms(query, [term for term in terms if term not in indexed])
+    messages = (
+        query.filter(text("MATCH (messages.body) AGAINST (:match IN BOOLEAN MODE)"))
+        .params(match=match)
+        .limit(limit)
+        .all()
+    )
+    return [(message, _make_snippet(message.body, terms)) for message in messages]
+
+
+def _contains_terms(query, terms: List[str]):
+    for term in terms:
+        query = query.filter(func.lower(Message.body).contains(term, autoescape=True))
+    return query
+
+
+def _search_like(query, terms: List[str], limit: int) -> List[Tuple[Message, str]]:
+    messages = _contains_terms(query, terms).limit(limit).all()
+    return [(message, _make_snippet(message.body, terms)) for message in messages]
+
+
+def search_messages(
+    user_id: int,
+    query: str,
+    chat_id: Optional[int] = None,
+    before_id: Optional[int] = None,
+    limit: Optional[int] = None,
+) -> Dict[str, Any]:
+    """Search message bodies in chats ``user_id`` belongs to, newest first.
+
+    Results are paginated by message id: pass the returned ``next_before``
+    back as ``before_id`` to fetch the next page.
+    """
+
+    terms = _terms(query)
+    page_size = max(1, min(MAX_PAGE_SIZE, limit or DEFAULT_PAGE_SIZE))
+    if not terms:
+        return {"hits": [], "next_before": None, "terms": []}
+
+    scoped = _scoped_query(user_id, chat_id, before_id)
+    connection = db.session.connection()
+    if _uses_fts_table(connection):
+        hits = _search_fts5(scoped, terms, page_size + 1)
+    elif connection.dialect.name == "mysql":
+        hits = _search_fulltext(scoped, terms, page_size + 1)
+    else:
+        hits = _search_like(scoped, terms, page_size + 1)
+
+    has_more = len(hits) > page_size
+    hits = hits[:page_size]
+    return {
+        "hits": hits,
+        "next_before": hits[-1][0].id if has_more and hits else None,
+        "terms": terms,
+    }
+
+
+def rebuild_message_index() -> int:
+    """Recreate the search index from ``messages`` and return the searchable row count."""
+
+    engine = db.engine
+    with engine.begin() as connection:
+        dialect = connection.dialect.name
+        if dialect == "sqlite":
+            connection.execute(text(f"DROP TABLE IF EXISTS {FTS_TABLE}"))
+            connection.execute(_SQLITE_CREATE)
+            connection.execute(
+                text(
+                    f"INSERT INTO {FTS_TABLE} (rowid, body, chat_id) "
+                    "SELECT id, body, chat_id FROM messages "
+                    "WHERE is_deleted = 0 AND body IS NOT NULL AND body != ''"
+                )
+            )
+            _ready_engines.add(str(engine.url))
+        elif dialect == "mysql":
+            existing = connection.execute(
+                text(
+                    "SELECT 1 FROM information_schema.statistics "
+                    "WHERE table_schema = DATABASE() AND table_name = 'messages' "
+                    "AND index_name = :name LIMIT 1"
+                ),
+                {"name": FULLTEXT_INDEX},
+            ).first()
+            if existing:
+                connection.execute(text(f"ALTER TABLE messages DROP INDEX {FULLTEXT_INDEX}"))
+            connection.execute(_MYSQL_CREATE)
+        return connection.execute(
+            text(
+                "SELECT COUNT(*) FROM messages "
+                "WHERE is_deleted = 0 AND body IS NOT NULL AND body != ''"
+            )
+        ).scalar()
@@ -0,0 +1,300 @@
+"""In-memory prefix index for contact search.
+
+Usernames, their ``._-`` separated parts and each word of the display name are
+kept lowercase in one sorted list of ``(token, user_id)`` pairs, so a prefix
+lookup is a binary search instead of a ``LIKE '%q%'`` scan over ``users``. The
+index follows registrations and profile edits committed by this process, and
+picks up users created elsewhere (``cli.py``, other workers) on a short
+catch-up interval plus a periodic full rebuild.
+
+Full builds run on a background task, with tokenizing and sorting offloaded
+through :func:`app.utils.offload.run_cpu`, so reading every user never stalls
+the event loop. The first build starts with the first request. Until it
+finishes, searches fall back to a username and display-name prefix query.
+Later rebuilds keep serving the previous snapshot until the new one is swapped
+in.
+"""
+from __future__ import annotations
+
+import re
+import threading
+import time
+from bisect import bisect_left, insort
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from flask import current_app
+from sqlalchemy import event, inspect, or_
+from sqlalchemy.orm import Session, object_session
+
+from app import db, socketio
+from app.models import User
+from app.utils.offload import run_cpu
+
+CANDIDATE_LIMIT = 200
+CATCHUP_INTERVAL = 5.0
+REBUILD_INTERVAL = 15 * 60.0
+_PENDING_KEY = "user_search_pending"
+_SPLIT_RE = re.compile(r"[._\-]+")
+
+
+def _tokenize(username: Optional[str], display_name: Optional[str]) -> Tuple[str, ...]:
+    tokens: List[str] = []
+    handle = (username or "").strip().lower().lstrip("@")
+    if handle:
+        tokens.append(handle)
+        tokens.extend(part for part in _SPLIT_RE.split(handle) if part)
+    name = (display_name or "").strip().lower()
+    if name:
+        tokens.append(name)
+        tokens.extend(name.split())
+    return tuple(dict.fromkeys(tokens))
+
+
+def _build(rows: List[Tuple[int, str, Optional[str]]]):
+    entries: List[Tuple[str, int]] = []
+    tokens: Dict[int, Tuple[str, ...]] = {}
+    usernames: Dict[int, str] = {}
+    for user_id, username, display_name in rows:
+        user_tokens = _tokenize(username, display_name)
+        tokens[user_id] = user_tokens
+        usernames[user_id] = (username or "").lower()
+        entries.extend((token, user_id) for token in user_tokens)
+    entries.sort()
+    return entries, tokens, usernames
+
+
+class UserSearchIndex:
+    def __init__(self, catchup_interval: float = CATCHUP_INTERVAL, rebuild_interval: float = REBUILD_INTERVAL):
+        self.catchup_interval = catchup_interval
+        self.rebuild_interval = rebuild_interval
+        self._lock = threading.RLock()
+        self._entries: List[Tuple[str, int]] = []
+        self._tokens: Dict[int, Tuple[str, ...]] = {}
+        self._usernames: Dict[int, str] = {}
+        self._max_id = 0
+        self._loaded_at: Optional[float] = None
+        self._checked_at = 0.0
+        self._building = False
+        # Commits seen while a build runs, replayed onto its snapshot; None when idle.
+        self._build_changes: Optional[Dict[int, Optional[Tuple[str, Optional[str]]]]] = None
+
+    @property
+    def loaded(self) -> bool:
+        return self._loaded_at is not None
+
+    def __len__(self) -> int:
+        return len(self._tokens)
+
+    def _insert(self, user_id: int, username: str, display_name: Optional[str]) -> None:
+        tokens = _tokenize(username, display_name)
+        self._tokens[user_id] = tokens
+        self._usernames[user_id] = (username or "").lower()
+        self._max_id = max(self._max_id, user_id)
+        for token in tokens:
+            insort(self._entries, (token, user_id))
+
+    def _remove(self, user_id: int) -> None:
+        for token in self._tokens.pop(user_id, ()):
+            position = bisect_left(self._entries, (token, user_id))
+            if position < len(self._entries) and self._entries[position] == (token, user_id):
+                del self._entries[position]
+        self._usernames.pop(user_id, None)
+
+    def upsert(self, user_id: int, username: str, display_name: Optional[str]) -> None:
+        with self._lock:
+            if self._build_changes is not None:
+                self._build_changes[user_id] = (username, display_name)
+            if not self.loaded:
+                return
+            self._remove(user_id)
+            self._insert(user_id, username, display_name)
+
+    def discard(self, user_id: int) -> None:
+        with self._lock:
+            if self._build_changes is not None:
+                self._build_changes[user_id] = None
+            self._remove(user_id)
+
+    def load(self) -> None:
+        """Read every user and swap in a freshly built snapshot."""
+
+        rows = [tuple(row) for row in db.session.query(User.id, User.username, User.display_name)]
+        entries, tokens, usernames = run_cpu("user_index_build", _build, rows)
+        with self._lock:
+            self._entries = entries
+            self._tokens = tokens
+            self._usernames = usernames
+            self._max_id = max(tokens, default=0)
+            self._loaded_at = self._checked_at = time.monotonic()
+            if self._build_changes:
+                for user_id, values in self._build_changes.items():
+                    self._remove(user_id)
+                    if values is not None:
+                        self._insert(user_id, *values)
+                self._build_changes.clear()
+
+    def start_rebuild(self, app) -> bool:
+        """Run :meth:`load` on a background task unless one is already running."""
+
+        with self._lock:
+            if self._building:
+                return False
+            self._building = True
+            self._build_changes = {}
+        socketio.start_background_task(self._rebuild, app)
+        return True
+
+    def _rebuild(self, app) -> None:
+        try:
+            with app.app_context():
+                try:
+                    self.load()
+                finally:
+                    db.session.remove()
+        except Exception:
+            app.logger.exception("Building the contact search index failed.")
+        finally:
+            with self._lock:
+                self._building = False
+                self._build_changes = None
+
+    def warm(self, app) -> None:
+        if not self.loaded and not self._building:
+            self.start_rebuild(app)
+
+    def refresh(self) -> None:
+        now = time.monotonic()
+        if self._loaded_at is None or now - self._loaded_at >= self.rebuild_interval:
+            self.start_rebuild(current_app._get_current_object())
+        if self._loaded_at is None or now - self._checked_at < self.catchup_interval:
+            return
+        self._checked_at = now
+        rows = (
+            db.session.query(User.id, User.username, User.display_name)
+            .filter(User.id > self._max_id)
+            .all()
+        )
+        for user_id, username, display_name in rows:
+            self.upsert(user_id, username, display_name)
+
+    def _prefix_ids(self, prefix: str, limit: int) -> Set[int]:
+        found: Set[int] = set()
+        with self._lock:
+            position = bisect_left(self._entries, (prefix,))
+            while position < len(self._entries) and len(found) < limit:
+                token, user_id = self._entries[position]
+                if not token.startswith(prefix):
+                    break
+                found.add(user_id)
+                position += 1
+        return found
+
+    def _matches(self, user_id: int, prefix: str) -> bool:
+        return any(token.startswith(prefix) for token in self._tokens.get(user_id, ()))
+
+    def _rank(self, user_id: int, prefix: str, friend_ids: Set[int]) -> Tuple:
+        username = self._usernames.get(user_id, "")
+        exact = any(token == prefix for token in self._tokens.get(user_id, ()))
+        return (
+            user_id not in friend_ids,
+            not exact,
+            not username.startswith(prefix),
+            len(username),
+            user_id,
+        )
+
+    def search(
+        self,
+        query: str,
+        friend_ids: Iterable[int] = (),
+        exclude_ids: Iterable[int] = (),
+        limit: int = 10,
+    ) -> List[int]:
+        """Return up to ``limit`` user ids whose tokens start with ``query``.
+
+        Friends rank first, then exact token matches, then username prefixes.
+        """
+
+        prefix = (query or "").strip().lower().lstrip("@")
+        if not prefix:
+            return []
+        self.refresh()
+        friends = set(friend_ids)
+        if not self.loaded:
+            return self._search_database(prefix, friends, set(exclude_ids), limit)
+        candidates = self._prefix_ids(prefix, CANDIDATE_LIMIT)
+        candidates.update(user_id for user_id in friends if self._matches(user_id, prefix))
+        candidates.difference_update(exclude_ids)
+        ranked = sorted(candidates, key=lambda user_id: self._rank(user_id, prefix, friends))
+        return ranked[:limit]
+
+    def _search_database(self, prefix: str, friends: Set[int], exclude_ids: Set[int], limit: int) -> List[int]:
+        """Prefix query used until the first build is in; matches the start of names only."""
+
+        rows = (
+            db.session.query(User.id, User.username)
+            .filter(
+                or_(
+                    User.username.istartswith(prefix, autoescape=True),
+                    User.display_name.istartswith(prefix, autoescape=True),
+                )
+            )
+            .limit(CANDIDATE_LIMIT)
+            .all()
+        )
+        ranked = sorted(
+            (
+                (user_id not in friends, not (username or "").lower().startswith(prefix), len(username or ""), user_id)
+                for user_id, username in rows
+                if user_id not in exclude_ids
+            )
+        )
+        return [key[-1] for key in ranked[:limit]]
+
+
+user_index = UserSearchIndex()
+
+
+def _pending(session: Session) -> Dict[int, Optional[Tuple[str, Optional[str]]]]:
+    return session.info.setdefault(_PENDING_KEY, {})
+
+
+@event.listens_for(User, "after_insert")
+def _queue_new_user(_, __, target: User) -> None:
+    session = object_session(target)
+    if session is not None:
+        _pending(session)[target.id] = (target.username, target.display_name)
+
+
+@event.listens_for(User, "after_update")
+def _queue_changed_user(_, __, target: User) -> None:
+    state = inspect(target)
+    if not (state.attrs.username.history.has_changes() or state.attrs.display_name.history.has_changes()):
+        return
+    session = object_session(target)
+    if session is not None:
+        _pending(session)[target.id] = (target.username, target.display_name)
+
+
+@event.listens_for(User, "after_delete")
+def _queue_removed_user(_, __, target: User) -> None:
+    session = object_session(target)
+    if session is not None:
+        _pending(session)[target.id] = None
+
+
+@event.listens_for(Session, "after_commit")
+def _apply_pending(session: Session) -> None:
+    pending = session.info.pop(_PENDING_KEY, None)
+    if not pending:
+        return
+    for user_id, values in pending.items():
+        if values is None:
+            user_index.discard(user_id)
+        else:
+            user_index.upsert(user_id, *values)
+
+
+@event.listens_for(Session, "after_rollback")
+def _drop_pending(session: Session) -> None:
+    session.info.pop(_PENDING_KEY, None)
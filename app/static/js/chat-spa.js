@@ -11,7 +11,43 @@
         console.error('Failed to parse initial state payload.', error);
     }
 
-    const SOCKET_IO_CLIENT_SRC = 'https://cdn.socket.io/4.7.4/socket.io.min.js';
+    const SOCKET_IO_CLIENT_SRC = window.NovaTalk?.socketParser === 'msgpack'
+        ? 'https://cdn.socket.io/4.7.4/socket.io.msgpack.min.js'
+        : 'https://cdn.socket.io/4.7.4/socket.io.min.js';
+
+    // Normalized frames carry each user once in `users`; restore the inline user objects the UI reads.
+    const hydrateUsers = (payload) => {
+        const users = payload?.users;
+        if (!users) {
+            return payload;
+        }
+        const lookup = (id) => (id === null || id === undefined ? null : users[id] || null);
+        const hydrateMessage = (message) => {
+            if (!message) {
+                return;
+            }
+            message.sender = lookup(message.sender_id);
+            if (message.forwarded_from) {
+                message.forwarded_from.sender = lookup(message.forwarded_from.sender_id);
+            }
+        };
+        const hydrateChat = (chat) => {
+            if (!chat) {
+                return;
+            }
+            (chat.members || []).forEach((member) => {
+                member.user = lookup(member.user_id);
+            });
+            chat.partner = lookup(chat.partner_id);
+            chat.creator = lookup(chat.creator_id);
+            hydrateMessage(chat.last_message);
+        };
+        hydrateChat(payload.chat);
+        (payload.chats || []).forEach(hydrateChat);
+        (payload.messages || []).forEach(hydrateMessage);
+        delete payload.users;
+        return payload;
+    };
 
     const DAY_MS = 24 * 60 * 60 * 1000;
 
@@ -283,6 +319,9 @@
                     }
                     this.contactsSearchForm.classList.add('is-loading');
                     this.emitSocket('contacts:search', { query }, (response) => {
+                        if (response?.stale) {
+                            return;
+                        }
                         this.contactsSearchForm.classList.remove('is-loading');
                         if (!response?.ok) {
                             this.showToast(response?.error || 'Search failed.');
@@ -530,9 +569,9 @@
             this.socket.on('connect', () => {
                 this.updatePresence('Online');
                 this.connectionErrorNotified = false;
-                this.emitSocket('initialize', {}, (response) => {
+                this.emitSocket('initialize', { normalized: true }, (response) => {
                     if (response?.ok && response.state) {
-                        this.applyState(response.state);
+                        this.applyState(hydrateUsers(response.state));
                     }
                 });
             });
@@ -548,9 +587,9 @@
             this.socket.on('reconnect', () => {
                 this.updatePresence('Online');
                 this.connectionErrorNotified = false;
-                this.emitSocket('initialize', {}, (response) => {
+                this.emitSocket('initialize', { normalized: true }, (response) => {
                     if (response?.ok && response.state) {
-                        this.applyState(response.state);
+                        this.applyState(hydrateUsers(response.state));
                         if (this.state.ui.activeChatId) {
                             this.openChat(this.state.ui.activeChatId, { force: true });
                         }
@@ -569,13 +608,21 @@
             });
 
             this.socket.on('chat:history', (payload) => {
-                this.handleChatHistory(payload);
+                this.handleChatHistory(hydrateUsers(payload));
             });
 
             this.socket.on('new_message', (payload) => {
                 this.handleIncomingMessage(payload);
             });
 
+            this.socket.on('message:updated', (payload) => {
+                this.handleMessageUpdated(payload);
+            });
+
+            this.socket.on('chat:activity', (payload) => {
+                this.handleChatActivity(payload);
+            });
+
             this.socket.on('contacts:update', (payload) => {
                 if (payload?.contacts) {
                     this.state.contacts = payload.contacts;
@@ -626,6 +673,9 @@
                     if (typeof callback === 'function') {
                         if (error) {
                             callback({ ok: false, error: error.message || 'Request timed out.' });
+                        } else if (response?.error === 'rate_limited') {
+                            const seconds = Math.max(1, Math.ceil(response.retry_after || 1));
+                            callback({ ...response, code: 'rate_limited', error: `Too many requests. Try again in ${seconds}s.` });
                         } else {
                             callback(response);
                         }
@@ -1136,6 +1186,13 @@
                     const attachments = document.createElement('div');
                     attachments.className = 'message__attachments';
                     message.attachments.forEach((attachment) => {
+                        if (attachment.pending) {
+                            const placeholder = document.createElement('div');
+                            placeholder.className = 'message__attachment message__attachment--pending';
+                            placeholder.textContent = 'Copying…';
+                            attachments.appendChild(placeholder);
+                            return;
+                        }
                         const link = document.createElement('a');
                         link.className = 'message__attachment';
                             link.href = attachment.url || attachment.download_url || '#';
@@ -1210,6 +1267,35 @@
             }
         }
 
+        handleMessageUpdated(message) {
+            const existing = this.messageStore.get(message?.chat_id);
+            const index = existing ? existing.findIndex((item) => item.id === message.id) : -1;
+            if (index < 0) {
+                return;
+            }
+            existing[index] = { ...existing[index], ...message };
+            if (this.state.ui.activeChatId === message.chat_id) {
+                this.renderMessages(message.chat_id, existing);
+            }
+        }
+
+        handleChatActivity(payload) {
+            const chatIndex = this.state.chats.findIndex((chat) => chat.id === payload?.chat_id);
+            if (chatIndex < 0) {
+                return;
+            }
+            const chat = this.state.chats[chatIndex];
+            if (payload.last_seq <= (chat.last_seq || 0)) {
+                return;
+            }
+            chat.last_seq = payload.last_seq;
+            chat.unread_count = payload.unread_count || 0;
+            chat.updated_at = payload.updated_at || chat.updated_at;
+            this.state.chats.splice(chatIndex, 1);
+            this.state.chats.unshift(chat);
+            this.renderChats();
+        }
+
         handleIncomingMessage(message) {
             if (!message?.chat_id) {
                 return;
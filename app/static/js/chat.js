@@ -12,6 +12,40 @@
         console.error('Failed to parse initial state payload.', error);
     }
 
+    // Normalized frames carry each user once in `users`; restore the inline user objects the UI reads.
+    const hydrateUsers = (payload) => {
+        const users = payload?.users;
+        if (!users) {
+            return payload;
+        }
+        const lookup = (id) => (id === null || id === undefined ? null : users[id] || null);
+        const hydrateMessage = (message) => {
+            if (!message) {
+                return;
+            }
+            message.sender = lookup(message.sender_id);
+            if (message.forwarded_from) {
+                message.forwarded_from.sender = lookup(message.forwarded_from.sender_id);
+            }
+        };
+        const hydrateChat = (chat) => {
+            if (!chat) {
+                return;
+            }
+            (chat.members || []).forEach((member) => {
+                member.user = lookup(member.user_id);
+            });
+            chat.partner = lookup(chat.partner_id);
+            chat.creator = lookup(chat.creator_id);
+            hydrateMessage(chat.last_message);
+        };
+        hydrateChat(payload.chat);
+        (payload.chats || []).forEach(hydrateChat);
+        (payload.messages || []).forEach(hydrateMessage);
+        delete payload.users;
+        return payload;
+    };
+
     const DEFAULT_DATETIME_FORMAT = 'MM/DD/YYYY HH:mm';
     const SUPPORTED_DATETIME_FORMATS = [
         'MM/DD/YYYY HH:mm',
@@ -1046,6 +1080,13 @@
                 body.appendChild(title);
                 body.appendChild(preview);
                 body.appendChild(meta);
+                if (chat.unread_count > 0 && String(chat.id) !== String(state.ui.activeChatId)) {
+                    const unread = document.createElement('span');
+                    unread.className = 'badge chat-roster__unread';
+                    unread.textContent = chat.unread_count > 99 ? '99+' : String(chat.unread_count);
+                    meta.appendChild(document.createTextNode(' '));
+                    meta.appendChild(unread);
+                }
                 if (String(chat.id) === String(state.ui.activeChatId)) {
                     item.classList.add('is-active');
                 }
@@ -1502,6 +1543,13 @@
             const attachments = document.createElement('div');
             attachments.className = 'message__attachments';
             message.attachments.forEach((attachment) => {
+                if (attachment.pending) {
+                    const placeholder = document.createElement('div');
+                    placeholder.className = 'message__attachment-image message__attachment-pending';
+                    placeholder.textContent = 'Copying…';
+                    attachments.appendChild(placeholder);
+                    return;
+                }
                 const link = document.createElement('a');
                 link.href = attachment.url || attachment.preview_url || attachment.download_url || '#';
                 link.addEventListener('click', (event) => event.preventDefault());
@@ -2263,6 +2311,9 @@
                 if (typeof callback === 'function') {
                     if (error) {
                         callback({ ok: false, error: error.message || 'Request timed out.' });
+                    } else if (response?.error === 'rate_limited') {
+                        const seconds = Math.max(1, Math.ceil(response.retry_after || 1));
+                        callback({ ...response, code: 'rate_limited', error: `Too many requests. Try again in ${seconds}s.` });
                     } else {
                         callback(response);
                     }
@@ -2337,14 +2388,90 @@
             state.ui.editingMessage = null;
             renderMessages(payload.chat_id, decorated);
             renderGroupMembers();
+            if (payload.chat?.unread_count) {
+                markChatRead(payload.chat_id, payload.chat.last_seq);
+                renderChats();
+            }
         }
     };
 
+    const highestSeq = (chatId) => {
+        if (!messageStore.has(chatId)) {
+            return null;
+        }
+        return messageStore.get(chatId).reduce((max, item) => Math.max(max, Number(item.seq) || 0), 0);
+    };
+
+    const fillMessageGap = (chatId, fromSeq, toSeq) => {
+        emitSocket('chat:fetch_range', { chat_id: chatId, from_seq: fromSeq, to_seq: toSeq }, (response) => {
+            if (!response?.ok) {
+                return;
+            }
+            const messages = getMessagesForChat(chatId);
+            ensureArray(response.messages).forEach((message) => {
+                const normalized = decorateMessage(message);
+                if (!messages.some((item) => String(item.id) === String(normalized.id))) {
+                    messages.push(normalized);
+                }
+            });
+            messages.sort((a, b) => (Number(a.seq) || Infinity) - (Number(b.seq) || Infinity));
+            if (String(chatId) === String(state.ui.activeChatId)) {
+                renderMessages(chatId, messages);
+            }
+            if (response.has_more && response.to_seq < toSeq) {
+                fillMessageGap(chatId, response.to_seq + 1, toSeq);
+            }
+        });
+    };
+
+    const markChatRead = (chatId, seq) => {
+        const chat = state.chats.find((item) => String(item.id) === String(chatId));
+        if (chat) {
+            chat.unread_count = 0;
+        }
+        emitSocket('chat:mark_read', { chat_id: chatId, seq });
+    };
+
+    const handleUnreadUpdate = (payload) => {
+        console.log('socket event: chat:unread', payload);
+        const chat = state.chats.find((item) => String(item.id) === String(payload?.chat_id));
+        if (!chat) {
+            return;
+        }
+        chat.unread_count = payload.unread_count || 0;
+        chat.last_read_seq = payload.last_read_seq;
+        renderChats();
+    };
+
+    const handleChatActivity = (payload) => {
+        console.log('socket event: chat:activity', payload);
+        const chatIndex = state.chats.findIndex((item) => String(item.id) === String(payload?.chat_id));
+        if (chatIndex < 0) {
+            return;
+        }
+        const chat = state.chats[chatIndex];
+        if (payload.last_seq <= (chat.last_seq || 0)) {
+            return;
+        }
+        chat.last_seq = payload.last_seq;
+        chat.updated_at = payload.updated_at || chat.updated_at;
+        if (String(chat.id) !== String(state.ui.activeChatId)) {
+            chat.unread_count = payload.unread_count || 0;
+        }
+        state.chats.splice(chatIndex, 1);
+        state.chats.unshift(chat);
+        renderChats();
+    };
+
     const handleIncomingMessage = (payload) => {
         console.log('socket event: new_message', payload);
         if (!payload?.chat_id) {
             return;
         }
+        const knownSeq = highestSeq(payload.chat_id);
+        if (knownSeq && payload.seq && payload.seq > knownSeq + 1) {
+            fillMessageGap(payload.chat_id, knownSeq + 1, payload.seq - 1);
+        }
         const incoming = decorateMessage(payload);
         if (Number(incoming.sender?.id || incoming.sender_id) !== Number(state.user.id)) {
             incoming.status = 'received';
@@ -2353,9 +2480,17 @@
         if (String(incoming.chat_id) === String(state.ui.activeChatId)) {
             scrollToBottom(true);
         }
+        const isOwn = Number(incoming.sender?.id || incoming.sender_id) === Number(state.user.id);
+        const isActive = String(incoming.chat_id) === String(state.ui.activeChatId);
+        if (isActive && !isOwn && incoming.seq) {
+            markChatRead(incoming.chat_id, incoming.seq);
+        }
         const chatIndex = state.chats.findIndex((chat) => String(chat.id) === String(incoming.chat_id));
         if (chatIndex >= 0) {
             const chat = state.chats[chatIndex];
+            if (!isActive && !isOwn) {
+                chat.unread_count = (chat.unread_count || 0) + 1;
+            }
             chat.last_message = incoming;
             chat.updated_at = incoming.created_at;
             state.chats.splice(chatIndex, 1);
@@ -2395,6 +2530,24 @@
         renderContacts();
     };
 
+    const handleInviteReceived = (payload) => {
+        console.log('socket event: invite:received', payload);
+        const invite = payload?.invite;
+        if (!invite?.id) {
+            return;
+        }
+        if (!state.contacts.group_invites) {
+            state.contacts.group_invites = { incoming: [], outgoing: [] };
+        }
+        const incoming = ensureArray(state.contacts.group_invites.incoming);
+        if (!incoming.some((existing) => existing.id === invite.id)) {
+            state.contacts.group_invites.incoming = [invite, ...incoming];
+            state.ui.pendingGroupInvites = (state.ui.pendingGroupInvites || 0) + 1;
+            showToast(`${invite.inviter?.display_name || 'A user'} invited you to ${invite.group_name || 'a group'}.`, 'info');
+        }
+        renderContacts();
+    };
+
     const handleChatMemberUpdate = (payload) => {
         console.log('socket event: chat:member_update', payload);
         if (!payload?.chat_id) {
@@ -2503,9 +2656,9 @@
             console.log('✅ Connected to server');
             updatePresence('Online', 'online');
             showToast('Connected to NovaTalk.', 'success');
-            socket.emit('initialize', {}, (response) => {
+            socket.emit('initialize', { normalized: true }, (response) => {
                 if (response?.ok && response.state) {
-                    applyState(response.state);
+                    applyState(hydrateUsers(response.state));
                     if (response.state.ui?.activeChatId) {
                         openChat(response.state.ui.activeChatId);
                     }
@@ -2528,9 +2681,9 @@
             console.log('socket event: reconnect');
             updatePresence('Online', 'online');
             showToast('Reconnected to NovaTalk.', 'success');
-            socket.emit('initialize', {}, (response) => {
+            socket.emit('initialize', { normalized: true }, (response) => {
                 if (response?.ok && response.state) {
-                    applyState(response.state);
+                    applyState(hydrateUsers(response.state));
                     if (state.ui.activeChatId) {
                         openChat(state.ui.activeChatId);
                     }
@@ -2546,6 +2699,9 @@
         socket.off('chat:history');
         socket.off('new_message');
         socket.off('contacts:update');
+        socket.off('invite:received');
+        socket.off('chat:unread');
+        socket.off('chat:activity');
         socket.off('friend:update');
         socket.off('profile:update');
         socket.off('chat:typing');
@@ -2554,9 +2710,12 @@
         socket.off('message:deleted');
         socket.off('chat:deleted');
 
-        socket.on('chat:history', handleChatHistory);
+        socket.on('chat:history', (payload) => handleChatHistory(hydrateUsers(payload)));
         socket.on('new_message', handleIncomingMessage);
         socket.on('contacts:update', handleContactsUpdate);
+        socket.on('invite:received', handleInviteReceived);
+        socket.on('chat:unread', handleUnreadUpdate);
+        socket.on('chat:activity', handleChatActivity);
         socket.on('friend:update', handleFriendUpdate);
         socket.on('profile:update', handleProfileUpdate);
         socket.on('chat:member_update', handleChatMemberUpdate);
@@ -2774,6 +2933,9 @@
                 }
                 elements.contactsSearchForm.classList.add('is-loading');
                 emitSocket('contacts:search', { query }, (response) => {
+                    if (response?.stale) {
+                        return;
+                    }
                     elements.contactsSearchForm.classList.remove('is-loading');
                     if (!response?.ok) {
                         showToast(response?.error || 'Search failed.', 'error');
@@ -17,7 +17,9 @@
     window.NovaTalk = window.NovaTalk || {};
     let socketClientPromise = null;
 
-    const SOCKET_IO_CLIENT_SRC = 'https://cdn.socket.io/4.7.4/socket.io.min.js';
+    const SOCKET_IO_CLIENT_SRC = window.NovaTalk.socketParser === 'msgpack'
+        ? 'https://cdn.socket.io/4.7.4/socket.io.msgpack.min.js'
+        : 'https://cdn.socket.io/4.7.4/socket.io.min.js';
 
     function ensureSocketClient() {
         if (typeof window.io === 'function') {
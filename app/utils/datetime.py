@@ -2,19 +2,29 @@
 from __future__ import annotations
 
 from datetime import datetime, timezone
+from functools import lru_cache
 from typing import Optional
 
+# Payloads repeat the same timestamps (a sender's last_seen on every message).
+ENCODED_CACHE_SIZE = 16384
+
 
 def to_utc_iso(value: Optional[datetime]) -> Optional[str]:
     """Return an ISO 8601 string in UTC with trailing ``Z``.
 
     ``None`` values are passed through unchanged. Naive datetimes are assumed to
     be in UTC already so they are annotated with :class:`datetime.timezone.utc`.
-    Aware datetimes are converted to UTC before serialization.
+    Aware datetimes are converted to UTC before serialization. Encoded values
+    are memoized.
     """
 
     if value is None:
         return None
+    return _encode_utc(value)
+
+
+@lru_cache(maxsize=ENCODED_CACHE_SIZE)
+def _encode_utc(value: datetime) -> str:
     if value.tzinfo is None:
         value = value.replace(tzinfo=timezone.utc)
     else:
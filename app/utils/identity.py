@@ -0,0 +1,168 @@
+"""Batched user lookup by id, username or email.
+
+Usernames and emails are stored canonically (lowercase, no leading ``@``) by
+``User._normalize_identity``, so lookups compare them directly and hit the
+unique indexes instead of wrapping the column in ``lower()``. A batch of any
+size resolves in at most two queries: one by primary key, one by
+username/email. Recent username/email -> id mappings are cached so repeated
+lookups collapse into the primary-key query.
+"""
+from __future__ import annotations
+
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import event, inspect, or_
+
+from app.models import User
+from app.utils.cache import TTLCache
+from app.utils.metrics import register_stats
+
+CACHE_SIZE = 4096
+CACHE_TTL = 300.0
+
+
+def normalize_username(value: Any) -> str:
+    return str(value or "").strip().lower().lstrip("@")
+
+
+def normalize_email(value: Any) -> str:
+    return str(value or "").strip().lower()
+
+
+identity_cache = TTLCache(CACHE_SIZE, CACHE_TTL)
+register_stats("identity_cache", identity_cache.stats)
+
+
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _forget_changed_identity(_, __, target: User) -> None:
+    state = inspect(target)
+    for kind in ("username", "email"):
+        history = getattr(state.attrs, kind).history
+        for value in (*history.deleted, *history.unchanged, *history.added):
+            if value:
+                identity_cache.discard((kind, value))
+
+
+def _classify(identifier: Any) -> List[Tuple[str, Any]]:
+    """Return the lookups to try for ``identifier``, most specific first."""
+
+    if identifier is None or isinstance(identifier, bool):
+        return []
+    if isinstance(identifier, User):
+        return [("user", identifier)]
+    if isinstance(identifier, dict):
+        if "user_id" in identifier:
+            return _classify(identifier.get("user_id"))
+        if "username" in identifier:
+            username = normalize_username(identifier.get("username"))
+            return [("username", username)] if username else []
+        if "email" in identifier:
+            email = normalize_email(identifier.get("email"))
+            return [("email", email)] if email else []
+        return []
+    if isinstance(identifier, int):
+        return [("id", identifier)]
+    if isinstance(identifier, str):
+        value = identifier.strip()
+        if not value:
+            return []
+        if "@" in value and not value.startswith("@"):
+            return [("email", normalize_email(value))]
+        lookups: List[Tuple[str, Any]] = []
+        if value.isdigit():
+            lookups.append(("id", int(value)))
+        username = normalize_username(value)
+        if username:
+            lookups.append(("username", username))
+        return lookups
+    return []
+
+
+def resolve_users(identifiers: Iterable[Any]) -> List[User]:
+    """Resolve ids, usernames, emails or ``User`` objects to distinct users.
+
+    Order follows ``identifiers``; unknown identifiers are skipped.
+    """
+
+    plans = [_classify(identifier) for identifier in identifiers]
+    by_id: Dict[int, User] = {}
+    wanted_ids: Set[int] = set()
+    cached: Dict[Tuple[str, str], int] = {}
+    for lookups in plans:
+        for kind, value in lookups:
+            if kind == "user":
+                by_id[value.id] = value
+            elif kind == "id":
+                wanted_ids.add(value)
+            else:
+                user_id = identity_cache.get((kind, value))
+                if user_id is not None:
+                    cached[(kind, value)] = user_id
+                    wanted_ids.add(user_id)
+
+    wanted_ids.difference_update(by_id)
+    if wanted_ids:
+        for user in User.query.filter(User.id.in_(wanted_ids)).all():
+            by_id[user.id] = user
+
+    def _match(kind: str, value: Any) -> Optional[User]:
+        if kind == "user":
+            return value
+        if kind == "id":
+            return by_id.get(value)
+        user = by_id.get(cached.get((kind, value), -1))
+        if user is not None and getattr(user, kind) == value:
+            return user
+        return None
+
+    usernames: Set[str] = set()
+    emails: Set[str] = set()
+    for lookups in plans:
+        if any(_match(kind, value) for kind, value in lookups):
+            continue
+        for kind, value in lookups:
+            if kind == "username":
+                usernames.add(value)
+            elif kind == "email":
+                emails.add(value)
+
+    by_key: Dict[Tuple[str, str], User] = {}
+    if usernames or emails:
+        clauses = []
+        if usernames:
+            clauses.append(User.username.in_(usernames))
+        if emails:
+            clauses.append(User.email.in_(emails))
+        for user in User.query.filter(or_(*clauses)).all():
+            by_id[user.id] = user
+            for key in (("username", user.username), ("email", user.email)):
+                by_key[key] = user
+                identity_cache.put(key, user.id)
+
+    resolved: List[User] = []
+    seen: Set[int] = set()
+    for lookups in plans:
+        for kind, value in lookups:
+            user = _match(kind, value) or by_key.get((kind, value))
+            if user is not None:
+                if user.id not in seen:
+                    seen.add(user.id)
+                    resolved.append(user)
+                break
+    return resolved
+
+
+def find_user(identifier: Any) -> Optional[User]:
+    users = resolve_users([identifier])
+    return users[0] if users else None
+
+
+def find_user_by_username(username: Any) -> Optional[User]:
+    normalized = normalize_username(username)
+    return find_user({"username": normalized}) if normalized else None
+
+
+def find_user_by_email(email: Any) -> Optional[User]:
+    normalized = normalize_email(email)
+    return find_user({"email": normalized}) if normalized else None
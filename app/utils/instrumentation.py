@@ -0,0 +1,353 @@
+"""Per-event instrumentation for Socket.IO handlers and HTTP routes.
+
+Every Socket.IO event handler (through :class:`InstrumentedSocketIO`) and
+every Flask request (through :meth:`Instrumentation.init_app`) runs inside an
+:class:`EventRecord` that collects its wall-clock latency and the number and
+duration of SQL statements it issued, counted by engine-wide
+``before_cursor_execute``/``after_cursor_execute`` listeners. Emits are
+measured in the Socket.IO client manager: encoded payload size, room fan-out
+and bytes put on the wire per event name, attributed to the handler that
+emitted them when there is one. Records also feed the slow-event log and the
+sampling profiler in :mod:`app.utils.slow_events`.
+
+Recording costs a couple of clock reads and a histogram update per event and
+per statement, so it stays on in production; ``INSTRUMENTATION=0`` turns it
+off. :meth:`Instrumentation.snapshot` is the in-process view (also under
+``instrumentation`` in ``/admin/stats``) and :meth:`Instrumentation.prometheus`
+renders the same data in the Prometheus text format for ``/metrics``.
+"""
+from __future__ import annotations
+
+import threading
+import time
+from contextvars import ContextVar
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import socketio as python_socketio
+from flask import g, request
+from flask_socketio import SocketIO
+from socketio import packet
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from app.utils.metrics import LATENCY_BUCKETS_MS, PAYLOAD_BUCKETS, SIZE_BUCKETS, Histogram, register_stats
+from app.utils.slow_events import MAX_STATEMENTS, profiler, slow_events
+
+SOCKET = "socket"
+HTTP = "http"
+
+_STARTED_KEY = "instrumentation_started"
+
+_current: ContextVar[Optional["EventRecord"]] = ContextVar("instrumentation_event", default=None)
+_encoded = threading.local()
+
+
+class EventRecord:
+    """Measurements for one handler invocation or request."""
+
+    __slots__ = ("kind", "name", "started", "sql_count", "sql_ms", "emits", "emit_bytes", "statements", "profile")
+
+    def __init__(self, kind: str, name: str):
+        self.kind = kind
+        self.name = name
+        self.sql_count = 0
+        self.sql_ms = 0.0
+        self.emits = 0
+        self.emit_bytes = 0
+        # Statement text is only kept while the slow-event log could need it.
+        self.statements: Optional[List[Tuple[str, float]]] = [] if slow_events.capturing else None
+        self.profile = profiler.start()
+        self.started = time.perf_counter()
+
+    def elapsed_ms(self) -> float:
+        return (time.perf_counter() - self.started) * 1000
+
+
+class EventMetrics:
+    def __init__(self):
+        self.latency_ms = Histogram(LATENCY_BUCKETS_MS)
+        self.sql_statements = Histogram(SIZE_BUCKETS)
+        self.sql_ms = 0.0
+        self.errors = 0
+        self.emits = 0
+        self.emit_bytes = 0
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "latency_ms": self.latency_ms.snapshot(),
+            "sql_statements": self.sql_statements.snapshot(),
+            "sql_ms": round(self.sql_ms, 3),
+            "errors": self.errors,
+            "emits": self.emits,
+            "emit_bytes": self.emit_bytes,
+        }
+
+
+class EmitMetrics:
+    def __init__(self):
+        self.payload_bytes = Histogram(PAYLOAD_BUCKETS)
+        self.fanout = Histogram(SIZE_BUCKETS)
+        self.sent_bytes = 0
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "payload_bytes": self.payload_bytes.snapshot(),
+            "fanout": self.fanout.snapshot(),
+            "sent_bytes": self.sent_bytes,
+        }
+
+
+class Instrumentation:
+    def __init__(self):
+        self.enabled = True
+        self._lock = threading.Lock()
+        self._events: Dict[Tuple[str, str], EventMetrics] = {}
+        self._emits: Dict[str, EmitMetrics] = {}
+        self.sql_ms = Histogram(LATENCY_BUCKETS_MS)
+
+    def configure(self, config) -> None:
+        self.enabled = bool(config.get("INSTRUMENTATION", True))
+
+    def init_app(self, app) -> None:
+        app.before_request(_start_request)
+        app.teardown_request(_finish_request)
+
+    def _event_metrics(self, kind: str, name: str) -> EventMetrics:
+        metrics = self._events.get((kind, name))
+        if metrics is None:
+            with self._lock:
+                metrics = self._events.setdefault((kind, name), EventMetrics())
+        return metrics
+
+    def _emit_metrics(self, name: str) -> EmitMetrics:
+        metrics = self._emits.get(name)
+        if metrics is None:
+            with self._lock:
+                metrics = self._emits.setdefault(name, EmitMetrics())
+        return metrics
+
+    def begin(self, kind: str, name: str) -> Optional[EventRecord]:
+        if not self.enabled:
+            return None
+        return EventRecord(kind, name)
+
+    def finish(self, record: EventRecord, failed: bool = False) -> float:
+        elapsed_ms = record.elapsed_ms()
+        if record.profile is not None:
+            profiler.stop(record.profile, record.kind, record.name, elapsed_ms)
+        metrics = self._event_metrics(record.kind, record.name)
+        metrics.latency_ms.observe(elapsed_ms)
+        metrics.sql_statements.observe(record.sql_count)
+        metrics.sql_ms += record.sql_ms
+        metrics.errors += int(failed)
+        metrics.emits += record.emits
+        metrics.emit_bytes += record.emit_bytes
+        slow_events.observe(record.kind, record.name, elapsed_ms, record.sql_count, record.statements)
+        return elapsed_ms
+
+    def record_statement(self, statement: str, elapsed_ms: float) -> None:
+        self.sql_ms.observe(elapsed_ms)
+        record = _current.get()
+        if record is not None:
+            record.sql_count += 1
+            record.sql_ms += elapsed_ms
+            if record.statements is not None and len(record.statements) < MAX_STATEMENTS:
+                record.statements.append((statement, elapsed_ms))
+
+    def record_emit(self, name: str, payload_bytes: int, recipients: int, sent_bytes: int) -> None:
+        metrics = self._emit_metrics(name)
+        metrics.payload_bytes.observe(payload_bytes)
+        metrics.fanout.observe(recipients)
+        metrics.sent_bytes += sent_bytes
+        record = _current.get()
+        if record is not None:
+            record.emits += 1
+            record.emit_bytes += sent_bytes
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            events = sorted(self._events.items())
+            emits = sorted(self._emits.items())
+        snapshot: Dict[str, Any] = {"enabled": self.enabled, SOCKET: {}, HTTP: {}}
+        for (kind, name), metrics in events:
+            snapshot[kind][name] = metrics.snapshot()
+        snapshot["emits"] = {name: metrics.snapshot() for name, metrics in emits}
+        snapshot["sql_ms"] = self.sql_ms.snapshot()
+        return snapshot
+
+    def prometheus(self) -> str:
+        """Render every metric in the Prometheus text exposition format (version 0.0.4)."""
+
+        with self._lock:
+            events = sorted(self._events.items())
+            emits = sorted(self._emits.items())
+        lines: List[str] = []
+
+        def family(name: str, kind: str, help_text: str) -> None:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        family("novatalk_event_duration_seconds", "histogram", "Handler and request latency.")
+        for (kind, name), metrics in events:
+            _histogram_lines(
+                lines, "novatalk_event_duration_seconds", {"kind": kind, "event": name}, metrics.latency_ms, 0.001
+            )
+        family("novatalk_event_sql_statements", "histogram", "SQL statements issued per handler call.")
+        for (kind, name), metrics in events:
+            _histogram_lines(lines, "novatalk_event_sql_statements", {"kind": kind, "event": name}, metrics.sql_statements)
+        family("novatalk_event_sql_seconds_total", "counter", "Time spent in SQL statements per handler.")
+        for (kind, name), metrics in events:
+            lines.append(_sample("novatalk_event_sql_seconds_total", {"kind": kind, "event": name}, metrics.sql_ms / 1000))
+        family("novatalk_event_errors_total", "counter", "Handler calls that raised.")
+        for (kind, name), metrics in events:
+            lines.append(_sample("novatalk_event_errors_total", {"kind": kind, "event": name}, metrics.errors))
+        family("novatalk_event_emitted_bytes_total", "counter", "Bytes emitted by each handler, across all recipients.")
+        for (kind, name), metrics in events:
+            lines.append(_sample("novatalk_event_emitted_bytes_total", {"kind": kind, "event": name}, metrics.emit_bytes))
+        family("novatalk_sql_statement_duration_seconds", "histogram", "Duration of individual SQL statements.")
+        _histogram_lines(lines, "novatalk_sql_statement_duration_seconds", {}, self.sql_ms, 0.001)
+        family("novatalk_emit_payload_bytes", "histogram", "Encoded size of emitted Socket.IO events.")
+        for name, metrics in emits:
+            _histogram_lines(lines, "novatalk_emit_payload_bytes", {"event": name}, metrics.payload_bytes)
+        family("novatalk_emit_fanout", "histogram", "Recipients per emitted Socket.IO event.")
+        for name, metrics in emits:
+            _histogram_lines(lines, "novatalk_emit_fanout", {"event": name}, metrics.fanout)
+        family("novatalk_emit_sent_bytes_total", "counter", "Bytes sent for each Socket.IO event, across all recipients.")
+        for name, metrics in emits:
+            lines.append(_sample("novatalk_emit_sent_bytes_total", {"event": name}, metrics.sent_bytes))
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _number(value: float) -> str:
+    return str(value) if isinstance(value, int) else repr(float(value))
+
+
+def _sample(name: str, labels: Dict[str, str], value: float) -> str:
+    if labels:
+        rendered = ",".join(f'{key}="{_escape(str(label))}"' for key, label in labels.items())
+        return f"{name}{{{rendered}}} {_number(value)}"
+    return f"{name} {_number(value)}"
+
+
+def _histogram_lines(
+    lines: List[str], name: str, labels: Dict[str, str], histogram: Histogram, scale: float = 1.0
+) -> None:
+    snapshot = histogram.snapshot()
+    cumulative = 0
+    for bound, count in zip(list(histogram.buckets) + [None], snapshot["buckets"].values()):
+        cumulative += count
+        le = "+Inf" if bound is None else f"{bound * scale:g}"
+        lines.append(_sample(f"{name}_bucket", {**labels, "le": le}, cumulative))
+    lines.append(_sample(f"{name}_sum", labels, snapshot["sum"] * scale))
+    lines.append(_sample(f"{name}_count", labels, snapshot["count"]))
+
+
+instrumentation = Instrumentation()
+register_stats("instrumentation", instrumentation.snapshot)
+
+
+def _run(record: Optional[EventRecord], handler, args: Iterable[Any]):
+    if record is None:
+        return handler(*args)
+    token = _current.set(record)
+    failed = True
+    try:
+        result = handler(*args)
+        failed = False
+        return result
+    finally:
+        _current.reset(token)
+        instrumentation.finish(record, failed)
+
+
+class InstrumentedSocketIO(SocketIO):
+    """``SocketIO`` that runs every event handler inside an :class:`EventRecord`."""
+
+    def _handle_event(self, handler, message, namespace, sid, *args):
+        def instrumented(*handler_args):
+            return _run(instrumentation.begin(SOCKET, message), handler, handler_args)
+
+        return super()._handle_event(instrumented, message, namespace, sid, *args)
+
+
+def _start_request() -> None:
+    rule = request.url_rule.rule if request.url_rule is not None else "unmatched"
+    record = instrumentation.begin(HTTP, f"{request.method} {rule}")
+    if record is not None:
+        g._instrumentation = (record, _current.set(record))
+
+
+def _finish_request(error: Optional[BaseException]) -> None:
+    started = g.pop("_instrumentation", None)
+    if started is not None:
+        record, token = started
+        _current.reset(token)
+        instrumentation.finish(record, error is not None)
+
+
+class InstrumentedManager(python_socketio.Manager):
+    """Client manager that measures payload size and fan-out of every emit."""
+
+    def emit(self, event, data, namespace, room=None, skip_sid=None, callback=None, **kwargs):
+        if not instrumentation.enabled:
+            return super().emit(event, data, namespace, room=room, skip_sid=skip_sid, callback=callback, **kwargs)
+        recipients = self._recipients(namespace, room, skip_sid)
+        _encoded.size = 0
+        result = super().emit(event, data, namespace, room=room, skip_sid=skip_sid, callback=callback, **kwargs)
+        encoded = _encoded.size
+        if callback:
+            # Each recipient got its own packet carrying a distinct ack id.
+            payload_bytes, sent_bytes = encoded // max(recipients, 1), encoded
+        else:
+            payload_bytes, sent_bytes = encoded, encoded * recipients
+        instrumentation.record_emit(event, payload_bytes, recipients, sent_bytes)
+        return result
+
+    def _recipients(self, namespace, room, skip_sid) -> int:
+        rooms = self.rooms.get(namespace, {})
+        targets = room if isinstance(room, (list, tuple)) else [room]
+        count = sum(len(rooms[target]) for target in targets if target in rooms)
+        skipped = skip_sid if isinstance(skip_sid, list) else [skip_sid]
+        return max(0, count - sum(1 for sid in skipped if sid is not None))
+
+
+def instrument_packets(server) -> None:
+    """Count the encoded size of outgoing events for :class:`InstrumentedManager`."""
+
+    base = server.packet_class
+
+    class InstrumentedPacket(base):
+        def encode(self):
+            encoded = super().encode()
+            if self.packet_type in (packet.EVENT, packet.BINARY_EVENT):
+                parts = encoded if isinstance(encoded, list) else [encoded]
+                _encoded.size = getattr(_encoded, "size", 0) + sum(len(part) for part in parts)
+            return encoded
+
+    InstrumentedPacket.__name__ = f"Instrumented{base.__name__}"
+    server.packet_class = InstrumentedPacket
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+    if instrumentation.enabled:
+        conn.info.setdefault(_STARTED_KEY, []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+    started = conn.info.get(_STARTED_KEY)
+    if started:
+        instrumentation.record_statement(statement, (time.perf_counter() - started.pop()) * 1000)
+
+
+@event.listens_for(Engine, "handle_error")
+def _failed_cursor_execute(context) -> None:
+    connection = context.connection
+    started = connection.info.get(_STARTED_KEY) if connection is not None else None
+    if started:
+        instrumentation.record_statement(context.statement or "", (time.perf_counter() - started.pop()) * 1000)
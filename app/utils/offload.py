@@ -0,0 +1,165 @@
+"""Run CPU-bound calls off the eventlet hub.
+
+Password hashing and decoding large base64 uploads can take tens of
+milliseconds. Under eventlet that time is stolen from every other connected
+socket, so :func:`run_cpu` hands such calls to native threads
+(``eventlet.tpool``), a ``concurrent.futures`` thread or process pool, or runs
+them inline. ``auto`` picks ``tpool`` when the process is monkey-patched and
+``inline`` otherwise, since plain OS threads already run handlers concurrently.
+Blocking file I/O goes through :func:`run_io`, which only needs to leave the
+hub and so always uses ``tpool`` under eventlet and runs inline otherwise.
+Queue wait and run time are recorded per task name.
+"""
+from __future__ import annotations
+
+import base64
+import threading
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from app.utils.metrics import Histogram, register_stats
+
+MODES = ("auto", "inline", "tpool", "thread", "process")
+DEFAULT_WORKERS = 4
+BASE64_INLINE_LIMIT = 64 * 1024
+
+
+def _eventlet_patched() -> bool:
+    try:
+        from eventlet import patcher
+    except ImportError:
+        return False
+    return patcher.is_monkey_patched("thread")
+
+
+def _timed_call(func: Callable[..., Any], args: Tuple[Any, ...], kwargs: Dict[str, Any]):
+    # Wall-clock timestamps so waits measured across a process pool stay comparable.
+    started = time.time()
+    result = func(*args, **kwargs)
+    return started, time.time(), result
+
+
+class CpuOffload:
+    def __init__(self):
+        self.mode = "auto"
+        self.workers = DEFAULT_WORKERS
+        self._resolved: Optional[str] = None
+        self._executor: Optional[Executor] = None
+        self._lock = threading.Lock()
+        self._wait_ms: Dict[str, Histogram] = {}
+        self._run_ms: Dict[str, Histogram] = {}
+
+    def configure(self, config) -> None:
+        mode = str(config.get("CPU_OFFLOAD", "auto")).strip().lower()
+        self.mode = mode if mode in MODES else "auto"
+        self.workers = max(1, config.get("CPU_OFFLOAD_WORKERS", DEFAULT_WORKERS))
+        self.shutdown()
+
+    def resolved_mode(self) -> str:
+        if self._resolved is None:
+            mode = self.mode
+            if mode == "auto":
+                mode = "tpool" if _eventlet_patched() else "inline"
+            if mode == "tpool":
+                from eventlet import tpool
+
+                tpool.set_num_threads(self.workers)
+            self._resolved = mode
+        return self._resolved
+
+    def _get_executor(self) -> Executor:
+        with self._lock:
+            if self._executor is None:
+                if self.resolved_mode() == "process":
+                    self._executor = ProcessPoolExecutor(max_workers=self.workers)
+                else:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=self.workers, thread_name_prefix="cpu-offload"
+                    )
+            return self._executor
+
+    def shutdown(self) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+            self._resolved = None
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+    def run(self, name: str, func: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        """Call ``func(*args, **kwargs)`` according to the configured mode and return its result."""
+
+        mode = self.resolved_mode()
+        queued = time.time()
+        if mode == "inline":
+            started, finished, result = _timed_call(func, args, kwargs)
+        elif mode == "tpool":
+            from eventlet import tpool
+
+            started, finished, result = tpool.execute(_timed_call, func, args, kwargs)
+        else:
+            future = self._get_executor().submit(_timed_call, func, args, kwargs)
+            if _eventlet_patched():
+                # Block a native thread, not the hub, while the pool works.
+                from eventlet import tpool
+
+                started, finished, result = tpool.execute(future.result)
+            else:
+                started, finished, result = future.result()
+        self._record(name, queued, started, finished)
+        return result
+
+    def run_io(self, name: str, func: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        """Call blocking I/O on a native thread when eventlet is patched, inline otherwise."""
+
+        queued = time.time()
+        if _eventlet_patched():
+            from eventlet import tpool
+
+            started, finished, result = tpool.execute(_timed_call, func, args, kwargs)
+        else:
+            started, finished, result = _timed_call(func, args, kwargs)
+        self._record(name, queued, started, finished)
+        return result
+
+    def _record(self, name: str, queued: float, started: float, finished: float) -> None:
+        self._histogram(self._wait_ms, name).observe((started - queued) * 1000)
+        self._histogram(self._run_ms, name).observe((finished - started) * 1000)
+
+    def _histogram(self, table: Dict[str, Histogram], name: str) -> Histogram:
+        histogram = table.get(name)
+        if histogram is None:
+            with self._lock:
+                histogram = table.setdefault(name, Histogram())
+        return histogram
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "mode": self.mode,
+            "resolved_mode": self._resolved,
+            "workers": self.workers,
+            "tasks": {
+                name: {"wait_ms": self._wait_ms[name].snapshot(), "run_ms": histogram.snapshot()}
+                for name, histogram in sorted(self._run_ms.items())
+            },
+        }
+
+
+cpu_offload = CpuOffload()
+register_stats("cpu_offload", cpu_offload.stats)
+
+
+def run_cpu(name: str, func: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    return cpu_offload.run(name, func, *args, **kwargs)
+
+
+def run_io(name: str, func: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    return cpu_offload.run_io(name, func, *args, **kwargs)
+
+
+def b64decode(data: str, validate: bool = False) -> bytes:
+    """``base64.b64decode`` that moves payloads above ``BASE64_INLINE_LIMIT`` off the hub."""
+
+    if len(data) <= BASE64_INLINE_LIMIT:
+        return base64.b64decode(data, validate=validate)
+    return run_cpu("base64_decode", base64.b64decode, data, validate=validate)
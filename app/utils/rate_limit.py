@@ -0,0 +1,267 @@
+"""Token-bucket rate limits for expensive Socket.IO events.
+
+Handlers decorated with :func:`rate_limited` belong to an event class
+(``send``, ``typing``, ``search``, ``forward``, ``initialize``). Each class has
+a bucket per user and a larger one per client IP, configured as
+``class=capacity/seconds`` lists in ``RATE_LIMITS`` and ``RATE_LIMITS_PER_IP``:
+a bucket holds up to ``capacity`` tokens and refills at ``capacity / seconds``
+per second, so short bursts pass and sustained floods are cut to the refill
+rate. An event takes a token from both buckets or from neither; a rejected one
+returns ``{"ok": False, "error": "rate_limited", "retry_after": seconds}``.
+
+Buckets live in process memory unless ``RATE_LIMIT_BACKEND`` names a Redis
+URL, in which case every worker shares them through an atomic Lua script
+(needs the ``redis`` package). If Redis is unreachable, events are allowed and
+``backend_errors`` counts the failures. Allowed and rejected counts per class
+and scope appear under ``rate_limits`` in ``/admin/stats`` and at ``/metrics``.
+"""
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from flask import current_app, request
+from flask_login import current_user
+
+from app.utils.metrics import register_stats
+
+try:
+    import redis
+except ImportError:  # pragma: no cover - optional dependency
+    redis = None
+
+DEFAULT_USER_LIMITS = "send=30/10,typing=30/10,search=20/10,forward=10/30,initialize=6/60"
+DEFAULT_IP_LIMITS = "send=120/10,typing=120/10,search=80/10,forward=40/30,initialize=24/60"
+MAX_BUCKETS = 100000
+REDIS_PREFIX = "novatalk:rl:"
+
+# configure() runs from create_app, outside any app context.
+logger = logging.getLogger(__name__)
+
+# (capacity, tokens per second)
+Limit = Tuple[float, float]
+# (bucket key, scope, limit)
+Check = Tuple[str, str, Limit]
+
+# Takes a token from every bucket in KEYS or from none. ARGV is now followed by
+# a capacity and refill rate per key; returns {allowed, retry_after, blocked index}.
+_TAKE_SCRIPT = """
+local now = tonumber(ARGV[1])
+local levels = {}
+local wait, blocked = 0, 0
+for i, key in ipairs(KEYS) do
+    local capacity = tonumber(ARGV[i * 2])
+    local rate = tonumber(ARGV[i * 2 + 1])
+    local bucket = redis.call('HMGET', key, 'tokens', 'ts')
+    local tokens = tonumber(bucket[1]) or capacity
+    local updated = tonumber(bucket[2]) or now
+    tokens = math.min(capacity, tokens + math.max(0, now - updated) * rate)
+    levels[i] = tokens
+    if tokens < 1 and (1 - tokens) / rate > wait then
+        wait = (1 - tokens) / rate
+        blocked = i
+    end
+end
+if blocked > 0 then
+    return {0, tostring(wait), blocked}
+end
+for i, key in ipairs(KEYS) do
+    local capacity = tonumber(ARGV[i * 2])
+    local rate = tonumber(ARGV[i * 2 + 1])
+    redis.call('HSET', key, 'tokens', tostring(levels[i] - 1), 'ts', tostring(now))
+    redis.call('PEXPIRE', key, math.ceil(capacity / rate * 1000) + 1000)
+end
+return {1, '0', 0}
+"""
+
+
+def parse_limits(value: Any) -> Dict[str, Limit]:
+    """Parse ``"send=30/10,search=20/10"`` into ``{class: (capacity, tokens per second)}``.
+
+    ``class=N`` means N per second; a capacity of ``0`` or ``off`` leaves the
+    class unlimited.
+    """
+
+    limits: Dict[str, Limit] = {}
+    for part in str(value or "").split(","):
+        name, _, spec = part.partition("=")
+        name, spec = name.strip(), spec.strip().lower()
+        if not name or not spec or spec == "off":
+            continue
+        amount, _, seconds = spec.partition("/")
+        try:
+            capacity = float(amount)
+            period = float(seconds) if seconds else 1.0
+        except ValueError:
+            continue
+        if capacity > 0 and period > 0:
+            limits[name] = (capacity, capacity / period)
+    return limits
+
+
+class MemoryBuckets:
+    """Per-process buckets in a bounded LRU; evicted buckets had refilled long ago."""
+
+    def __init__(self, max_size: int = MAX_BUCKETS):
+        self.max_size = max_size
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def take(self, checks: List[Check], now: float) -> Tuple[bool, float, Optional[str]]:
+        with self._lock:
+            levels = []
+            wait, blocked = 0.0, None
+            for key, scope, (capacity, rate) in checks:
+                tokens, updated = self._buckets.get(key, (capacity, now))
+                tokens = min(capacity, tokens + max(0.0, now - updated) * rate)
+                levels.append(tokens)
+                if tokens < 1 and (1 - tokens) / rate > wait:
+                    wait, blocked = (1 - tokens) / rate, scope
+            if blocked is not None:
+                return False, wait, blocked
+            for (key, _, _), tokens in zip(checks, levels):
+                self._buckets[key] = (tokens - 1, now)
+                self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_size:
+                self._buckets.popitem(last=False)
+            return True, 0.0, None
+
+
+class RedisBuckets:
+    """Buckets shared by every worker through one Redis server."""
+
+    def __init__(self, url: str):
+        self.client = redis.Redis.from_url(url)
+        self.script = self.client.register_script(_TAKE_SCRIPT)
+
+    def take(self, checks: List[Check], now: float) -> Tuple[bool, float, Optional[str]]:
+        args: List[Any] = [repr(now)]
+        for _, _, (capacity, rate) in checks:
+            args.extend([repr(capacity), repr(rate)])
+        allowed, wait, blocked = self.script(keys=[REDIS_PREFIX + key for key, _, _ in checks], args=args)
+        if allowed:
+            return True, 0.0, None
+        return False, float(wait), checks[int(blocked) - 1][1]
+
+
+class RateLimiter:
+    def __init__(self):
+        self.enabled = True
+        self.user_limits: Dict[str, Limit] = parse_limits(DEFAULT_USER_LIMITS)
+        self.ip_limits: Dict[str, Limit] = parse_limits(DEFAULT_IP_LIMITS)
+        self.backend_name = "memory"
+        self.memory = MemoryBuckets()
+        self.backend: Any = self.memory
+        self.allowed: Dict[str, int] = {}
+        self.rejected: Dict[Tuple[str, str], int] = {}
+        self.backend_errors = 0
+        self._backend_failing = False
+        self._lock = threading.Lock()
+
+    def configure(self, config) -> None:
+        self.enabled = bool(config.get("RATE_LIMITING", True))
+        self.user_limits = parse_limits(config.get("RATE_LIMITS", DEFAULT_USER_LIMITS))
+        self.ip_limits = parse_limits(config.get("RATE_LIMITS_PER_IP", DEFAULT_IP_LIMITS))
+        url = (config.get("RATE_LIMIT_BACKEND") or "memory").strip()
+        self.backend, self.backend_name = self.memory, "memory"
+        if url.startswith(("redis://", "rediss://", "unix://")):
+            if redis is None:
+                logger.warning("RATE_LIMIT_BACKEND=%s needs the redis package; using memory.", url)
+            else:
+                self.backend, self.backend_name = RedisBuckets(url), "redis"
+
+    def check(self, event_class: str, user_id: Optional[int], ip: Optional[str]) -> Optional[float]:
+        """Take a token for ``event_class``; return seconds to wait if the event is over limit."""
+
+        if not self.enabled:
+            return None
+        checks: List[Check] = []
+        if user_id is not None and event_class in self.user_limits:
+            checks.append((f"{event_class}:user:{user_id}", "user", self.user_limits[event_class]))
+        if ip and event_class in self.ip_limits:
+            checks.append((f"{event_class}:ip:{ip}", "ip", self.ip_limits[event_class]))
+        if not checks:
+            return None
+        try:
+            allowed, wait, scope = self.backend.take(checks, time.time())
+            self._backend_failing = False
+        except Exception:
+            self.backend_errors += 1
+            if not self._backend_failing:
+                self._backend_failing = True
+                current_app.logger.exception("Rate limit backend failed; allowing events until it recovers.")
+            allowed, wait, scope = True, 0.0, None
+        with self._lock:
+            if allowed:
+                self.allowed[event_class] = self.allowed.get(event_class, 0) + 1
+            else:
+                key = (event_class, scope or "user")
+                self.rejected[key] = self.rejected.get(key, 0) + 1
+        return None if allowed else round(max(wait, 0.001), 3)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            allowed = dict(self.allowed)
+            rejected = dict(self.rejected)
+        return {
+            "enabled": self.enabled,
+            "backend": self.backend_name,
+            "buckets": len(self.memory),
+            "backend_errors": self.backend_errors,
+            "limits": {
+                "user": {name: {"capacity": capacity, "per_second": rate} for name, (capacity, rate) in self.user_limits.items()},
+                "ip": {name: {"capacity": capacity, "per_second": rate} for name, (capacity, rate) in self.ip_limits.items()},
+            },
+            "allowed": allowed,
+            "rejected": {f"{event_class}:{scope}": count for (event_class, scope), count in sorted(rejected.items())},
+        }
+
+    def prometheus(self) -> str:
+        from app.utils.instrumentation import _sample
+
+        with self._lock:
+            allowed = sorted(self.allowed.items())
+            rejected = sorted(self.rejected.items())
+        lines = [
+            "# HELP novatalk_rate_limit_allowed_total Rate-limited events let through.",
+            "# TYPE novatalk_rate_limit_allowed_total counter",
+        ]
+        lines.extend(_sample("novatalk_rate_limit_allowed_total", {"class": name}, count) for name, count in allowed)
+        lines.append("# HELP novatalk_rate_limit_rejected_total Events rejected as over limit.")
+        lines.append("# TYPE novatalk_rate_limit_rejected_total counter")
+        lines.extend(
+            _sample("novatalk_rate_limit_rejected_total", {"class": name, "scope": scope}, count)
+            for (name, scope), count in rejected
+        )
+        lines.append("# HELP novatalk_rate_limit_backend_errors_total Rate limit checks that failed open.")
+        lines.append("# TYPE novatalk_rate_limit_backend_errors_total counter")
+        lines.append(_sample("novatalk_rate_limit_backend_errors_total", {}, self.backend_errors))
+        return "\n".join(lines) + "\n"
+
+
+rate_limiter = RateLimiter()
+register_stats("rate_limits", rate_limiter.stats)
+
+
+def rate_limited(event_class: str) -> Callable[[Callable[..., Any]], Callable[..., Any]]:
+    """Reject calls to the decorated socket handler once its user or IP is over limit."""
+
+    def decorator(handler: Callable[..., Any]) -> Callable[..., Any]:
+        @wraps(handler)
+        def wrapper(*args, **kwargs):
+            user_id = current_user.id if current_user.is_authenticated else None
+            retry_after = rate_limiter.check(event_class, user_id, request.remote_addr)
+            if retry_after is not None:
+                return {"ok": False, "error": "rate_limited", "retry_after": retry_after}
+            return handler(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,146 @@
+"""Read-replica routing for ``db.session``.
+
+When ``DATABASE_READ_URL`` is set, the app registers it as the ``replica``
+bind. Code wrapped in :func:`replica_reads` sends its ``SELECT`` statements
+there; everything else, including flushes and any statement issued after the
+current transaction has written, stays on the primary. After a user commits a
+write, their reads stick to the primary for ``DATABASE_READ_STICKY_SECONDS``
+so they always see what they just wrote despite replication lag. Stickiness is
+tracked per process.
+"""
+from __future__ import annotations
+
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional
+
+from flask import has_app_context, has_request_context
+from flask_login import current_user
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+
+from app.utils.cache import TTLCache
+from app.utils.metrics import register_stats
+
+REPLICA_BIND = "replica"
+DEFAULT_STICKY_SECONDS = 5.0
+STICKY_USERS = 100000
+
+_ROUTE_KEY = "read_replica"
+_WROTE_KEY = "read_replica_wrote"
+_INCIDENTAL_KEY = "read_replica_incidental"
+
+_sticky_users = TTLCache(STICKY_USERS, DEFAULT_STICKY_SECONDS)
+_counters = {"replica_queries": 0, "sticky_reads": 0}
+
+
+class RoutingSession(Session):
+    """Session that sends ``SELECT`` statements to the replica inside :func:`replica_reads`."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if (
+            bind is None
+            and self.info.get(_ROUTE_KEY)
+            and not self.info.get(_WROTE_KEY)
+            and getattr(clause, "is_select", False)
+        ):
+            engine = self._db.engines.get(REPLICA_BIND)
+            if engine is not None:
+                _counters["replica_queries"] += 1
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def configure(config) -> None:
+    _sticky_users.ttl = float(config.get("DATABASE_READ_STICKY_SECONDS", DEFAULT_STICKY_SECONDS))
+
+
+def _current_user_id() -> Optional[int]:
+    if not has_request_context():
+        return None
+    try:
+        return int(current_user.get_id()) if current_user.is_authenticated else None
+    except (TypeError, ValueError):
+        return None
+
+
+@contextmanager
+def replica_reads() -> Iterator[None]:
+    """Route reads in this block to the replica unless the current user just wrote."""
+
+    from app import db
+
+    session = db.session()
+    user_id = _current_user_id()
+    if REPLICA_BIND not in db.engines or session.info.get(_ROUTE_KEY):
+        yield
+        return
+    if user_id is not None and _sticky_users.get(user_id):
+        _counters["sticky_reads"] += 1
+        yield
+        return
+    session.info[_ROUTE_KEY] = True
+    try:
+        yield
+    finally:
+        session.info.pop(_ROUTE_KEY, None)
+
+
+def incidental_write() -> None:
+    """Keep the pending commit from pinning the current user to the primary.
+
+    For bookkeeping writes such as ``last_seen`` that the user never reads back.
+    """
+
+    from app import db
+
+    db.session.info[_INCIDENTAL_KEY] = True
+
+
+@event.listens_for(Session, "after_flush")
+def _record_flush(session, _) -> None:
+    session.info[_WROTE_KEY] = True
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _record_dml(state) -> None:
+    if state.is_insert or state.is_update or state.is_delete:
+        state.session.info[_WROTE_KEY] = True
+
+
+@event.listens_for(Session, "after_commit")
+def _stick_writer(session) -> None:
+    wrote = session.info.pop(_WROTE_KEY, False)
+    incidental = session.info.pop(_INCIDENTAL_KEY, False)
+    if wrote and not incidental:
+        user_id = _current_user_id()
+        if user_id is not None:
+            _sticky_users.put(user_id, True)
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_writes(session) -> None:
+    session.info.pop(_WROTE_KEY, None)
+    session.info.pop(_INCIDENTAL_KEY, None)
+
+
+def _pool_stats(engine) -> Dict[str, Any]:
+    pool = engine.pool
+    stats: Dict[str, Any] = {"class": type(pool).__name__, "status": pool.status()}
+    for name in ("size", "checkedin", "checkedout", "overflow"):
+        method = getattr(pool, name, None)
+        if callable(method):
+            stats[name] = method()
+    return stats
+
+
+def database_stats() -> Dict[str, Any]:
+    from app import db
+
+    pools = {}
+    if has_app_context():
+        for key, engine in db.engines.items():
+            pools[key or "primary"] = _pool_stats(engine)
+    return {"pools": pools, "sticky_users": len(_sticky_users), **_counters}
+
+
+register_stats("database", database_stats)
@@ -0,0 +1,115 @@
+"""Payload encoding for Socket.IO packets and inline page state.
+
+This module is a drop-in for the stdlib ``json`` module (``dumps``/``loads``)
+that encodes with orjson when it is installed and the call uses no options
+orjson lacks, and falls back to the stdlib otherwise. :func:`socketio_options`
+hands it to the ``SocketIO`` instance as its json module together with
+:class:`JSONPacket`, or switches the server to the MessagePack parser when
+``SOCKETIO_SERIALIZER`` is ``msgpack`` and the ``msgpack`` package is
+available. The chosen parser is exposed to templates so browsers load the
+matching Socket.IO client build.
+"""
+from __future__ import annotations
+
+import json as _stdlib_json
+import sys
+from typing import Any, Dict, Tuple
+
+from socketio import packet
+
+from app.utils.metrics import register_stats
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack  # noqa: F401
+except ImportError:
+    msgpack = None
+
+SERIALIZERS = ("auto", "json", "orjson", "msgpack")
+
+# Keyword arguments the orjson path reproduces; anything else goes to the stdlib.
+_COMPATIBLE_KWARGS = {"separators", "ensure_ascii"}
+
+_counters = {"fast": 0, "fallback": 0}
+_fast_enabled = orjson is not None
+
+
+def dumps(obj: Any, **kwargs: Any) -> str:
+    if _fast_enabled and _COMPATIBLE_KWARGS.issuperset(kwargs):
+        try:
+            encoded = orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode()
+        except TypeError:
+            # Integers beyond 64 bits and other types orjson rejects.
+            pass
+        else:
+            _counters["fast"] += 1
+            return encoded
+    _counters["fallback"] += 1
+    return _stdlib_json.dumps(obj, **kwargs)
+
+
+def loads(data: Any, **kwargs: Any) -> Any:
+    if _fast_enabled and not kwargs:
+        return orjson.loads(data)
+    return _stdlib_json.loads(data, **kwargs)
+
+
+def set_fast_path(enabled: bool) -> None:
+    global _fast_enabled
+    _fast_enabled = enabled and orjson is not None
+
+
+class JSONPacket(packet.Packet):
+    """Socket.IO packet whose binary check is one orjson pass.
+
+    The stock check walks the whole payload in Python, which costs more than
+    encoding it. orjson rejects ``bytes``, so a clean encode proves there are no
+    binary attachments; otherwise the stock walk decides.
+    """
+
+    def _data_is_binary(self, data: Any) -> bool:
+        if _fast_enabled and isinstance(data, (list, dict)):
+            try:
+                orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS)
+            except TypeError:
+                pass
+            else:
+                return False
+        return super()._data_is_binary(data)
+
+
+def socketio_options(mode: str) -> Tuple[Dict[str, Any], str]:
+    """Return ``SocketIO.init_app`` options for ``mode`` and the client parser name.
+
+    ``auto`` uses orjson when installed. ``msgpack`` without the ``msgpack``
+    package degrades to JSON.
+    """
+
+    mode = (mode or "auto").strip().lower()
+    if mode not in SERIALIZERS:
+        mode = "auto"
+    set_fast_path(mode != "json")
+    options: Dict[str, Any] = {"json": sys.modules[__name__]}
+    if mode == "msgpack" and msgpack is not None:
+        options["serializer"] = "msgpack"
+        return options, "msgpack"
+    if _fast_enabled:
+        options["serializer"] = JSONPacket
+    return options, "default"
+
+
+def serialization_stats() -> Dict[str, Any]:
+    return {
+        "orjson": orjson is not None,
+        "msgpack": msgpack is not None,
+        "fast_path": _fast_enabled,
+        "fast_encodes": _counters["fast"],
+        "fallback_encodes": _counters["fallback"],
+    }
+
+
+register_stats("serialization", serialization_stats)
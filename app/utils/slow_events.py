@@ -0,0 +1,188 @@
+"""Slow-event log and on-demand sampling profiler.
+
+Handlers and requests measured by :mod:`app.utils.instrumentation` keep the
+SQL statements they issue while ``SLOW_EVENT_MS`` is set. One that runs longer
+than that is logged with its name, user, duration and statements, together
+with any N+1 pattern: a statement template (literals and ``IN`` lists
+collapsed) repeated more than ``SLOW_EVENT_REPEAT_THRESHOLD`` times. The most
+recent reports are kept under ``slow_events`` in ``/admin/stats``.
+
+Administrators can turn on :class:`SamplingProfiler` at ``/admin/profiler``.
+It runs ``cProfile`` on the given percentage of events, one at a time per
+process, and writes a ``.pstats`` file per sample to ``PROFILE_DIR``; load it
+with :mod:`pstats` or convert it to a flame graph with ``flameprof``. Under
+eventlet the profile also covers greenlets that ran while the sampled handler
+was waiting on I/O.
+"""
+from __future__ import annotations
+
+import cProfile
+import os
+import random
+import re
+import threading
+import time
+from collections import Counter, deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from flask import current_app
+
+from app.utils.metrics import register_stats
+from app.utils.replica import _current_user_id
+
+DEFAULT_SLOW_MS = 1000
+DEFAULT_REPEAT_THRESHOLD = 5
+MAX_STATEMENTS = 200
+RECENT_REPORTS = 50
+
+_WHITESPACE = re.compile(r"\s+")
+_PLACEHOLDER_LIST = re.compile(r"\(\s*(?:\?|%s|%\(\w+\)s|:\w+)(?:\s*,\s*(?:\?|%s|%\(\w+\)s|:\w+))*\s*\)")
+_LITERAL = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_UNSAFE_NAME = re.compile(r"[^\w.-]+")
+
+Statement = Tuple[str, float]
+
+
+def statement_template(statement: str) -> str:
+    """Collapse literals and placeholder lists so repeats of one query compare equal."""
+
+    template = _WHITESPACE.sub(" ", statement).strip()
+    template = _LITERAL.sub("?", template)
+    return _PLACEHOLDER_LIST.sub("(?)", template)
+
+
+def repeated_templates(statements: List[Statement], threshold: int) -> List[Dict[str, Any]]:
+    counts: Counter = Counter()
+    total_ms: Dict[str, float] = {}
+    for statement, elapsed_ms in statements:
+        template = statement_template(statement)
+        counts[template] += 1
+        total_ms[template] = total_ms.get(template, 0.0) + elapsed_ms
+    return [
+        {"template": template, "count": count, "total_ms": round(total_ms[template], 3)}
+        for template, count in counts.most_common()
+        if count > threshold
+    ]
+
+
+class SlowEventLog:
+    def __init__(self):
+        self.threshold_ms = DEFAULT_SLOW_MS
+        self.repeat_threshold = DEFAULT_REPEAT_THRESHOLD
+        self.logged = 0
+        self._recent: Deque[Dict[str, Any]] = deque(maxlen=RECENT_REPORTS)
+
+    def configure(self, config) -> None:
+        self.threshold_ms = max(0, config.get("SLOW_EVENT_MS", DEFAULT_SLOW_MS))
+        self.repeat_threshold = max(1, config.get("SLOW_EVENT_REPEAT_THRESHOLD", DEFAULT_REPEAT_THRESHOLD))
+
+    @property
+    def capturing(self) -> bool:
+        return self.threshold_ms > 0
+
+    def observe(
+        self, kind: str, name: str, elapsed_ms: float, sql_count: int, statements: Optional[List[Statement]]
+    ) -> None:
+        if not self.capturing or elapsed_ms < self.threshold_ms:
+            return
+        statements = statements or []
+        report = {
+            "at": time.time(),
+            "kind": kind,
+            "event": name,
+            "user_id": _current_user_id(),
+            "duration_ms": round(elapsed_ms, 3),
+            "sql_count": sql_count,
+            "sql_ms": round(sum(elapsed for _, elapsed in statements), 3),
+            "statements": [
+                {"sql": _WHITESPACE.sub(" ", statement).strip(), "ms": round(elapsed, 3)}
+                for statement, elapsed in statements
+            ],
+            "n_plus_one": repeated_templates(statements, self.repeat_threshold),
+        }
+        self.logged += 1
+        self._recent.append(report)
+        lines = [
+            f"Slow {kind} event {name!r}: {elapsed_ms:.1f} ms, user {report['user_id']}, "
+            f"{sql_count} statements in {report['sql_ms']:.1f} ms"
+        ]
+        for pattern in report["n_plus_one"]:
+            lines.append(f"  N+1: {pattern['count']}x ({pattern['total_ms']:.1f} ms) {pattern['template']}")
+        for statement in report["statements"]:
+            lines.append(f"  {statement['ms']:8.2f} ms  {statement['sql']}")
+        if sql_count > len(statements):
+            lines.append(f"  ... {sql_count - len(statements)} more statements not captured")
+        current_app.logger.warning("\n".join(lines))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "threshold_ms": self.threshold_ms,
+            "repeat_threshold": self.repeat_threshold,
+            "logged": self.logged,
+            "recent": [
+                {key: value for key, value in report.items() if key != "statements"} for report in self._recent
+            ],
+        }
+
+
+class SamplingProfiler:
+    """Profiles a random share of events with ``cProfile``, one event at a time."""
+
+    def __init__(self):
+        self.enabled = False
+        self.sample_percent = 0.0
+        self.directory = ""
+        self.samples = 0
+        self.skipped_busy = 0
+        self._busy = threading.Lock()
+
+    def configure(self, config) -> None:
+        self.directory = config.get("PROFILE_DIR", "")
+
+    def set(self, enabled: bool, sample_percent: Optional[float] = None) -> None:
+        if sample_percent is not None:
+            self.sample_percent = min(100.0, max(0.0, float(sample_percent)))
+        self.enabled = bool(enabled) and self.sample_percent > 0 and bool(self.directory)
+
+    def start(self) -> Optional[cProfile.Profile]:
+        if not self.enabled or random.random() * 100 >= self.sample_percent:
+            return None
+        if not self._busy.acquire(blocking=False):
+            # cProfile hooks the whole thread, so overlapping samples would corrupt each other.
+            self.skipped_busy += 1
+            return None
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            self._busy.release()
+            return None
+        return profile
+
+    def stop(self, profile: cProfile.Profile, kind: str, name: str, elapsed_ms: float) -> None:
+        profile.disable()
+        self._busy.release()
+        safe_name = _UNSAFE_NAME.sub("_", name).strip("_") or "event"
+        filename = f"{time.strftime('%Y%m%d-%H%M%S')}-{kind}-{safe_name}-{int(elapsed_ms)}ms-{os.getpid()}.pstats"
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            profile.dump_stats(os.path.join(self.directory, filename))
+        except OSError:
+            current_app.logger.exception("Failed to write profile %s.", filename)
+            return
+        self.samples += 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "sample_percent": self.sample_percent,
+            "directory": self.directory,
+            "samples": self.samples,
+            "skipped_busy": self.skipped_busy,
+        }
+
+
+slow_events = SlowEventLog()
+profiler = SamplingProfiler()
+register_stats("slow_events", slow_events.stats)
+register_stats("profiler", profiler.stats)
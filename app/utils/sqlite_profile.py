@@ -0,0 +1,154 @@
+"""Performance profile for SQLite deployments.
+
+Every new SQLite connection gets ``utf8mb4_unicode_ci`` registered (the
+messages table declares it for MySQL) and, unless ``SQLITE_PROFILE`` is off,
+the pragmas below: WAL journaling so readers never wait for the writer,
+``synchronous=NORMAL`` (durable at checkpoints, one fsync per checkpoint rather
+than per commit), a memory-mapped I/O window, a busy timeout and a larger page
+cache.
+
+SQLite allows one writer at a time. Instead of letting concurrent write
+transactions collide and retry inside ``busy_timeout``, sessions queue on an
+in-process writer gate from their first write until their transaction ends;
+reads never touch it.
+"""
+from __future__ import annotations
+
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from app.utils.metrics import Histogram, register_stats
+
+DEFAULT_BUSY_TIMEOUT_MS = 5000
+DEFAULT_CACHE_MB = 64
+DEFAULT_MMAP_MB = 256
+WRITE_GATE_TIMEOUT = 30.0
+
+_HELD_KEY = "sqlite_write_gate"
+
+
+def _unicode_ci(left: str, right: str) -> int:
+    left, right = left.casefold(), right.casefold()
+    return (left > right) - (left < right)
+
+
+def _eventlet_unpatched() -> bool:
+    # Greenlets on an unpatched hub would block the whole process on a native lock.
+    from app import socketio
+    from app.utils.offload import _eventlet_patched
+
+    return getattr(socketio, "async_mode", None) == "eventlet" and not _eventlet_patched()
+
+
+class SQLiteProfile:
+    """Connection pragmas plus the writer gate for SQLite engines."""
+
+    def __init__(self):
+        self.enabled = False
+        self.busy_timeout_ms = DEFAULT_BUSY_TIMEOUT_MS
+        self.cache_mb = DEFAULT_CACHE_MB
+        self.mmap_mb = DEFAULT_MMAP_MB
+        self.serialize_writes = False
+        self._gate = threading.Lock()
+        self.waiting = 0
+        self.write_transactions = 0
+        self.gate_timeouts = 0
+        self.wait_ms = Histogram()
+        self.hold_ms = Histogram()
+
+    def configure(self, config) -> None:
+        is_sqlite = str(config.get("SQLALCHEMY_DATABASE_URI", "")).startswith("sqlite")
+        self.enabled = is_sqlite and bool(config.get("SQLITE_PROFILE", True))
+        self.busy_timeout_ms = config.get("SQLITE_BUSY_TIMEOUT_MS", DEFAULT_BUSY_TIMEOUT_MS)
+        self.cache_mb = config.get("SQLITE_CACHE_MB", DEFAULT_CACHE_MB)
+        self.mmap_mb = config.get("SQLITE_MMAP_MB", DEFAULT_MMAP_MB)
+        mode = str(config.get("SQLITE_SERIALIZE_WRITES", "auto")).strip().lower()
+        if mode == "auto":
+            self.serialize_writes = self.enabled and not _eventlet_unpatched()
+        else:
+            self.serialize_writes = is_sqlite and mode in {"1", "true", "yes", "on"}
+
+    def apply_pragmas(self, connection: sqlite3.Connection) -> None:
+        connection.create_collation("utf8mb4_unicode_ci", _unicode_ci)
+        if not self.enabled:
+            return
+        cursor = connection.cursor()
+        try:
+            cursor.execute("PRAGMA journal_mode=WAL")
+            cursor.execute("PRAGMA synchronous=NORMAL")
+            cursor.execute(f"PRAGMA busy_timeout={int(self.busy_timeout_ms)}")
+            cursor.execute(f"PRAGMA cache_size=-{int(self.cache_mb) * 1024}")
+            cursor.execute(f"PRAGMA mmap_size={int(self.mmap_mb) * 1024 * 1024}")
+        finally:
+            cursor.close()
+
+    def acquire_writer(self, session: Session) -> None:
+        if not self.serialize_writes or _HELD_KEY in session.info:
+            return
+        queued = time.monotonic()
+        self.waiting += 1
+        try:
+            acquired = self._gate.acquire(timeout=WRITE_GATE_TIMEOUT)
+        finally:
+            self.waiting -= 1
+        now = time.monotonic()
+        self.wait_ms.observe((now - queued) * 1000)
+        if not acquired:
+            # Fall back to SQLite's own locking rather than failing the write.
+            self.gate_timeouts += 1
+            session.info[_HELD_KEY] = None
+            return
+        self.write_transactions += 1
+        session.info[_HELD_KEY] = now
+
+    def release_writer(self, session: Session) -> None:
+        if _HELD_KEY not in session.info:
+            return
+        acquired_at: Optional[float] = session.info.pop(_HELD_KEY)
+        if acquired_at is not None:
+            self.hold_ms.observe((time.monotonic() - acquired_at) * 1000)
+            self._gate.release()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "serialize_writes": self.serialize_writes,
+            "waiting_writers": self.waiting,
+            "write_transactions": self.write_transactions,
+            "gate_timeouts": self.gate_timeouts,
+            "wait_ms": self.wait_ms.snapshot(),
+            "hold_ms": self.hold_ms.snapshot(),
+        }
+
+
+sqlite_profile = SQLiteProfile()
+register_stats("sqlite", sqlite_profile.stats)
+
+
+@event.listens_for(Engine, "connect")
+def _configure_connection(dbapi_connection, _) -> None:
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        sqlite_profile.apply_pragmas(dbapi_connection)
+
+
+@event.listens_for(Session, "before_flush")
+def _gate_flush(session: Session, *_) -> None:
+    sqlite_profile.acquire_writer(session)
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _gate_statement(state) -> None:
+    if state.is_insert or state.is_update or state.is_delete:
+        sqlite_profile.acquire_writer(state.session)
+
+
+@event.listens_for(Session, "after_transaction_end")
+def _release_gate(session: Session, transaction) -> None:
+    if transaction.parent is None:
+        sqlite_profile.release_writer(session)
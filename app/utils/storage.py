@@ -1,13 +1,18 @@
+import os
 import secrets
 import shutil
 from pathlib import Path
-from typing import Optional
+from typing import Optional, Tuple
 
 from flask import current_app
 from werkzeug.datastructures import FileStorage
 from werkzeug.utils import secure_filename
 
+from app.utils.offload import run_io
+
 ALLOWED_IMAGE_EXTENSIONS = {"png", "jpg", "jpeg", "gif", "webp"}
+# Uploads written on the request path and moved into place by a job; never served.
+STAGING_CATEGORY = "staging"
 
 
 def _random_filename(filename: str) -> str:
@@ -16,6 +21,60 @@ def _random_filename(filename: str) -> str:
     return f"{random_hex}_{name}"
 
 
+def new_avatar_filename(name: str) -> str:
+    extension = Path(name).suffix.lower().strip(".")
+    if extension not in ALLOWED_IMAGE_EXTENSIONS:
+        raise ValueError("Unsupported file type for avatar.")
+    return _random_filename(name)
+
+
+def _write_bytes(upload_dir: Path, path: Path, data: bytes) -> None:
+    upload_dir.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(data)
+
+
+def _save_storage(upload_dir: Path, file: FileStorage, path: Path) -> None:
+    upload_dir.mkdir(parents=True, exist_ok=True)
+    file.save(path)
+
+
+def _move(upload_dir: Path, source: Path, target: Path) -> bool:
+    upload_dir.mkdir(parents=True, exist_ok=True)
+    try:
+        os.replace(source, target)
+    except FileNotFoundError:
+        # Already moved by an earlier attempt of the same job.
+        return target.exists()
+    return True
+
+
+def _unlink(path: Path) -> None:
+    try:
+        path.unlink()
+    except OSError:
+        pass
+
+
+def write_upload(category: str, filename: str, data: bytes) -> None:
+    upload_dir = Path(current_app.config["UPLOAD_FOLDER"]) / category
+    run_io("file_write", _write_bytes, upload_dir, upload_dir / secure_filename(Path(filename).name), data)
+
+
+def stage_upload(data: bytes) -> str:
+    """Write ``data`` to the staging folder and return its name for :func:`promote_staged`."""
+    name = secrets.token_hex(16)
+    write_upload(STAGING_CATEGORY, name, data)
+    return name
+
+
+def promote_staged(staged: str, category: str, filename: str) -> bool:
+    """Move a staged upload into ``category`` as ``filename``; False if it no longer exists."""
+    root = Path(current_app.config["UPLOAD_FOLDER"])
+    source = root / STAGING_CATEGORY / secure_filename(staged)
+    target = root / category / secure_filename(Path(filename).name)
+    return run_io("file_move", _move, root / category, source, target)
+
+
 def save_avatar(file: FileStorage, existing_filename: Optional[str] = None) -> Optional[str]:
     if not file:
         return None
@@ -32,9 +91,7 @@ def save_avatar(file: FileStorage, existing_filename: Optional[str] = None) -> O
     if not filename:
         filename = _random_filename(file.filename)
     upload_dir = Path(current_app.config["UPLOAD_FOLDER"]) / "avatars"
-    upload_dir.mkdir(parents=True, exist_ok=True)
-    file_path = upload_dir / filename
-    file.save(file_path)
+    run_io("file_write", _save_storage, upload_dir, file, upload_dir / filename)
     return filename
 
 
@@ -48,13 +105,12 @@ def save_message_image(file: FileStorage) -> Optional[str]:
 
     filename = _random_filename(file.filename)
     upload_dir = Path(current_app.config["UPLOAD_FOLDER"]) / "messages"
-    upload_dir.mkdir(parents=True, exist_ok=True)
-    file_path = upload_dir / filename
-    file.save(file_path)
+    run_io("file_write", _save_storage, upload_dir, file, upload_dir / filename)
     return filename
 
 
-def duplicate_message_file(filename: str) -> str:
+def plan_message_copy(filename: str) -> Tuple[str, str]:
+    """Check that ``filename`` exists and return ``(source, copy_name)`` for a later copy."""
     if not filename:
         raise ValueError("Filename required.")
     sanitized = secure_filename(Path(filename).name)
@@ -62,21 +118,22 @@ def duplicate_message_file(filename: str) -> str:
         raise ValueError("Filename required.")
 
     upload_dir = Path(current_app.config["UPLOAD_FOLDER"]) / "messages"
-    source_path = upload_dir / sanitized
-    if not source_path.exists():
+    if not (upload_dir / sanitized).exists():
         raise FileNotFoundError(f"Source attachment {sanitized} is missing.")
+    return sanitized, _random_filename(sanitized)
 
-    copy_name = _random_filename(sanitized)
-    destination = upload_dir / copy_name
-    shutil.copy2(source_path, destination)
+
+def copy_message_file(source: str, copy_name: str) -> None:
+    upload_dir = Path(current_app.config["UPLOAD_FOLDER"]) / "messages"
+    run_io("file_copy", shutil.copy2, upload_dir / secure_filename(source), upload_dir / secure_filename(copy_name))
+
+
+def duplicate_message_file(filename: str) -> str:
+    source, copy_name = plan_message_copy(filename)
+    copy_message_file(source, copy_name)
     return copy_name
 
 
 def remove_file(category: str, filename: str) -> None:
     folder = Path(current_app.config["UPLOAD_FOLDER"]) / category
-    file_path = folder / filename
-    if file_path.exists():
-        try:
-            file_path.unlink()
-        except OSError:
-            pass
+    run_io("file_remove", _unlink, folder / filename)
@@ -0,0 +1,315 @@
+"""Per-process cache behind ``login_manager.user_loader``.
+
+Every HTTP request and Socket.IO event that touches ``current_user`` used to
+load the user row (and its avatar on first use of ``avatar_url``). The cache
+keeps a detached copy of each recently seen user with its avatar for
+``USER_CACHE_TTL`` seconds; :func:`load_user` merges that copy into the
+current session with ``load=False``, so no SQL runs and relationships still
+lazy-load as usual.
+
+Any flushed change to a user's columns, or to its avatar row, drops the entry
+at flush and again after commit, which covers ``me:update``, the profile page,
+password changes and the CLI commands in their own process. Updates that only
+touch ``last_seen`` and ``online`` (every request refreshes them) are written
+into the cached copy instead of evicting it. Other processes see a change once
+their copy expires, so keep the TTL short. Hits and misses appear under
+``user_cache`` in ``/admin/stats``.
+
+:data:`user_cards` keeps the serialized public card (``User.to_public_dict``)
+of each user under a version counter that the same invalidations bump, so a
+card is built once per change instead of once per message, member or friend.
+``online`` and ``last_seen`` are not part of the stored card; they are laid
+over it from the live row, or from the copy the presence updates keep current.
+:meth:`UserCardCache.get_cards` serves a batch of ids and loads every miss,
+with its avatar, in one query. Counters appear under ``user_cards``.
+"""
+from __future__ import annotations
+
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Optional, Set, Tuple
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session, joinedload, make_transient_to_detached, object_session
+from sqlalchemy.orm.attributes import set_committed_value
+
+from app import db
+from app.models import Avatar, User
+from app.utils.cache import TTLCache
+from app.utils.datetime import to_utc_iso
+from app.utils.metrics import register_stats
+
+DEFAULT_SIZE = 10000
+DEFAULT_TTL = 30.0
+DEFAULT_CARD_SIZE = 50000
+DEFAULT_CARD_TTL = 300.0
+PRESENCE_FIELDS = frozenset({"last_seen", "online"})
+
+_PENDING_KEY = "user_cache_evictions"
+
+
+def _detached_copy(user: User) -> User:
+    copy = User(**{key: getattr(user, key) for key in inspect(User).column_attrs.keys()})
+    avatar = user.avatar
+    if avatar is not None:
+        avatar_copy = Avatar(id=avatar.id, filename=avatar.filename, created_at=avatar.created_at)
+        make_transient_to_detached(avatar_copy)
+        copy.avatar = avatar_copy
+    make_transient_to_detached(copy)
+    return copy
+
+
+class UserCache:
+    def __init__(self, max_size: int = DEFAULT_SIZE, ttl: float = DEFAULT_TTL):
+        self.enabled = ttl > 0
+        self._users = TTLCache(max_size, ttl)
+        # avatar id -> user id, so avatar-only updates can find the entry to drop.
+        self._avatar_owners: Dict[int, int] = {}
+        self._lock = threading.Lock()
+
+    def configure(self, config) -> None:
+        ttl = float(config.get("USER_CACHE_TTL", DEFAULT_TTL))
+        self.enabled = ttl > 0
+        self._users = TTLCache(max(1, int(config.get("USER_CACHE_SIZE", DEFAULT_SIZE))), ttl)
+        with self._lock:
+            self._avatar_owners.clear()
+
+    def load(self, user_id: int) -> Optional[User]:
+        session = db.session
+        key = session.identity_key(User, user_id)
+        if key in session.identity_map:
+            return session.identity_map[key]
+        if self.enabled:
+            cached = self._users.get(user_id)
+            if cached is not None:
+                return session.merge(cached, load=False)
+        user = session.get(User, user_id)
+        if user is not None and self.enabled:
+            self._store(user)
+        return user
+
+    def _store(self, user: User) -> None:
+        copy = _detached_copy(user)
+        self._users.put(user.id, copy)
+        self.remember_avatar(user.avatar_id, user.id)
+
+    def discard(self, user_id: int) -> None:
+        self._users.discard(user_id)
+
+    def discard_avatar(self, avatar_id: int) -> Optional[int]:
+        with self._lock:
+            user_id = self._avatar_owners.pop(avatar_id, None)
+        if user_id is not None:
+            self.discard(user_id)
+        return user_id
+
+    def remember_avatar(self, avatar_id: Optional[int], user_id: int) -> None:
+        if avatar_id is not None:
+            with self._lock:
+                self._avatar_owners[avatar_id] = user_id
+
+    def refresh_presence(self, user: User) -> None:
+        cached = self._users.peek(user.id)
+        if cached is not None:
+            for key in PRESENCE_FIELDS:
+                set_committed_value(cached, key, getattr(user, key))
+
+    def clear(self) -> None:
+        self._users.clear()
+        with self._lock:
+            self._avatar_owners.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {"enabled": self.enabled, "ttl": self._users.ttl, **self._users.stats()}
+
+
+user_cache = UserCache()
+register_stats("user_cache", user_cache.stats)
+
+
+def _card_fields(user: User) -> Dict[str, Any]:
+    return {
+        "id": user.id,
+        "display_name": user.display_name,
+        "username": user.username,
+        "avatar": user.avatar_url,
+        "bio": user.bio,
+    }
+
+
+def _presence(user: User) -> Tuple[Any, Optional[str]]:
+    return user.online, to_utc_iso(user.last_seen)
+
+
+def _has_pending_profile_changes(user: User) -> bool:
+    state = inspect(user)
+    return state.modified and not set(state.committed_state) <= PRESENCE_FIELDS
+
+
+class UserCardCache:
+    """Serialized public user cards, keyed by user id and checked against a version."""
+
+    def __init__(self, max_size: int = DEFAULT_CARD_SIZE, ttl: float = DEFAULT_CARD_TTL):
+        self.enabled = ttl > 0
+        self.max_size = max_size
+        # user id -> (version, card without presence, (online, last_seen))
+        self._cards = TTLCache(max_size, ttl)
+        self._versions: "OrderedDict[int, int]" = OrderedDict()
+        self._next_version = 0
+        self.bumps = 0
+        self.built = 0
+        self._lock = threading.Lock()
+
+    def configure(self, config) -> None:
+        ttl = float(config.get("USER_CARD_TTL", DEFAULT_CARD_TTL))
+        self.enabled = ttl > 0
+        self.max_size = max(1, int(config.get("USER_CARD_SIZE", DEFAULT_CARD_SIZE)))
+        self._cards = TTLCache(self.max_size, ttl)
+        with self._lock:
+            self._versions.clear()
+
+    def version(self, user_id: int) -> int:
+        with self._lock:
+            return self._versions.get(user_id, 0)
+
+    def bump(self, user_id: int) -> None:
+        """Invalidate the card of ``user_id``, including one being built right now."""
+
+        with self._lock:
+            self._next_version += 1
+            self._versions[user_id] = self._next_version
+            self._versions.move_to_end(user_id)
+            while len(self._versions) > self.max_size:
+                # A forgotten version reads as 0, which no card stored before the bump carries.
+                self._cards.discard(self._versions.popitem(last=False)[0])
+            self.bumps += 1
+        self._cards.discard(user_id)
+
+    def _lookup(self, user_id: int) -> Optional[Tuple[int, Dict[str, Any], Tuple[Any, Optional[str]]]]:
+        entry = self._cards.get(user_id)
+        if entry is None or entry[0] != self.version(user_id):
+            return None
+        return entry
+
+    def _build(self, user: User, version: int) -> Dict[str, Any]:
+        fields = _card_fields(user)
+        self.built += 1
+        if self.enabled:
+            self._cards.put(user.id, (version, fields, _presence(user)))
+            user_cache.remember_avatar(user.avatar_id, user.id)
+        return fields
+
+    def card(self, user: User) -> Dict[str, Any]:
+        """Return the public card of a loaded ``user`` with its current presence."""
+
+        online, last_seen = _presence(user)
+        if user.id is None or not self.enabled or _has_pending_profile_changes(user):
+            fields = _card_fields(user)
+        else:
+            entry = self._lookup(user.id)
+            fields = entry[1] if entry is not None else self._build(user, self.version(user.id))
+        return {**fields, "online": online, "last_seen": last_seen}
+
+    def get_cards(self, user_ids: Iterable[Optional[int]]) -> Dict[int, Dict[str, Any]]:
+        """Return ``{user id: card}`` for the known ids; misses are loaded in one query."""
+
+        session = db.session
+        cards: Dict[int, Dict[str, Any]] = {}
+        missing: Dict[int, int] = {}
+        for user_id in user_ids:
+            if user_id is None or user_id in cards or user_id in missing:
+                continue
+            loaded = session.identity_map.get(session.identity_key(User, user_id))
+            # An expired row would refresh itself with a query; the cached presence is enough.
+            if loaded is not None and PRESENCE_FIELDS.isdisjoint(inspect(loaded).unloaded):
+                cards[user_id] = self.card(loaded)
+                continue
+            entry = self._lookup(user_id) if self.enabled else None
+            if entry is None:
+                missing[user_id] = self.version(user_id)
+                continue
+            online, last_seen = entry[2]
+            cards[user_id] = {**entry[1], "online": online, "last_seen": last_seen}
+        if missing:
+            for user in User.query.options(joinedload(User.avatar)).filter(User.id.in_(missing)):
+                online, last_seen = _presence(user)
+                cards[user.id] = {**self._build(user, missing[user.id]), "online": online, "last_seen": last_seen}
+        return cards
+
+    def get_card(self, user_id: Optional[int]) -> Optional[Dict[str, Any]]:
+        return self.get_cards([user_id]).get(user_id) if user_id is not None else None
+
+    def refresh_presence(self, user: User) -> None:
+        entry = self._cards.peek(user.id)
+        if entry is not None:
+            self._cards.put(user.id, (entry[0], entry[1], _presence(user)))
+
+    def clear(self) -> None:
+        self._cards.clear()
+        with self._lock:
+            self._versions.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "ttl": self._cards.ttl,
+            "versions": len(self._versions),
+            "bumps": self.bumps,
+            "built": self.built,
+            **self._cards.stats(),
+        }
+
+
+user_cards = UserCardCache()
+register_stats("user_cards", user_cards.stats)
+
+
+def load_user(user_id: Any) -> Optional[User]:
+    try:
+        return user_cache.load(int(user_id))
+    except (TypeError, ValueError):
+        return None
+
+
+def _queue_eviction(target: Any, user_id: Optional[int]) -> None:
+    if user_id is None:
+        return
+    user_cache.discard(user_id)
+    user_cards.bump(user_id)
+    session = object_session(target)
+    if session is not None:
+        evictions: Set[int] = session.info.setdefault(_PENDING_KEY, set())
+        evictions.add(user_id)
+
+
+@event.listens_for(User, "after_update")
+def _forget_changed_user(_, __, target: User) -> None:
+    state = inspect(target)
+    changed = {key for key in state.mapper.column_attrs.keys() if getattr(state.attrs, key).history.has_changes()}
+    if changed and changed <= PRESENCE_FIELDS:
+        user_cache.refresh_presence(target)
+        user_cards.refresh_presence(target)
+        return
+    _queue_eviction(target, target.id)
+
+
+@event.listens_for(User, "after_delete")
+def _forget_deleted_user(_, __, target: User) -> None:
+    _queue_eviction(target, target.id)
+
+
+@event.listens_for(Avatar, "after_update")
+@event.listens_for(Avatar, "after_delete")
+def _forget_avatar_owner(_, __, target: Avatar) -> None:
+    _queue_eviction(target, user_cache.discard_avatar(target.id))
+
+
+@event.listens_for(Session, "after_commit")
+@event.listens_for(Session, "after_rollback")
+def _evict_settled(session: Session) -> None:
+    # After commit, a concurrent load between the flush and the commit may have
+    # cached the old row; after rollback, a card may have been built from the
+    # flushed changes that never landed.
+    for user_id in session.info.pop(_PENDING_KEY, ()):
+        user_cache.discard(user_id)
+        user_cards.bump(user_id)
@@ -0,0 +1,129 @@
+"""Threshold-based permessage-deflate for the eventlet WebSocket transport.
+
+Eventlet compresses every frame once a client offers ``permessage-deflate``,
+including the many tiny frames (acks, typing, pings) where zlib costs more CPU
+than it saves. With this module installed, the extension is negotiated only
+when ``WS_COMPRESSION`` is on and frames shorter than
+``WS_COMPRESSION_THRESHOLD`` bytes go out uncompressed; RFC 7692 sets the
+compression bit per message, so clients need no changes. Raw and on-the-wire
+bytes are counted per Socket.IO event name.
+"""
+from __future__ import annotations
+
+import re
+import threading
+from typing import Any, Dict, Optional
+
+from app.utils.metrics import register_stats
+
+try:
+    from engineio.async_drivers.eventlet import WebSocketWSGI as _EventletWebSocketWSGI
+    from eventlet.websocket import RFC6455WebSocket
+except ImportError:
+    _EventletWebSocketWSGI = None
+    RFC6455WebSocket = None
+
+DEFAULT_THRESHOLD = 1024
+
+# Engine.IO message (4) carrying a Socket.IO event (2/5) or ack (3/6).
+_FRAME = re.compile(r'4([2-6])(?:\d+-)?(?:/[^,]*,)?\d*(?:\["((?:[^"\\]){1,64})")?')
+
+
+def _event_name(message: Any) -> str:
+    if isinstance(message, str):
+        match = _FRAME.match(message, 0, 96)
+        if match:
+            if match.group(1) in "36":
+                return "ack"
+            return match.group(2) or "event"
+        return "engineio"
+    return "binary"
+
+
+class WebSocketCompression:
+    def __init__(self):
+        self.enabled = True
+        self.threshold = DEFAULT_THRESHOLD
+        self.installed = False
+        self._lock = threading.Lock()
+        self._events: Dict[str, Dict[str, int]] = {}
+
+    def configure(self, config) -> None:
+        self.enabled = bool(config.get("WS_COMPRESSION", True))
+        self.threshold = max(0, config.get("WS_COMPRESSION_THRESHOLD", DEFAULT_THRESHOLD))
+
+    def install(self, server) -> bool:
+        """Swap the Engine.IO websocket handler of ``server`` for the thresholded one."""
+
+        if _EventletWebSocketWSGI is None or getattr(server, "async_mode", None) != "eventlet":
+            return False
+        server._async = {**server._async, "websocket": ThresholdWebSocketWSGI}
+        self.installed = True
+        return True
+
+    def record(self, message: Any, raw_bytes: int, sent_bytes: int, compressed: bool) -> None:
+        name = _event_name(message)
+        with self._lock:
+            entry = self._events.setdefault(
+                name, {"frames": 0, "compressed_frames": 0, "raw_bytes": 0, "sent_bytes": 0}
+            )
+            entry["frames"] += 1
+            entry["compressed_frames"] += int(compressed)
+            entry["raw_bytes"] += raw_bytes
+            entry["sent_bytes"] += sent_bytes
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            events = {
+                name: {**entry, "bytes_saved": entry["raw_bytes"] - entry["sent_bytes"]}
+                for name, entry in sorted(self._events.items())
+            }
+        return {
+            "enabled": self.enabled,
+            "installed": self.installed,
+            "threshold": self.threshold,
+            "events": events,
+        }
+
+
+websocket_compression = WebSocketCompression()
+register_stats("websocket", websocket_compression.stats)
+
+
+if _EventletWebSocketWSGI is not None:
+
+    class ThresholdWebSocket(RFC6455WebSocket):
+        """Skips the deflate step for frames below the configured threshold."""
+
+        _skip_deflate = False
+
+        def _get_permessage_deflate_enc(self):
+            if self._skip_deflate:
+                return None
+            return super()._get_permessage_deflate_enc()
+
+        def _pack_message(self, message, masked=False, continuation=False, final=True, control_code=None):
+            if control_code:
+                return super()._pack_message(message, masked, continuation, final, control_code)
+            raw = message.encode("utf-8") if isinstance(message, str) else bytes(message)
+            compress = "permessage-deflate" in self.extensions and len(raw) >= websocket_compression.threshold
+            self._skip_deflate = not compress
+            try:
+                packed = super()._pack_message(message, masked, continuation, final, control_code)
+            finally:
+                self._skip_deflate = False
+            websocket_compression.record(message, len(raw), len(packed), compress)
+            return packed
+
+    class ThresholdWebSocketWSGI(_EventletWebSocketWSGI):
+        def _negotiate_permessage_deflate(self, extensions) -> Optional[Dict[str, Any]]:
+            if not websocket_compression.enabled:
+                return None
+            return super()._negotiate_permessage_deflate(extensions)
+
+        def _handle_hybi_request(self, environ):
+            ws = super()._handle_hybi_request(environ)
+            if type(ws) is RFC6455WebSocket:
+                # Eventlet builds the socket object itself; adopt it into the subclass.
+                ws.__class__ = ThresholdWebSocket
+            return ws
@@ -2,11 +2,18 @@
 
 from __future__ import annotations
 
+import time
+
 import click
 from sqlalchemy import func
 
 from app import create_app, db
+from app.models.chat import Chat, ChatMember
+from app.models.job import Job
+from app.models.message import Message
 from app.models.user import User
+from app.search import rebuild_message_index, search_messages
+from app.utils.identity import find_user_by_email, find_user_by_username
 
 app = create_app()
 
@@ -28,9 +35,9 @@ def add_user(username: str, email: str, password: str, display_name: str | None)
     if not display_name:
         display_name = username
     with app.app_context():
-        if User.query.filter(func.lower(User.username).in_([username, f"@{username}"])).first():
+        if find_user_by_username(username):
             raise click.ClickException(f"Username '{username}' already exists")
-        if User.query.filter(func.lower(User.email) == email).first():
+        if find_user_by_email(email):
             raise click.ClickException(f"Email '{email}' is already registered")
         user = User(username=username, email=email, display_name=display_name, bio="")
         user.set_password(password)
@@ -46,7 +53,7 @@ def set_password(username: str, password: str):
     """Update a user's password."""
     username = username.strip().lower().lstrip("@")
     with app.app_context():
-        user = User.query.filter(func.lower(User.username).in_([username, f"@{username}"])).first()
+        user = find_user_by_username(username)
         if not user:
             raise click.ClickException(f"User '{username}' was not found")
         user.set_password(password)
@@ -60,12 +67,453 @@ def delete_user(username: str):
     """Delete a NovaTalk user."""
     username = username.strip().lower().lstrip("@")
     with app.app_context():
-        user = User.query.filter(func.lower(User.username).in_([username, f"@{username}"])).first()
+        user = find_user_by_username(username)
         if not user:
             raise click.ClickException(f"User '{username}' was not found")
         db.session.delete(user)
         db.session.commit()
         click.secho(f"User '{username}' has been deleted.", fg="yellow")
 
+
+@cli.command("backfill-seq")
+@click.option("--batch-size", default=1000, show_default=True, help="Messages updated per statement batch")
+def backfill_seq(batch_size: int):
+    """Number existing messages per chat and reset each chat's sequence counter."""
+    with app.app_context():
+        chat_ids = [chat_id for (chat_id,) in db.session.query(Chat.id).order_by(Chat.id)]
+        numbered = 0
+        for chat_id in chat_ids:
+            message_ids = [
+                message_id
+                for (message_id,) in db.session.query(Message.id)
+                .filter(Message.chat_id == chat_id)
+                .order_by(Message.created_at.asc(), Message.id.asc())
+            ]
+            # Clear first so renumbering never collides with the unique (chat_id, seq) index.
+            Message.query.filter(Message.chat_id == chat_id).update({"seq": None}, synchronize_session=False)
+            for offset in range(0, len(message_ids), batch_size):
+                chunk = message_ids[offset : offset + batch_size]
+                db.session.bulk_update_mappings(
+                    Message,
+                    [{"id": message_id, "seq": offset + index + 1} for index, message_id in enumerate(chunk)],
+                )
+            Chat.query.filter(Chat.id == chat_id).update({"last_seq": len(message_ids)}, synchronize_session=False)
+            db.session.commit()
+            numbered += len(message_ids)
+        click.secho(f"Numbered {numbered} messages across {len(chat_ids)} chats", fg="green")
+
+
+@cli.command("search-reindex")
+def search_reindex():
+    """Rebuild the full-text message search index."""
+    with app.app_context():
+        started = time.perf_counter()
+        indexed = rebuild_message_index()
+        elapsed = time.perf_counter() - started
+        click.secho(f"Indexed {indexed} messages in {elapsed:.2f}s", fg="green")
+
+
+@cli.command("search-benchmark")
+@click.option("--query", "queries", multiple=True, required=True, help="Search text (repeatable)")
+@click.option("--username", required=False, help="Search as this user (defaults to the busiest member)")
+@click.option("--iterations", default=50, show_default=True, help="Runs per query")
+def search_benchmark(queries: tuple, username: str | None, iterations: int):
+    """Measure message search latency against the configured database."""
+    with app.app_context():
+        if username:
+            username = username.strip().lower().lstrip("@")
+            user = find_user_by_username(username)
+            if not user:
+                raise click.ClickException(f"User '{username}' was not found")
+            user_id = user.id
+        else:
+            user_id = (
+                db.session.query(ChatMember.user_id)
+                .group_by(ChatMember.user_id)
+                .order_by(func.count(ChatMember.id).desc())
+                .limit(1)
+                .scalar()
+            )
+            if user_id is None:
+                raise click.ClickException("No chat members to search as")
+        total = db.session.execute(db.text("SELECT COUNT(*) FROM messages")).scalar()
+        click.echo(f"messages={total} user_id={user_id} iterations={iterations}")
+        for query in queries:
+            timings = []
+            hits = 0
+            for _ in range(max(1, iterations)):
+                started = time.perf_counter()
+                hits = len(search_messages(user_id, query)["hits"])
+                timings.append((time.perf_counter() - started) * 1000)
+            timings.sort()
+            p50 = timings[len(timings) // 2]
+            p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+            click.echo(f"{query!r}: hits={hits} p50={p50:.2f}ms p95={p95:.2f}ms max={timings[-1]:.2f}ms")
+
+
+@cli.command("cpu-benchmark")
+@click.option("--logins", default=40, show_default=True, help="Concurrent password checks per run")
+@click.option(
+    "--mode",
+    "modes",
+    multiple=True,
+    type=click.Choice(["inline", "tpool", "thread", "process"]),
+    default=("inline", "tpool"),
+    show_default=True,
+    help="Offload mode to measure (repeatable)",
+)
+@click.option("--workers", default=4, show_default=True, help="Offload pool size")
+def cpu_benchmark(logins: int, modes: tuple, workers: int):
+    """Measure event-loop stalls while a login storm hashes passwords."""
+    import eventlet
+    from werkzeug.security import check_password_hash, generate_password_hash
+
+    from app.utils.offload import cpu_offload, run_cpu
+
+    tick = 0.005
+    password_hash = generate_password_hash("benchmark-password")
+    for mode in modes:
+        cpu_offload.configure({"CPU_OFFLOAD": mode, "CPU_OFFLOAD_WORKERS": workers})
+        lags: list = []
+        running = [True]
+
+        def ticker():
+            # Stands in for message delivery: any delay past the tick is latency other sockets see.
+            while running[0]:
+                expected = time.perf_counter() + tick
+                eventlet.sleep(tick)
+                lags.append(max(0.0, (time.perf_counter() - expected) * 1000))
+
+        def login():
+            run_cpu("password_check", check_password_hash, password_hash, "benchmark-password")
+
+        delivery = eventlet.spawn(ticker)
+        started = time.perf_counter()
+        pool = eventlet.GreenPool(max(1, logins))
+        for _ in range(max(1, logins)):
+            pool.spawn(login)
+        pool.waitall()
+        elapsed = time.perf_counter() - started
+        running[0] = False
+        delivery.wait()
+        lags.sort()
+        if not lags:
+            lags = [elapsed * 1000]
+        p50 = lags[len(lags) // 2]
+        p99 = lags[min(len(lags) - 1, int(len(lags) * 0.99))]
+        click.echo(
+            f"{mode:<8} logins={logins} total={elapsed:.2f}s "
+            f"delivery_lag p50={p50:.1f}ms p99={p99:.1f}ms max={lags[-1]:.1f}ms"
+        )
+    cpu_offload.shutdown()
+
+
+@cli.command("sqlite-benchmark")
+@click.option("--writers", default=8, show_default=True, help="Concurrent sending threads")
+@click.option("--readers", default=2, show_default=True, help="Concurrent history readers")
+@click.option("--messages", default=200, show_default=True, help="Messages sent by each writer")
+@click.option("--work-ms", default=1.0, show_default=True, help="Handler work between a send's flush and commit")
+def sqlite_benchmark(writers: int, readers: int, messages: int, work_ms: float):
+    """Compare message throughput with SQLite defaults and with the tuned profile."""
+    import random
+    import tempfile
+    import threading
+
+    from sqlalchemy.exc import OperationalError
+
+    from app.utils.sqlite_profile import sqlite_profile
+
+    writers, readers, messages = max(1, writers), max(0, readers), max(1, messages)
+    profiles = (
+        ("default", {"SQLITE_PROFILE": False, "SQLITE_SERIALIZE_WRITES": "off"}),
+        ("tuned", {"SQLITE_PROFILE": True, "SQLITE_SERIALIZE_WRITES": "on"}),
+    )
+    for label, overrides in profiles:
+        with tempfile.TemporaryDirectory() as workdir:
+            settings = {
+                "SQLALCHEMY_DATABASE_URI": f"sqlite:///{workdir}/benchmark.db",
+                "SQLALCHEMY_BINDS": {},
+                **overrides,
+            }
+            bench_app = create_app(type("BenchmarkConfig", (), settings))
+            with bench_app.app_context():
+                db.create_all()
+                chat_ids = []
+                for index in range(writers):
+                    sender = User(username=f"bench{index}", email=f"bench{index}@example.com", display_name=f"Bench {index}")
+                    sender.password_hash = "!"
+                    chat = Chat(name=f"bench{index}", is_group=True)
+                    db.session.add_all([sender, chat])
+                    db.session.flush()
+                    db.session.add(ChatMember(chat_id=chat.id, user_id=sender.id))
+                    chat_ids.append((chat.id, sender.id))
+                db.session.commit()
+
+            lock = threading.Lock()
+            totals = {"sent": 0, "locked": 0, "reads": 0, "read_errors": 0}
+            send_ms: list = []
+            writing = [True]
+
+            def send(index: int) -> None:
+                chat_id, sender_id = chat_ids[index]
+                with bench_app.app_context():
+                    for number in range(messages):
+                        started = time.perf_counter()
+                        try:
+                            chat = db.session.get(Chat, chat_id)
+                            db.session.add(
+                                Message(
+                                    chat_id=chat_id,
+                                    sender_id=sender_id,
+                                    seq=chat.allocate_seq(),
+                                    body=f"benchmark message {number}",
+                                )
+                            )
+                            db.session.flush()
+                            time.sleep(work_ms / 1000)
+                            db.session.commit()
+                        except OperationalError:
+                            db.session.rollback()
+                            with lock:
+                                totals["locked"] += 1
+                            continue
+                        with lock:
+                            totals["sent"] += 1
+                            send_ms.append((time.perf_counter() - started) * 1000)
+                    db.session.remove()
+
+            def read() -> None:
+                with bench_app.app_context():
+                    while writing[0]:
+                        chat_id = random.choice(chat_ids)[0]
+                        try:
+                            Message.query.filter_by(chat_id=chat_id).order_by(Message.seq.desc()).limit(50).all()
+                            db.session.commit()
+                        except OperationalError:
+                            db.session.rollback()
+                            totals["read_errors"] += 1
+                            continue
+                        totals["reads"] += 1
+                    db.session.remove()
+
+            reader_threads = [threading.Thread(target=read) for _ in range(readers)]
+            writer_threads = [threading.Thread(target=send, args=(index,)) for index in range(writers)]
+            started = time.perf_counter()
+            for thread in reader_threads + writer_threads:
+                thread.start()
+            for thread in writer_threads:
+                thread.join()
+            elapsed = time.perf_counter() - started
+            writing[0] = False
+            for thread in reader_threads:
+                thread.join()
+            with bench_app.app_context():
+                for engine in db.engines.values():
+                    engine.dispose()
+
+            send_ms.sort()
+            p50 = send_ms[len(send_ms) // 2] if send_ms else 0.0
+            p99 = send_ms[min(len(send_ms) - 1, int(len(send_ms) * 0.99))] if send_ms else 0.0
+            click.echo(
+                f"{label:<8} sent={totals['sent']}/{writers * messages} locked={totals['locked']} "
+                f"{totals['sent'] / elapsed:.0f} msg/s reads={totals['reads'] / elapsed:.0f}/s "
+                f"read_errors={totals['read_errors']} send p50={p50:.1f}ms p99={p99:.1f}ms"
+            )
+    stats = sqlite_profile.stats()
+    click.echo(
+        f"writer gate: transactions={stats['write_transactions']} timeouts={stats['gate_timeouts']} "
+        f"wait p95={stats['wait_ms']['p95']:.1f}ms hold p95={stats['hold_ms']['p95']:.1f}ms"
+    )
+
+
+@cli.command("serializer-benchmark")
+@click.option("--messages", default=200, show_default=True, help="Messages in the history frame")
+@click.option("--senders", default=5, show_default=True, help="Distinct senders in the history frame")
+@click.option("--iterations", default=200, show_default=True, help="Encodes per serializer")
+def serializer_benchmark(messages: int, senders: int, iterations: int):
+    """Compare Socket.IO packet encoders on a chat history frame."""
+    import json
+    from datetime import datetime, timedelta
+
+    from socketio import packet
+
+    from app.chat.routes import _serialize_message
+    from app.utils import serialization
+    from app.utils.datetime import _encode_utc
+
+    now = datetime.utcnow()
+    people = [
+        User(
+            id=index + 1,
+            username=f"member{index}",
+            display_name=f"Member {index} ✨",
+            bio="Product designer. Coffee, climbing and long walks with the dog. " * 2,
+            online=index % 2 == 0,
+            last_seen=now - timedelta(minutes=index),
+        )
+        for index in range(max(1, senders))
+    ]
+    history = []
+    for index in range(max(1, messages)):
+        message = Message(
+            id=index + 1,
+            chat_id=1,
+            seq=index + 1,
+            sender_id=people[index % len(people)].id,
+            body=f"Message {index}: see you at the café around {index % 12 + 1}pm? 👍",
+            created_at=now - timedelta(seconds=messages - index),
+            is_deleted=False,
+        )
+        message.sender = people[index % len(people)]
+        history.append(message)
+
+    def build() -> dict:
+        return {"ok": True, "chat_id": 1, "messages": [_serialize_message(message) for message in history]}
+
+    for label, warm in (("timestamps cold", False), ("timestamps cached", True)):
+        timings = []
+        for _ in range(max(1, iterations)):
+            if not warm:
+                _encode_utc.cache_clear()
+            started = time.perf_counter()
+            frame = build()
+            timings.append((time.perf_counter() - started) * 1000)
+        timings.sort()
+        click.echo(f"{label:<18} build p50={timings[len(timings) // 2]:.2f}ms")
+
+    encoders = [
+        ("stdlib json", packet.Packet, json),
+        ("orjson", packet.Packet, serialization),
+        ("orjson packet", serialization.JSONPacket, serialization),
+    ]
+    try:
+        from socketio.msgpack_packet import MsgPackPacket
+
+        encoders.append(("msgpack", MsgPackPacket, serialization))
+    except ImportError:
+        click.echo("msgpack not installed; skipping")
+    original_json = {packet_class: packet_class.json for _, packet_class, _ in encoders}
+    try:
+        for label, packet_class, json_module in encoders:
+            packet_class.json = json_module
+            serialization.set_fast_path(json_module is serialization)
+            timings = []
+            for _ in range(max(1, iterations)):
+                started = time.perf_counter()
+                encoded = packet_class(packet.EVENT, data=["chat:history", frame]).encode()
+                timings.append((time.perf_counter() - started) * 1000)
+            timings.sort()
+            click.echo(
+                f"{label:<18} encode p50={timings[len(timings) // 2]:.2f}ms "
+                f"p99={timings[min(len(timings) - 1, int(len(timings) * 0.99))]:.2f}ms bytes={len(encoded)}"
+            )
+    finally:
+        for packet_class, json_module in original_json.items():
+            packet_class.json = json_module
+        serialization.set_fast_path(True)
+
+
+@cli.command("jobs")
+@click.option("--status", type=click.Choice(["pending", "running", "done", "failed"]), help="Only list jobs in this state")
+@click.option("--queue", required=False, help="Only list jobs from this queue")
+@click.option("--limit", default=20, show_default=True, help="Number of jobs to list")
+@click.option("--retry-failed", is_flag=True, help="Requeue failed jobs (filtered by --queue) before listing")
+def jobs(status: str | None, queue: str | None, limit: int, retry_failed: bool):
+    """Inspect the background job queue."""
+    with app.app_context():
+        if retry_failed:
+            failed = Job.query.filter(Job.status == "failed")
+            if queue:
+                failed = failed.filter(Job.queue == queue)
+            requeued = failed.update(
+                {"status": "pending", "attempts": 0, "run_at": func.now(), "finished_at": None},
+                synchronize_session=False,
+            )
+            db.session.commit()
+            click.secho(f"Requeued {requeued} failed jobs", fg="green")
+
+        counts = (
+            db.session.query(Job.queue, Job.status, func.count(Job.id))
+            .group_by(Job.queue, Job.status)
+            .order_by(Job.queue, Job.status)
+            .all()
+        )
+        if not counts:
+            click.echo("No jobs recorded.")
+            return
+        for job_queue, job_status, count in counts:
+            click.echo(f"{job_queue:<12} {job_status:<8} {count}")
+
+        listing = Job.query
+        if status:
+            listing = listing.filter(Job.status == status)
+        if queue:
+            listing = listing.filter(Job.queue == queue)
+        click.echo("")
+        for job in listing.order_by(Job.id.desc()).limit(max(1, limit)):
+            line = (
+                f"#{job.id} {job.queue}/{job.name} {job.status} "
+                f"attempts={job.attempts}/{job.max_attempts} run_at={job.run_at:%Y-%m-%d %H:%M:%S}"
+            )
+            if job.last_error:
+                line += f" error={job.last_error}"
+            click.echo(line)
+
+
+@cli.command("seed")
+@click.option("--users", default=1000, show_default=True, help="Users to create")
+@click.option("--messages", default=100000, show_default=True, help="Messages spread across all chats")
+@click.option("--friends", default=20, show_default=True, help="Average friends per user")
+@click.option("--groups", type=int, help="Group chats to create  [default: users / 20]")
+@click.option("--max-group-size", default=200, show_default=True, help="Largest group")
+@click.option("--dm-ratio", default=0.3, show_default=True, help="Share of friend pairs with a direct chat")
+@click.option("--forward-ratio", default=0.02, show_default=True, help="Share of messages that are forwards")
+@click.option("--edit-ratio", default=0.03, show_default=True, help="Share of messages that were edited")
+@click.option("--delete-ratio", default=0.01, show_default=True, help="Share of messages that were deleted")
+@click.option("--attachment-ratio", default=0.005, show_default=True, help="Share of messages with an image")
+@click.option("--pending-requests", type=int, help="Pending friend requests  [default: users / 10]")
+@click.option("--pending-invites", type=int, help="Pending group invites  [default: one per group]")
+@click.option("--days", default=180, show_default=True, help="Days of history ending at --until")
+@click.option("--until", type=click.DateTime(), help="End of the history window (UTC)  [default: today 00:00]")
+@click.option("--zipf", default=1.1, show_default=True, help="Zipf exponent for popularity and chat activity")
+@click.option("--seed", "seed_value", default=1, show_default=True, help="Random seed")
+@click.option("--prefix", default="seed", show_default=True, help="Username prefix for generated users")
+@click.option("--password", default="password123", show_default=True, help="Password for every generated user")
+def seed(seed_value: int, friends: int, **options):
+    """Bulk-generate a deterministic synthetic population for benchmarks."""
+    from app.bench.seed import drop_search_index, generate
+
+    last_report = [0.0]
+
+    def report(table: str, rows: int) -> None:
+        now = time.perf_counter()
+        if now - last_report[0] >= 5:
+            last_report[0] = now
+            click.echo(f"  {table}: {rows} rows")
+
+    with app.app_context():
+        started = time.perf_counter()
+        drop_search_index(db.engine)
+        try:
+            counts = generate(
+                db.engine,
+                app.config["UPLOAD_FOLDER"],
+                avg_friends=friends,
+                seed=seed_value,
+                report=report,
+                **options,
+            )
+        except ValueError as exc:
+            raise click.ClickException(str(exc))
+        generated = time.perf_counter() - started
+        for table, rows in counts.items():
+            click.echo(f"{table:<20} {rows}")
+        click.echo(f"Generated in {generated:.1f}s ({counts['messages'] / max(generated, 1e-9):.0f} messages/s)")
+        indexed = rebuild_message_index()
+        click.secho(
+            f"Indexed {indexed} messages; done in {time.perf_counter() - started:.1f}s", fg="green"
+        )
+
+
 if __name__ == "__main__":
     cli()
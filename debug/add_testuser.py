@@ -6,7 +6,7 @@ sys.path.append(BASE_DIR)
 
 from app import create_app, db
 from app.models.user import User
-from sqlalchemy import func
+from app.utils.identity import find_user_by_email, find_user_by_username
 
 
 app = create_app()
@@ -17,10 +17,10 @@ def create_user(username, email, password, display_name=None):
     if not display_name:
         display_name = username
     with app.app_context():
-        if User.query.filter(func.lower(User.username).in_([username, f"@{username}"])).first():
+        if find_user_by_username(username):
             print(f"sername '{username}' already exists, skipping.")
             return
-        if User.query.filter(func.lower(User.email) == email).first():
+        if find_user_by_email(email):
             print(f"Email '{email}' already registered, skipping.")
             return
         
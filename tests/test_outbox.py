@@ -0,0 +1,60 @@
+"""Outbox dispatch keeps each room's events in the order they were queued."""
+import time
+
+import pytest
+
+from app import create_app, socketio
+from app.chat import outbox
+from app.chat.outbox import OutboxDispatcher
+
+
+def _event(name, room="chat_1", coalesce=False, payload=None):
+    return (name, payload, room, coalesce, time.monotonic())
+
+
+@pytest.fixture
+def emitted(tmp_path, monkeypatch):
+    monkeypatch.setenv("DATABASE_URL", f"sqlite:///{tmp_path / 'app.db'}")
+    monkeypatch.delenv("DATABASE_READ_URL", raising=False)
+    create_app(type("OutboxConfig", (), {"UPLOAD_FOLDER": str(tmp_path / "uploads")}))
+    sent = []
+    monkeypatch.setattr(
+        outbox.socketio, "emit", lambda name, payload, room: sent.append((room, name, payload))
+    )
+    return sent
+
+
+def _dispatcher(max_queue=10):
+    dispatcher = OutboxDispatcher(max_queue=max_queue)
+    # Leave the queue to the test instead of a background task.
+    dispatcher._running = True
+    dispatcher._wakeup = socketio.server.eio.create_event()
+    return dispatcher
+
+
+def test_coalescing_only_merges_adjacent_events(emitted):
+    dispatcher = _dispatcher()
+    dispatcher._emit_batch(
+        [
+            _event("contacts", coalesce=True, payload=1),
+            _event("contacts", coalesce=True, payload=2),
+            _event("new_message", payload=3),
+            _event("message_edit", coalesce=True, payload=4),
+            _event("new_message", payload=5),
+            _event("message_edit", coalesce=True, payload=6),
+        ]
+    )
+    assert [payload for _, _, payload in emitted] == [2, 3, 4, 5, 6]
+    assert dispatcher.coalesced == 1
+
+
+def test_overflow_emits_the_oldest_events_first(emitted):
+    dispatcher = _dispatcher(max_queue=2)
+    dispatcher.enqueue([_event("new_message", payload=1), _event("new_message", room="chat_2", payload=2)])
+    assert emitted == []
+    dispatcher.enqueue([_event("message_edit", payload=3)])
+    assert emitted == [("chat_1", "new_message", 1)]
+    assert dispatcher.overflowed == 1
+
+    dispatcher._emit_batch(list(dispatcher._queue))
+    assert [(room, payload) for room, _, payload in emitted] == [("chat_1", 1), ("chat_2", 2), ("chat_1", 3)]
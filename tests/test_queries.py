@@ -0,0 +1,25 @@
+"""Socket.IO handler statement counts must not grow with the data.
+
+Runs :mod:`app.bench.queries` at two fixture sizes; see its docstring for what
+each case covers.
+"""
+import pytest
+
+from app.bench import queries
+from app.bench.queries import ACCEPTED_GROWTH, CASES, JOB_CASES, growth
+
+SCALES = [4, 12]
+
+
+@pytest.fixture(scope="module")
+def runs():
+    return queries.measure(SCALES)
+
+
+@pytest.mark.parametrize("name", [*CASES, *JOB_CASES])
+def test_statement_count_stays_flat(runs, name):
+    (small, small_failures), (large, large_failures) = runs
+    assert name not in small_failures and name not in large_failures, large_failures.get(name)
+    if name in ACCEPTED_GROWTH:
+        pytest.skip(ACCEPTED_GROWTH[name])
+    assert len(large[name]) <= len(small[name]), growth(small[name], large[name])
@@ -0,0 +1,13 @@
+"""Rate limiter configuration at startup."""
+from app import create_app
+from app.utils import rate_limit
+from app.utils.rate_limit import rate_limiter
+
+
+def test_redis_backend_without_the_package_falls_back_to_memory(tmp_path, monkeypatch, caplog):
+    monkeypatch.setattr(rate_limit, "redis", None)
+    monkeypatch.setenv("DATABASE_URL", f"sqlite:///{tmp_path / 'app.db'}")
+    monkeypatch.setenv("RATE_LIMIT_BACKEND", "redis://localhost:6379/0")
+    create_app(type("RateLimitConfig", (), {"UPLOAD_FOLDER": str(tmp_path / "uploads")}))
+    assert rate_limiter.backend_name == "memory"
+    assert "needs the redis package" in caplog.text
@@ -0,0 +1,74 @@
+"""Read cursor flushes: unread counts derived from seqs and batches kept on failure."""
+from datetime import datetime
+
+import pytest
+
+from app import create_app, db
+from app.chat import read_state
+from app.chat.read_state import ReadCursorBuffer
+from app.models import Chat, ChatMember, User
+
+
+def _add_user(username: str) -> User:
+    user = User(username=username, email=f"{username}@example.com", display_name=username)
+    user.password_hash = "!"
+    db.session.add(user)
+    return user
+
+
+@pytest.fixture
+def chat(tmp_path, monkeypatch):
+    monkeypatch.setenv("DATABASE_URL", f"sqlite:///{tmp_path / 'app.db'}")
+    monkeypatch.delenv("DATABASE_READ_URL", raising=False)
+    app = create_app(type("ReadStateConfig", (), {"UPLOAD_FOLDER": str(tmp_path / "uploads")}))
+    with app.app_context():
+        db.create_all()
+        reader, writer = _add_user("reader"), _add_user("writer")
+        chat = Chat(last_seq=10)
+        db.session.add(chat)
+        db.session.flush()
+        db.session.add_all(
+            [
+                ChatMember(chat_id=chat.id, user_id=reader.id, last_read_seq=2, unread_count=8),
+                ChatMember(chat_id=chat.id, user_id=writer.id, last_read_seq=10),
+            ]
+        )
+        db.session.commit()
+        yield chat.id, reader.id
+        db.session.remove()
+
+
+def _cursor(chat_id: int, user_id: int):
+    member = db.session.query(ChatMember).filter_by(chat_id=chat_id, user_id=user_id).one()
+    db.session.refresh(member)
+    return member.last_read_seq, member.unread_count
+
+
+def test_flush_derives_unread_from_last_seq(chat):
+    chat_id, user_id = chat
+    buffer = ReadCursorBuffer()
+    buffer._pending[(chat_id, user_id)] = (7, datetime.utcnow())
+    buffer.flush()
+    assert _cursor(chat_id, user_id) == (7, 3)
+
+
+def test_failed_flush_keeps_the_batch(chat, monkeypatch):
+    chat_id, user_id = chat
+    buffer = ReadCursorBuffer()
+    buffer._pending[(chat_id, user_id)] = (6, datetime.utcnow())
+    apply_cursor = read_state._apply_cursor
+
+    def failing(*args):
+        raise RuntimeError("database went away")
+
+    monkeypatch.setattr(read_state, "_apply_cursor", failing)
+    with pytest.raises(RuntimeError):
+        buffer.flush()
+    db.session.rollback()
+    assert buffer.pending_seq(chat_id, user_id) == 6
+    assert buffer.stats()["failures"] == 1
+
+    monkeypatch.setattr(read_state, "_apply_cursor", apply_cursor)
+    buffer.flush()
+    assert buffer.pending_seq(chat_id, user_id) is None
+    assert _cursor(chat_id, user_id) == (6, 4)
@@ -0,0 +1,134 @@
+"""Read routing between two SQLite files standing in for a primary and its replica.
+
+The replica is a copy of the primary that still has the user ``replica-only``
+after it was deleted from the primary, so a query's result shows which
+database answered it.
+"""
+import shutil
+import time
+
+import pytest
+from flask_login import login_user
+
+from app import create_app, db
+from app.models import User
+from app.utils import replica
+from app.utils.replica import incidental_write, replica_reads
+
+STICKY_SECONDS = 0.3
+
+
+def _add_user(username: str) -> User:
+    user = User(username=username, email=f"{username}@example.com", display_name=username)
+    user.password_hash = "!"
+    db.session.add(user)
+    return user
+
+
+def _answered_by_replica() -> bool:
+    return User.query.filter_by(username="replica-only").first() is not None
+
+
+@pytest.fixture
+def make_app(tmp_path, monkeypatch):
+    def make(with_replica: bool = True):
+        primary = tmp_path / "primary.db"
+        copy = tmp_path / "replica.db"
+        monkeypatch.setenv("DATABASE_URL", f"sqlite:///{primary}")
+        monkeypatch.setenv("DATABASE_READ_STICKY_SECONDS", str(STICKY_SECONDS))
+        if with_replica:
+            monkeypatch.setenv("DATABASE_READ_URL", f"sqlite:///{copy}")
+        else:
+            monkeypatch.delenv("DATABASE_READ_URL", raising=False)
+        app = create_app(type("ReplicaConfig", (), {"UPLOAD_FOLDER": str(tmp_path / "uploads")}))
+        with app.app_context():
+            db.create_all(bind_key=None)
+            _add_user("probe")
+            _add_user("replica-only")
+            db.session.commit()
+            db.session.remove()
+            for engine in db.engines.values():
+                engine.dispose()
+            shutil.copyfile(primary, copy)
+            User.query.filter_by(username="replica-only").delete()
+            db.session.commit()
+            db.session.remove()
+        replica._sticky_users.clear()
+        return app
+
+    yield make
+    replica._sticky_users.clear()
+
+
+def _as_probe(app):
+    context = app.test_request_context()
+    context.push()
+    login_user(User.query.filter_by(username="probe").one())
+    return context
+
+
+def test_reads_inside_replica_reads_go_to_the_replica(make_app):
+    app = make_app()
+    with app.test_request_context():
+        assert not _answered_by_replica()
+        with replica_reads():
+            assert _answered_by_replica()
+        assert not _answered_by_replica()
+
+
+def test_reads_after_a_write_stay_on_the_primary(make_app):
+    app = make_app()
+    context = _as_probe(app)
+    try:
+        with replica_reads():
+            _add_user("fresh")
+            db.session.flush()
+            assert not _answered_by_replica()
+            assert User.query.filter_by(username="fresh").first() is not None
+        db.session.commit()
+    finally:
+        context.pop()
+
+    # The commit pins probe to the primary for the sticky window.
+    context = _as_probe(app)
+    try:
+        with replica_reads():
+            assert not _answered_by_replica()
+    finally:
+        context.pop()
+
+    time.sleep(STICKY_SECONDS + 0.1)
+    context = _as_probe(app)
+    try:
+        with replica_reads():
+            assert _answered_by_replica()
+    finally:
+        context.pop()
+
+
+def test_incidental_write_does_not_pin_the_user(make_app):
+    app = make_app()
+    context = _as_probe(app)
+    try:
+        probe = User.query.filter_by(username="probe").one()
+        probe.bio = "seen"
+        incidental_write()
+        db.session.commit()
+    finally:
+        context.pop()
+
+    context = _as_probe(app)
+    try:
+        with replica_reads():
+            assert _answered_by_replica()
+    finally:
+        context.pop()
+
+
+def test_without_a_replica_reads_use_the_primary(make_app):
+    app = make_app(with_replica=False)
+    with app.test_request_context():
+        assert "replica" not in db.engines
+        with replica_reads():
+            assert not _answered_by_replica()
+            assert User.query.filter_by(username="probe").first() is not None